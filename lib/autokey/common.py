@@ -17,6 +17,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import json
 import dbus.service
 import logging
 
@@ -84,3 +85,17 @@ class AppService(dbus.service.Object):
     @dbus.service.method(dbus_interface='org.autokey.Service', in_signature='s', out_signature='')
     def run_folder(self, name):
         self.app.service.run_folder(name)
+
+    @dbus.service.method(dbus_interface='org.autokey.Service', in_signature='b', out_signature='')
+    def set_latency_tracing(self, enabled):
+        from autokey.configmanager import ConfigManager, LATENCY_TRACING
+        ConfigManager.SETTINGS[LATENCY_TRACING] = bool(enabled)
+        self.app.service.update_tracing()
+
+    @dbus.service.method(dbus_interface='org.autokey.Service', in_signature='', out_signature='s')
+    def get_latency_statistics(self):
+        """
+        Returns the keystroke latency percentiles of each pipeline stage as a JSON object. See autokey.tracing.
+        """
+        from autokey import tracing
+        return json.dumps(tracing.statistics())
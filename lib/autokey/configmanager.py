@@ -52,6 +52,13 @@ INPUT_SAVINGS = "inputSavings"
 ENABLE_QT4_WORKAROUND = "enableQT4Workaround"
 from .configmanager_constants import INTERFACE_TYPE
 UNDO_USING_BACKSPACE = "undoUsingBackspace"
+XTEST_OUTPUT = "xtestOutput"
+PRE_REMAP_CHARACTERS = "preRemapCharacters"
+ROOT_WINDOW_HOTKEY_GRABS = "rootWindowHotkeyGrabs"
+SINGLE_HOP_INPUT = "singleHopInput"
+LATENCY_TRACING = "latencyTracing"
+WATCH_MACRO_FILES = "watchMacroFiles"
+CONCURRENT_SCRIPT_MACROS = "concurrentScriptMacros"
 WINDOW_DEFAULT_SIZE = "windowDefaultSize"
 HPANE_POSITION = "hPanePosition"
 COLUMN_WIDTHS = "columnWidths"
@@ -369,6 +376,13 @@ class ConfigManager:
                 ENABLE_QT4_WORKAROUND: False,
                 INTERFACE_TYPE: X_RECORD_INTERFACE,
                 UNDO_USING_BACKSPACE: True,
+                XTEST_OUTPUT: False,
+                PRE_REMAP_CHARACTERS: False,
+                ROOT_WINDOW_HOTKEY_GRABS: False,
+                SINGLE_HOP_INPUT: False,
+                LATENCY_TRACING: False,
+                WATCH_MACRO_FILES: False,
+                CONCURRENT_SCRIPT_MACROS: False,
                 WINDOW_DEFAULT_SIZE: (600, 400),
                 HPANE_POSITION: 150,
                 COLUMN_WIDTHS: [150, 50, 100],
@@ -805,7 +819,9 @@ dialog.info_dialog("Window information",
     def config_altered(self, persistGlobal):
         """
         Called when some element of configuration has been altered, to update
-        the lists of phrases/folders. 
+        the lists of phrases/folders. The lock only serializes concurrent
+        rebuilds. The expansion service keeps using the previously published
+        snapshot until the rebuild is complete.
         
         @param persistGlobal: save the global configuration at the end of the process
         """
@@ -839,6 +855,18 @@ dialog.info_dialog("Window information",
         self.globalHotkeys = []
         self.globalHotkeys.append(self.configHotkey)
         self.globalHotkeys.append(self.toggleServiceHotkey)
+
+        # Publish the new state to the keypress handling thread. This is a single, atomic reference assignment.
+        self.snapshot = ConfigSnapshot(
+            tuple(self.globalHotkeys),
+            tuple(self.hotKeys),
+            tuple(self.hotKeyFolders),
+            tuple(self.allFolders),
+            tuple(self.allItems),
+            matcher.AbbreviationIndex(self.allFolders, self.allItems),
+            matcher.HotkeyTable(self.globalHotkeys, self.hotKeys, self.hotKeyFolders),
+            matcher.WindowFilterCache(self.allFolders + self.allItems)
+        )
         #_logger.debug("Global hotkeys: %s", self.globalHotkeys)
         
         #_logger.debug("Hotkey folders: %s", self.hotKeyFolders)
@@ -852,6 +880,43 @@ dialog.info_dialog("Window information",
 
         self.lock.release()
                     
+    def hotkey_created(self, item):
+        """
+        Called when the hotkey of an item, folder or global hotkey was assigned or changed, to update the hotkey
+        dispatch table without rebuilding the whole configuration.
+        """
+        with self.lock:
+            # Copy on write: The keypress handling thread may still be reading the currently published table.
+            hotkeyTable = self.snapshot.hotkeyTable.copy()
+            hotkeyTable.add(item, self.__configurationRanks())
+            self.snapshot = self.snapshot._replace(hotkeyTable=hotkeyTable)
+
+    def hotkey_removed(self, item):
+        """
+        Called when the hotkey of an item, folder or global hotkey is about to be removed or changed.
+        """
+        with self.lock:
+            hotkeyTable = self.snapshot.hotkeyTable.copy()
+            hotkeyTable.remove(item)
+            self.snapshot = self.snapshot._replace(hotkeyTable=hotkeyTable)
+
+    def __configurationRanks(self) -> typing.Dict[typing.Any, int]:
+        """
+        Returns the position of each global hotkey, folder and item in the order config_altered() lists them. Folders
+        come before their sub-folders, and the items of sub-folders come before the items of their parent folder.
+        """
+        entries = [self.configHotkey, self.toggleServiceHotkey]
+
+        def add_folder(folder):
+            entries.append(folder)
+            for sub_folder in folder.folders:
+                add_folder(sub_folder)
+            entries.extend(folder.items)
+
+        for folder in self.folders:
+            add_folder(folder)
+        return {entry: rank for rank, entry in enumerate(entries)}
+
     def __processFolder(self, parentFolder):        
         if not self.app.monitor.has_watch(parentFolder.path):
             self.app.monitor.add_watch(parentFolder.path)
@@ -985,6 +1050,7 @@ dialog.info_dialog("Window information",
     
 # This import placed here to prevent circular import conflicts
 from . import model
+from . import matcher
 
 
 class GlobalHotkey(model.AbstractHotkey):
@@ -1017,9 +1083,9 @@ class GlobalHotkey(model.AbstractHotkey):
         """
         self.closure = closure
         
-    def check_hotkey(self, modifiers, key, windowTitle):
+    def check_hotkey(self, modifiers, key, windowTitle, skip_window_filter=False):
         # TODO: Doesn’t this always return False? (as long as no exceptions are thrown)
-        if model.AbstractHotkey.check_hotkey(self, modifiers, key, windowTitle) and self.enabled:
+        if model.AbstractHotkey.check_hotkey(self, modifiers, key, windowTitle, skip_window_filter) and self.enabled:
             _logger.debug("Triggered global hotkey using modifiers: %r key: %r", modifiers, key)
             self.closure()
         return False
@@ -1047,3 +1113,17 @@ class GlobalHotkey(model.AbstractHotkey):
         
     def __str__(self):
         return "AutoKey global hotkeys"  # TODO: i18n
+
+
+# Immutable view of the trigger related configuration, as used by the expansion service on every keypress.
+# ConfigManager publishes a new snapshot by swapping a single reference, so readers never need the configuration lock.
+ConfigSnapshot = typing.NamedTuple("ConfigSnapshot", [
+    ("globalHotkeys", typing.Tuple[GlobalHotkey, ...]),
+    ("hotKeys", typing.Tuple[model.Item, ...]),
+    ("hotKeyFolders", typing.Tuple[model.Folder, ...]),
+    ("allFolders", typing.Tuple[model.Folder, ...]),
+    ("allItems", typing.Tuple[model.Item, ...]),
+    ("abbreviationIndex", matcher.AbbreviationIndex),
+    ("hotkeyTable", matcher.HotkeyTable),
+    ("windowFilterCache", matcher.WindowFilterCache),
+])
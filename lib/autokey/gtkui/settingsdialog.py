@@ -55,6 +55,13 @@ class SettingsDialog:
         # Added by Trey Blancher (ectospasm) 2015-09-16
         self.triggerItemByInitial = builder.get_object("triggerItemByInitial")
         self.enableUndoCheckbox = builder.get_object("enableUndoCheckbox")
+        self.xtestOutputCheckbox = builder.get_object("xtestOutputCheckbox")
+        self.preRemapCheckbox = builder.get_object("preRemapCheckbox")
+        self.rootWindowGrabsCheckbox = builder.get_object("rootWindowGrabsCheckbox")
+        self.singleHopInputCheckbox = builder.get_object("singleHopInputCheckbox")
+        self.latencyTracingCheckbox = builder.get_object("latencyTracingCheckbox")
+        self.watchMacroFilesCheckbox = builder.get_object("watchMacroFilesCheckbox")
+        self.concurrentScriptMacrosCheckbox = builder.get_object("concurrentScriptMacrosCheckbox")
         
         self.iconStyleCombo = Gtk.ComboBoxText.new()
         hbox = builder.get_object("hbox4")
@@ -76,6 +83,13 @@ class SettingsDialog:
         self.triggerItemByInitial.set_active(cm.ConfigManager.SETTINGS[cm.TRIGGER_BY_INITIAL])
         self.sortByUsageCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.SORT_BY_USAGE_COUNT])
         self.enableUndoCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.UNDO_USING_BACKSPACE])
+        self.xtestOutputCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT])
+        self.preRemapCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.PRE_REMAP_CHARACTERS])
+        self.rootWindowGrabsCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.ROOT_WINDOW_HOTKEY_GRABS])
+        self.singleHopInputCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.SINGLE_HOP_INPUT])
+        self.latencyTracingCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.LATENCY_TRACING])
+        self.watchMacroFilesCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.WATCH_MACRO_FILES])
+        self.concurrentScriptMacrosCheckbox.set_active(cm.ConfigManager.SETTINGS[cm.CONCURRENT_SCRIPT_MACROS])
         
 
 
@@ -113,6 +127,13 @@ class SettingsDialog:
         # Added by Trey Blancher (ectospasm) 2015-09-16
         cm.ConfigManager.SETTINGS[cm.TRIGGER_BY_INITIAL] = self.triggerItemByInitial.get_active()
         cm.ConfigManager.SETTINGS[cm.UNDO_USING_BACKSPACE] = self.enableUndoCheckbox.get_active()
+        cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT] = self.xtestOutputCheckbox.get_active()
+        cm.ConfigManager.SETTINGS[cm.PRE_REMAP_CHARACTERS] = self.preRemapCheckbox.get_active()
+        cm.ConfigManager.SETTINGS[cm.ROOT_WINDOW_HOTKEY_GRABS] = self.rootWindowGrabsCheckbox.get_active()
+        cm.ConfigManager.SETTINGS[cm.SINGLE_HOP_INPUT] = self.singleHopInputCheckbox.get_active()
+        cm.ConfigManager.SETTINGS[cm.LATENCY_TRACING] = self.latencyTracingCheckbox.get_active()
+        cm.ConfigManager.SETTINGS[cm.WATCH_MACRO_FILES] = self.watchMacroFilesCheckbox.get_active()
+        cm.ConfigManager.SETTINGS[cm.CONCURRENT_SCRIPT_MACROS] = self.concurrentScriptMacrosCheckbox.get_active()
         cm.ConfigManager.SETTINGS[cm.NOTIFICATION_ICON] = ICON_NAME_MAP[self.iconStyleCombo.get_active_text()]
         self._save_disable_capslock_setting()
         self.configManager.userCodeDir = self.userModuleChooserButton.get_current_folder()
@@ -137,7 +158,8 @@ class SettingsDialog:
             app.hotkey_created(toggleHotkey)
             
         app.update_notifier_visibility()            
-        self.configManager.config_altered(True)
+        # Through the application, so that the hotkey grabs follow a changed grab setting
+        app.config_altered(True)
         
         self.hide()
         self.destroy()
@@ -20,9 +20,11 @@ __all__ = ["XRecordInterface", "AtSpiInterface"]
 from abc import abstractmethod
 import typing
 import threading
+import collections
+import enum
 import select
 import logging
-import queue
+import os
 import subprocess
 import time
 
@@ -42,6 +44,7 @@ from Xlib.error import ConnectionClosedError
 
 
 from . import common
+from . import tracing
 
 if common.USING_QT:
     from PyQt5.QtGui import QClipboard
@@ -62,7 +65,7 @@ else:
     except SyntaxError:  # pyatspi 2.26 fails when used with Python 3.7
         HAS_ATSPI = False
 
-from Xlib import X, XK, display, error
+from Xlib import X, XK, Xatom, display, error
 try:
     from Xlib.ext import record, xtest
     HAS_RECORD = True
@@ -88,6 +91,13 @@ MASK_INDEXES = [
 CAPSLOCK_LEDMASK = 1<<0
 NUMLOCK_LEDMASK = 1<<1
 
+# Seconds after which an unseen echo of a key event sent using XTest is no longer expected
+FAKE_EVENT_ECHO_TIMEOUT = 1.0
+# Seconds without further keymap change events, after which the keyboard mappings are re-initialised
+MAPPING_CHANGE_DELAY = 0.2
+# The modifier bits of a key event state. The other bits hold pointer buttons and the keyboard group.
+MODIFIER_STATE_MASK = X.ShiftMask|X.LockMask|X.ControlMask|X.Mod1Mask|X.Mod2Mask|X.Mod3Mask|X.Mod4Mask|X.Mod5Mask
+
 
 def str_or_bytes_to_bytes(x: typing.Union[str, bytes, memoryview]) -> bytes:
     if type(x) == bytes:
@@ -106,6 +116,257 @@ def str_or_bytes_to_bytes(x: typing.Union[str, bytes, memoryview]) -> bytes:
 WindowInfo = typing.NamedTuple("WindowInfo", [("wm_title", str), ("wm_class", str)])
 
 
+class WindowInfoCache:
+    """
+    Caches the WindowInfo of windows, keyed by X window id, to avoid the synchronous X round trips needed to read the
+    window title and class on every keystroke.
+
+    The WindowInfo of a window may be read from any of its parent windows. So each entry records all windows visited
+    while resolving it, and is dropped as soon as any of them changes its title or class, is re-parented or destroyed.
+    The X interface subscribes to the required PropertyNotify and StructureNotify events and calls invalidate().
+    """
+
+    # Crude size bound. Entries of destroyed windows are removed anyways, so this is only reached in odd cases.
+    MAX_SIZE = 512
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # type: typing.Dict[int, WindowInfo]
+        # Maps a window id to the ids of all windows whose entry was resolved using that window
+        self._dependents = {}  # type: typing.Dict[int, typing.Set[int]]
+        # Ids of windows that send property and structure events to AutoKey
+        self.watched = set()  # type: typing.Set[int]
+
+    def get(self, window_id: int) -> typing.Optional[WindowInfo]:
+        return self._entries.get(window_id)
+
+    def put(self, window_id: int, window_info: WindowInfo, visited: typing.Iterable[int]):
+        with self._lock:
+            if len(self._entries) >= self.MAX_SIZE:
+                self._entries.clear()
+                self._dependents.clear()
+            self._entries[window_id] = window_info
+            for visited_id in visited:
+                self._dependents.setdefault(visited_id, set()).add(window_id)
+
+    def invalidate(self, window_id: int, destroyed: bool=False):
+        """Drop all entries that depend on the given window."""
+        with self._lock:
+            for dependent_id in self._dependents.pop(window_id, ()):
+                self._entries.pop(dependent_id, None)
+            if destroyed:
+                self.watched.discard(window_id)
+
+
+class FocusTracker:
+    """
+    Keeps the window having the input focus in memory, so that the keypress and send paths do not need a synchronous
+    get_input_focus() round trip for each event.
+
+    The remembered window is dropped, when the window manager changes _NET_ACTIVE_WINDOW on the root window or the
+    focused window reports a FocusIn/FocusOut event. The next read then queries the X server once.
+    Window managers without EWMH support do not announce the active window, so the tracker is disabled for them and
+    every read queries the X server, as before.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._focus = None
+        # Incremented on each invalidation. Used to discard results of queries that raced with an invalidation.
+        self._generation = 0
+
+    def get_focus(self, query_focus: typing.Callable[[], typing.Any]):
+        """Return the focused window. Uses query_focus to ask the X server, if the focus is not known."""
+        if not self.enabled:
+            return query_focus()
+        focus = self._focus
+        if focus is None:
+            generation = self._generation
+            focus = query_focus()
+            with self._lock:
+                if generation == self._generation:
+                    self._focus = focus
+        return focus
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._focus = None
+
+
+class DebouncedCall:
+    """
+    Calls the given callback once, after no further schedule() call happened for the given delay. A burst of calls is
+    thereby collapsed into a single invocation of the callback. The callback runs in a timer thread.
+    """
+
+    def __init__(self, delay: float, callback: typing.Callable[[], None]):
+        self.delay = delay
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._timer = None  # type: typing.Optional[threading.Timer]
+        # Incremented on each schedule() and cancel(). Used to discard timers that fired while being replaced.
+        self._generation = 0
+
+    def schedule(self) -> bool:
+        """
+        (Re-)start the delay. Returns True, if a pending call was postponed, i.e. this call was coalesced with a
+        previous one.
+        """
+        with self._lock:
+            coalesced = self._timer is not None
+            if coalesced:
+                self._timer.cancel()
+            self._generation += 1
+            self._timer = threading.Timer(self.delay, self._fire, args=(self._generation,))
+            self._timer.setDaemon(True)
+            self._timer.start()
+        return coalesced
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _fire(self, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._timer = None
+        self._callback()
+
+
+class GrabRegistry:
+    """
+    Records the passive key grabs currently held by AutoKey, as (window id, keycode, modifier mask) triples. Each
+    triple stands for the grab of the plain modifier mask and its variants with NumLock and CapsLock active.
+
+    Knowing the active grabs allows updating them after configuration changes by only grabbing and ungrabbing the
+    difference to the desired set, instead of ungrabbing and re-grabbing every hotkey in every window.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._grabs = {}  # type: typing.Dict[int, typing.Set[typing.Tuple[int, int]]]
+
+    def add(self, window_id: int, keycode: int, mask: int):
+        with self._lock:
+            self._grabs.setdefault(window_id, set()).add((keycode, mask))
+
+    def discard(self, window_id: int, keycode: int, mask: int):
+        with self._lock:
+            grabs = self._grabs.get(window_id)
+            if grabs is not None:
+                grabs.discard((keycode, mask))
+                if not grabs:
+                    del self._grabs[window_id]
+
+    def forget_window(self, window_id: int):
+        """Drop all grabs of the given window. Used for destroyed windows, as their grabs vanish with them."""
+        with self._lock:
+            self._grabs.pop(window_id, None)
+
+    def grabs(self) -> typing.Set[typing.Tuple[int, int, int]]:
+        with self._lock:
+            return {
+                (window_id, keycode, mask) for window_id, grabs in self._grabs.items() for keycode, mask in grabs
+            }
+
+    def diff(self, desired: typing.Set[typing.Tuple[int, int, int]]):
+        """
+        Compare the active grabs with the desired ones.
+        @return: A tuple (missing, obsolete) of the grabs to acquire and the grabs to release
+        """
+        active = self.grabs()
+        return desired - active, active - desired
+
+    def window_ids(self) -> typing.Set[int]:
+        """Returns the ids of all windows holding at least one grab."""
+        with self._lock:
+            return set(self._grabs)
+
+    def window_grabs(self, window_id: int) -> typing.Set[typing.Tuple[int, int]]:
+        """Returns the (keycode, modifier mask) pairs grabbed in the given window."""
+        with self._lock:
+            return set(self._grabs.get(window_id, ()))
+
+    def diff_window(self, window_id: int, desired: typing.Set[typing.Tuple[int, int]]):
+        """
+        Compare the active grabs of a single window with the desired (keycode, modifier mask) pairs.
+        @return: A tuple (missing, obsolete) of the grabs to acquire and the grabs to release
+        """
+        active = self.window_grabs(window_id)
+        return desired - active, active - desired
+
+
+class GrabWalk:
+    """
+    State of a hotkey grab update that walks the window tree. The walk visits one window per event loop job, so that
+    the INPUT and OUTPUT lanes are served between two windows.
+    """
+
+    def __init__(self, signature, rootWindow, everywhereSpecs: list, filteredItems: list,
+                 staleWindowIds: typing.Set[int]):
+        # The hotkey signature this walk grabs for. The walk is abandoned, once the hotkeys differ.
+        self.signature = signature
+        # Pairs of an item having a window filter and its grab spec
+        self.filteredItems = filteredItems
+        # Windows still to visit, each with the grab specs applying to it because of its ancestors
+        self.pending = [(rootWindow, everywhereSpecs)]  # type: typing.List[typing.Tuple[typing.Any, list]]
+        # Windows holding grabs when the walk started, that were not visited yet. Their grabs are released at the end.
+        self.staleWindowIds = staleWindowIds
+
+
+class WorkLane(enum.IntEnum):
+    """The lanes of the WorkQueue, in the order they are served."""
+    INPUT = 0  # Handling of user input: key presses, releases and mouse clicks
+    OUTPUT = 1  # Sending keys, mouse clicks and clipboard contents
+    BACKGROUND = 2  # Hotkey grab maintenance and keymap (re-)initialisation
+
+
+class WorkQueue:
+    """
+    The job queue of the X event loop thread. Jobs are kept in one FIFO lane per WorkLane. get() always serves the
+    first lane having pending jobs, so that user input and expansions never wait behind hotkey grab maintenance.
+    The current and the highest seen depth of each lane are available for monitoring.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._lanes = [collections.deque() for _ in WorkLane]  # type: typing.List[typing.Deque[tuple]]
+        self._peakDepths = [0 for _ in WorkLane]
+
+    def put(self, lane: WorkLane, method: typing.Optional[typing.Callable], args: typing.Optional[tuple]):
+        with self._condition:
+            jobs = self._lanes[lane]
+            jobs.append((method, args))
+            if len(jobs) > self._peakDepths[lane]:
+                self._peakDepths[lane] = len(jobs)
+            self._condition.notify()
+
+    def get(self) -> tuple:
+        """Remove and return the next job as a (method, args) tuple. Blocks until a job is available."""
+        with self._condition:
+            while True:
+                for jobs in self._lanes:
+                    if jobs:
+                        return jobs.popleft()
+                self._condition.wait()
+
+    def depths(self) -> typing.Dict[str, int]:
+        """Returns the number of pending jobs of each lane, keyed by lane name."""
+        with self._condition:
+            return {lane.name: len(self._lanes[lane]) for lane in WorkLane}
+
+    def peak_depths(self) -> typing.Dict[str, int]:
+        """Returns the highest number of jobs pending at once in each lane, keyed by lane name."""
+        with self._condition:
+            return {lane.name: self._peakDepths[lane] for lane in WorkLane}
+
+
 class AbstractClipboard:
     """
     Abstract interface for clipboard interactions.
@@ -204,12 +465,49 @@ class XInterfaceBase(threading.Thread):
         
         # Event loop
         self.eventThread = threading.Thread(target=self.__eventLoop)
-        self.queue = queue.Queue()
+        self.queue = WorkQueue()
         
         # Event listener
         self.listenerThread = threading.Thread(target=self.__flushEvents)
+        # Writing to this pipe wakes the listener thread up, when it has to shut down or the display was replaced
+        self.__wakeupPipe = os.pipe()
+        os.set_blocking(self.__wakeupPipe[1], False)
+        # Windows created, mapped or renamed since the last grab pass, by window id
+        self.__windowsToGrab = {}
+        self.__windowsToGrabLock = threading.Lock()
+        # True while a hotkey grab update is enqueued, but not yet started. It will see any newer hotkey change, too.
+        self.__grabUpdatePending = False
+        self.__grabUpdateLock = threading.Lock()
         self.clipboard = Clipboard()
-
+        # Serializes reading events from the local display, which is done by the listener and the event loop thread
+        self.__xEventLock = threading.Lock()
+        # Key events sent using XTest are recorded like physical key presses. Their echo must not be handled as user
+        # input, so the fake events not yet recorded are kept in the order they were sent, as
+        # (event type, keycode, send time, swallow echo) tuples.
+        self.__pendingFakeEvents = collections.deque()  # type: typing.Deque[typing.Tuple[int, int, float, bool]]
+        self.__pendingFakeEventsLock = threading.Lock()
+        # The thread running __sendBatch(), if any
+        self.__batchThread = None  # type: typing.Optional[threading.Thread]
+
+        # Characters not present in the keyboard layout, remapped to unused keycodes. Ordered from least to most
+        # recently used. The remappings are kept between sends and evicted when the unused keycodes run out.
+        self.remappedChars = collections.OrderedDict()  # type: typing.Dict[str, typing.Tuple[int, int]]
+        # Bursts of keymap change events, like those caused by a layout switch, result in a single re-initialisation
+        self.__mappingChangeScheduler = DebouncedCall(MAPPING_CHANGE_DELAY, self.__mappingChangeSettled)
+        # Keyboard mapping changes made by AutoKey itself, as (first keycode, keycode count), whose MappingNotify event
+        # was not received yet. Notifications for exactly these ranges do not re-initialise the keyboard mappings.
+        self.__ownMappingChanges = collections.deque()  # type: typing.Deque[typing.Tuple[int, int]]
+        self.__mappingNotifyLock = threading.Lock()
+        # Time of the last MappingNotify of an own change, and whether a MappingNotify of a foreign change was received
+        # during the current burst of keymap change events
+        self.__ownMappingNotifyTime = None  # type: typing.Optional[float]
+        self.__foreignMappingNotified = False
+        # Time of the first keymap change event of the current burst
+        self.__mappingChangeBurstStart = 0.0
+        # True while a re-initialisation is enqueued, but not yet started. It will read any newer keymap, too.
+        self.__mappingReinitPending = False
+        # Number of keymap change events that did not cause a re-initialisation of their own
+        self.coalescedMappingChanges = 0
         self.__initMappings()
 
         # Set initial lock state
@@ -220,13 +518,13 @@ class XInterfaceBase(threading.Thread):
         # Window name atoms
         self.__NameAtom = self.localDisplay.intern_atom("_NET_WM_NAME", True)
         self.__VisibleNameAtom = self.localDisplay.intern_atom("_NET_WM_VISIBLE_NAME", True)
+        # Changes of these properties invalidate cached window information
+        self.__windowInfoAtoms = {self.__NameAtom, self.__VisibleNameAtom, Xatom.WM_NAME, Xatom.WM_CLASS}
         
         if not common.USING_QT:
             self.keyMap = Gdk.Keymap.get_default()
             self.keyMap.connect("keys-changed", self.on_keys_changed)
         
-        self.__ignoreRemap = False
-        
         self.eventThread.start()
         self.listenerThread.start()
         
@@ -240,32 +538,105 @@ class XInterfaceBase(threading.Thread):
                 logger.debug("__eventLoop: Got method {} with None arguments!".format(method))
             try:
                 method(*args)
+                # Requests done by the method may have read events from the connection. Those are queued by Xlib and
+                # do not wake up the listener thread, so handle them now.
+                self.__processPendingEvents()
             except Exception as e:
                 logger.exception("Error in X event loop thread")
 
-            self.queue.task_done()
+    def __enqueue(self, method: typing.Callable, *args, lane: WorkLane=WorkLane.OUTPUT):
+        # Keystrokes being traced are followed through the queue
+        self.queue.put(lane, tracing.propagate(method), args)
 
-    def __enqueue(self, method: typing.Callable, *args):
-        self.queue.put_nowait((method, args))
+    def queue_depths(self) -> typing.Dict[str, typing.Tuple[int, int]]:
+        """
+        Returns the current and the highest seen number of pending jobs in each lane of the event loop queue, as
+        {lane name: (current, peak)}.
+        """
+        depths = self.queue.depths()
+        peakDepths = self.queue.peak_depths()
+        return {name: (depth, peakDepths[name]) for name, depth in depths.items()}
 
     def on_keys_changed(self, data=None):
-        if not self.__ignoreRemap:
-            logger.debug("Recorded keymap change event")
-            self.__ignoreRemap = True
-            time.sleep(0.2)
-            self.__enqueue(self.__ungrabAllHotkeys)
-            self.__enqueue(self.__delayedInitMappings)
+        """
+        Called by the toolkit, when the keyboard layout changed, and for MappingNotify events of changes not made by
+        AutoKey. The toolkit events do not tell which keycodes changed, so the decision whether the keyboard mappings
+        need to be re-initialised is done once the burst settled.
+        """
+        if self.__mappingReinitPending or self.__mappingChangeScheduler.schedule():
+            self.coalescedMappingChanges += 1
+            logger.debug("Coalesced keymap change event. Total coalesced: %d", self.coalescedMappingChanges)
         else:
-            logger.debug("Ignored keymap change event")
+            self.__mappingChangeBurstStart = time.monotonic()
+            logger.debug("Recorded keymap change event")
+
+    def __expectMappingNotify(self, firstCode: int, count: int):
+        """Record a keyboard mapping change about to be made by AutoKey, so that its MappingNotify is ignored."""
+        with self.__mappingNotifyLock:
+            self.__ownMappingChanges.append((firstCode, count))
+
+    def __mappingNotified(self, firstCode: int, count: int):
+        """
+        Handle the MappingNotify event of a keyboard mapping change, which is received by every X client. Changes made
+        by AutoKey are recognised by their exact keycode range. Any other change re-initialises the keyboard mappings.
+        """
+        with self.__mappingNotifyLock:
+            if (firstCode, count) in self.__ownMappingChanges:
+                self.__ownMappingChanges.remove((firstCode, count))
+                self.__ownMappingNotifyTime = time.monotonic()
+                logger.debug("Ignored keymap change of keycodes %d to %d made by AutoKey",
+                             firstCode, firstCode + count - 1)
+                return
+            self.__foreignMappingNotified = True
+        self.on_keys_changed()
+
+    def __mappingChangeSettled(self):
+        """
+        Called once a burst of keymap change events settled. The toolkit reports the changes made by AutoKey, too, but
+        without their keycode range. If no foreign change was notified during the burst and a change made by AutoKey
+        was notified right before or during it, the toolkit events are attributed to that change and ignored.
+        """
+        with self.__mappingNotifyLock:
+            foreign = self.__foreignMappingNotified
+            self.__foreignMappingNotified = False
+            ownTime = self.__ownMappingNotifyTime
+        ownOnly = ownTime is not None and ownTime >= self.__mappingChangeBurstStart - MAPPING_CHANGE_DELAY
+        if ownOnly and not foreign:
+            logger.debug("Ignored keymap change events caused by characters remapped by AutoKey")
+            return
+        self.__scheduleMappingReinit()
+
+    def __scheduleMappingReinit(self):
+        self.__mappingReinitPending = True
+        self.__enqueue(self.__ungrabAllHotkeys, lane=WorkLane.BACKGROUND)
+        self.__enqueue(self.__delayedInitMappings, lane=WorkLane.BACKGROUND)
 
-    def __delayedInitMappings(self):        
+    def __delayedInitMappings(self):
+        self.__mappingReinitPending = False
         self.__initMappings()
-        self.__ignoreRemap = False
 
     def __initMappings(self):
         self.localDisplay = display.Display()
+        with self.__mappingNotifyLock:
+            # Events of the previous display are not received anymore. Foreign changes until now are read right away.
+            self.__ownMappingChanges.clear()
+            self.__foreignMappingNotified = False
+        # The listener thread may still wait for events on the previous display
+        self.__wakeListener()
         self.rootWindow = self.localDisplay.screen().root
-        self.rootWindow.change_attributes(event_mask=X.SubstructureNotifyMask|X.StructureNotifyMask)
+        # Event subscriptions are bound to the display connection, so cached information is lost with the old display
+        self.__windowInfoCache = WindowInfoCache()
+        self.__grabRegistry = GrabRegistry()
+        # Root window grabs of hotkeys having a window filter, see __allowGrabbedKeyPress()
+        self.__syncGrabItems = {}  # type: typing.Dict[typing.Tuple[int, int], typing.List[model.AbstractHotkey]]
+        self.__activeWindowAtom = self.localDisplay.intern_atom("_NET_ACTIVE_WINDOW")
+        self.__focusTracker = FocusTracker(self.__isActiveWindowSupported())
+        if self.__focusTracker.enabled:
+            self.rootWindow.change_attributes(
+                event_mask=X.SubstructureNotifyMask|X.StructureNotifyMask|X.PropertyChangeMask)
+        else:
+            logger.info("Window manager does not announce the active window. Querying the input focus on each use.")
+            self.rootWindow.change_attributes(event_mask=X.SubstructureNotifyMask|X.StructureNotifyMask)
         
         altList = self.localDisplay.keysym_to_keycodes(XK.XK_ISO_Level3_Shift)
         self.__usableOffsets = (0, 1)
@@ -294,14 +665,18 @@ class XInterfaceBase(threading.Thread):
                     if found: break
 
         logger.debug("Modifier masks: %r", self.modMasks)
+        self.__buildKeyNameTable()
 
         self.__grabHotkeys()
         self.localDisplay.flush()
 
         # --- get list of keycodes that are unused in the current keyboard mapping
 
+        # Keycodes still carrying characters remapped by AutoKey are usable, too. Those remappings are kept.
+        remappedSymbols = self.__remappedSymbols()
         keyCode = 8
         avail = []
+        keptCodes = set()
         for keyCodeMapping in self.localDisplay.get_keyboard_mapping(keyCode, 200):
             codeAvail = True
             for offset in keyCodeMapping:
@@ -311,15 +686,54 @@ class XInterfaceBase(threading.Thread):
 
             if codeAvail:
                 avail.append(keyCode)
+            elif keyCode in remappedSymbols and self.__isRemappedRow(keyCodeMapping, remappedSymbols, keyCode):
+                avail.append(keyCode)
+                keptCodes.add(keyCode)
 
             keyCode += 1
 
         self.__availableKeycodes = avail
-        self.remappedChars = {}
+        # Each usable keycode provides two slots: offset 0 (unshifted) and 1 (shifted). As before, the last available
+        # keycode is not used.
+        self.__remapSlots = [(code, offset) for code in avail[:-1] for offset in (0, 1)]
+        self.remappedChars = collections.OrderedDict(
+            (char, slot) for char, slot in self.remappedChars.items()
+            if slot[0] in keptCodes and slot in self.__remapSlots
+        )  # type: typing.Dict[str, typing.Tuple[int, int]]
+        # Keycodes for sending characters, filled on demand by __lookupSendKeycode()
+        self.__sendKeycodes = {}  # type: typing.Dict[str, typing.Tuple[typing.Optional[int], typing.Optional[int]]]
 
         if logging.getLogger().getEffectiveLevel() == logging.DEBUG:
             self.keymap_test()
 
+        if cm.ConfigManager.SETTINGS[cm.PRE_REMAP_CHARACTERS]:
+            self.__enqueue(self.__preRemapCharacters, lane=WorkLane.BACKGROUND)
+
+    def __isActiveWindowSupported(self) -> bool:
+        """Returns True, if the window manager supports the EWMH _NET_ACTIVE_WINDOW root window property."""
+        supported = self.rootWindow.get_full_property(self.localDisplay.intern_atom("_NET_SUPPORTED"), Xatom.ATOM)
+        return supported is not None and self.__activeWindowAtom in supported.value
+
+    def __getFocusWindow(self):
+        """Return the window having the input focus."""
+        # Polling for events flushes the output buffer, so it is skipped while sending a batch, which is flushed once
+        # at its end. The event loop processes the events received in the meantime after the batch.
+        inBatch = self.__batchThread is threading.current_thread()
+        if not inBatch:
+            # Apply already received focus change events first
+            self.__processPendingEvents()
+        focus = self.__focusTracker.get_focus(self.__queryFocusWindow)
+        if not inBatch:
+            self.__processRoundTripEvents()
+        return focus
+
+    def __queryFocusWindow(self):
+        focus = self.localDisplay.get_input_focus().focus
+        if not isinstance(focus, int):
+            # Receive FocusOut, once the focus moves to another window of the same application
+            self.__watchWindows([focus])
+        return focus
+
     def keymap_test(self):
         code = self.localDisplay.keycode_to_keysym(108, 0)
         for attr in XK.__dict__.items():
@@ -354,224 +768,357 @@ class XInterfaceBase(threading.Thread):
         """
         Run during startup to grab global and specific hotkeys in all open windows
         """
-        c = self.app.configManager
-        hotkeys = c.hotKeys + c.hotKeyFolders
+        self.__grabbedSignature = None
+        self.__grabWalk = None
+        self.__scheduleHotkeyGrabUpdate()
 
-        # Grab global hotkeys in root window
-        for item in c.globalHotkeys:
-            if item.enabled:
-                self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, self.rootWindow)
-                if self.__needsMutterWorkaround(item):
-                    self.__enqueue(self.__grabRecurse, item, self.rootWindow, False)
+    def config_altered(self):
+        """
+        Called after the configuration was altered. Grabs the added and ungrabs the removed hotkeys.
+        """
+        self.__scheduleHotkeyGrabUpdate()
 
-        # Grab hotkeys without a filter in root window
-        for item in hotkeys:
-            if item.get_applicable_regex() is None:
-                self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, self.rootWindow)
-                if self.__needsMutterWorkaround(item):
-                    self.__enqueue(self.__grabRecurse, item, self.rootWindow, False)
+    def __scheduleHotkeyGrabUpdate(self):
+        """
+        Enqueue a hotkey grab update, unless one is already waiting to be run. The user interface reports a single
+        hotkey change using several calls, which are thereby collapsed into a single update.
+        """
+        with self.__grabUpdateLock:
+            if self.__grabUpdatePending:
+                return
+            self.__grabUpdatePending = True
+        self.__enqueue(self.__runHotkeyGrabUpdate, lane=WorkLane.BACKGROUND)
+
+    def __runHotkeyGrabUpdate(self):
+        with self.__grabUpdateLock:
+            self.__grabUpdatePending = False
+        self.__updateHotkeyGrabs()
+
+    def __updateHotkeyGrabs(self):
+        """
+        Bring the active grabs in line with the configured hotkeys. Only the difference between the registered and the
+        desired grabs is sent to the X server. If no hotkey changed since the last update, nothing is done at all.
 
-        self.__enqueue(self.__recurseTree, self.rootWindow, hotkeys)
+        The root window grabs are updated right away. Grabs in other windows need a walk of the window tree, which is
+        done one window per BACKGROUND job by __grabWalkStep().
+        """
+        snapshot = self.app.configManager.snapshot
+        signature = self.__hotkeySignature(snapshot)
+        if signature == self.__grabbedSignature:
+            logger.debug("Hotkeys unchanged, keeping the current grabs.")
+            return
+        if self.__grabWalk is not None and self.__grabWalk.signature == signature:
+            logger.debug("Hotkeys unchanged, continuing the running window tree walk.")
+            return
 
-    def __recurseTree(self, parent, hotkeys):
-        # Grab matching hotkeys in all open child windows
-        try:
-            children = parent.query_tree().children
-        except:
-            return # window has been destroyed
-            
-        for window in children:
+        rootSpecs, syncGrabItems, everywhereSpecs, filteredItems = self.__desiredGrabs(snapshot)
+        rootId = self.rootWindow.id
+        missing, obsolete = self.__grabRegistry.diff_window(rootId, rootSpecs)
+        # Root window grabs switching between consuming every press and deciding per press have to be re-done
+        modeChanged = (syncGrabItems.keys() ^ self.__syncGrabItems.keys()) & (rootSpecs - missing)
+        logger.debug("Updating root window hotkey grabs: %d to grab, %d to ungrab, %d to change, %d unchanged",
+                     len(missing), len(obsolete), len(modeChanged), len(rootSpecs) - len(missing) - len(modeChanged))
+        for keycode, mask in obsolete | modeChanged:
+            self.__ungrabKey(self.rootWindow, keycode, mask)
+        self.__syncGrabItems = syncGrabItems
+        for keycode, mask in missing | modeChanged:
+            if (keycode, mask) in syncGrabItems:
+                self.__grabKey(self.rootWindow, keycode, mask, X.GrabModeSync)
+            else:
+                self.__grabKey(self.rootWindow, keycode, mask)
+
+        staleWindowIds = self.__grabRegistry.window_ids() - {rootId}
+        if everywhereSpecs or filteredItems:
+            self.__grabWalk = GrabWalk(signature, self.rootWindow, everywhereSpecs, filteredItems, staleWindowIds)
+            self.__enqueue(self.__grabWalkStep, self.__grabWalk, lane=WorkLane.BACKGROUND)
+        else:
+            # No grabs are needed outside of the root window
+            self.__grabWalk = None
+            self.__ungrabWindows(staleWindowIds)
+            self.__grabbedSignature = signature
+        self.localDisplay.flush()
+
+    def __grabWalkStep(self, walk: GrabWalk):
+        """
+        Visit the next window of a grab update walk: bring its grabs in line with the configured hotkeys and add its
+        children to the windows to visit. Enqueues itself again, until the whole window tree was visited.
+        """
+        if walk is not self.__grabWalk:
+            # Superseded by a newer update or a keymap change
+            return
+        if self.__hotkeySignature(self.app.configManager.snapshot) != walk.signature:
+            logger.debug("Hotkeys changed during the window tree walk, starting over.")
+            self.__grabWalk = None
+            self.__updateHotkeyGrabs()
+            return
+
+        window, specs = walk.pending.pop()
+        if window.id != self.rootWindow.id:
+            walk.staleWindowIds.discard(window.id)
+            specs = self.__windowGrabSpecs(window, specs, walk.filteredItems)
+            if specs is not None:
+                missing, obsolete = self.__grabRegistry.diff_window(window.id, set(specs))
+                for keycode, mask in obsolete:
+                    self.__ungrabKey(window, keycode, mask)
+                for keycode, mask in missing:
+                    self.__grabKey(window, keycode, mask)
+        if specs is not None:
             try:
-                window_info = self.get_window_info(window, False)
-                
-                if window_info.wm_title or window_info.wm_class:
-                    for item in hotkeys:
-                        if item.get_applicable_regex() is not None and item._should_trigger_window_title(window_info):
-                            self.__grabHotkey(item.hotKey, item.modifiers, window)
-                            self.__grabRecurse(item, window, False)
-                        
-                self.__enqueue(self.__recurseTree, window, hotkeys)
+                children = window.query_tree().children
             except:
-                logger.exception("grab on window failed")
-                
-    def __ungrabAllHotkeys(self):
+                children = []  # window has been destroyed
+            walk.pending.extend((child, specs) for child in children)
+
+        if walk.pending:
+            self.__enqueue(self.__grabWalkStep, walk, lane=WorkLane.BACKGROUND)
+        else:
+            # Windows not found in the tree were destroyed, their grabs are released, if they still exist
+            self.__ungrabWindows(walk.staleWindowIds)
+            self.__grabWalk = None
+            self.__grabbedSignature = walk.signature
+        self.localDisplay.flush()
+
+    def __windowGrabSpecs(self, window, inheritedSpecs: list, filteredItems: list) -> typing.Optional[list]:
         """
-        Ungrab all hotkeys in preparation for keymap change
+        Returns the grab specs desired in the given window, or None, if the window information can not be read. The
+        window and its descendants are skipped in that case.
         """
-        c = self.app.configManager
-        hotkeys = c.hotKeys + c.hotKeyFolders
-
-        # Ungrab global hotkeys in root window, recursively
-        for item in c.globalHotkeys:
-            if item.enabled:
-                self.__ungrabHotkey(item.hotKey, item.modifiers, self.rootWindow)
-                if self.__needsMutterWorkaround(item):
-                    self.__ungrabRecurse(item, self.rootWindow, False)
-        
-        # Ungrab hotkeys without a filter in root window, recursively
-        for item in hotkeys:
-            if item.get_applicable_regex() is None:
-                self.__ungrabHotkey(item.hotKey, item.modifiers, self.rootWindow)
-                if self.__needsMutterWorkaround(item):
-                    self.__ungrabRecurse(item, self.rootWindow, False)
-                
-        self.__recurseTreeUngrab(self.rootWindow, hotkeys)
-                
-    def __recurseTreeUngrab(self, parent, hotkeys):
-        # Ungrab matching hotkeys in all open child windows
-        try:
-            children = parent.query_tree().children
-        except:
-            return # window has been destroyed
-            
-        for window in children:
+        specs = list(inheritedSpecs)
+        if filteredItems:
             try:
                 window_info = self.get_window_info(window, False)
-                
-                if window_info.wm_title or window_info.wm_class:
-                    for item in hotkeys:
-                        if item.get_applicable_regex() is not None and item._should_trigger_window_title(window_info):
-                            self.__ungrabHotkey(item.hotKey, item.modifiers, window)
-                            self.__ungrabRecurse(item, window, False)
-                        
-                self.__enqueue(self.__recurseTreeUngrab, window, hotkeys)
             except:
-                logger.exception("ungrab on window failed")
+                logger.exception("grab on window failed")
+                return None
+            if window_info.wm_title or window_info.wm_class:
+                specs += [spec for item, spec in filteredItems if item._should_trigger_window_title(window_info)]
+        return specs
+
+    def __ungrabWindows(self, windowIds: typing.Iterable[int]):
+        """Release all registered grabs of the given windows."""
+        for window_id in windowIds:
+            window = self.localDisplay.create_resource_object("window", window_id)
+            for keycode, mask in self.__grabRegistry.window_grabs(window_id):
+                self.__ungrabKey(window, keycode, mask)
 
-    def __grabHotkeysForWindow(self, window):
+    @staticmethod
+    def __hotkeySignature(snapshot):
         """
-        Grab all hotkeys relevant to the window
-
-        Used when a new window is created
+        Returns everything about the configured hotkeys that determines the desired grabs, apart from the open windows.
         """
-        c = self.app.configManager
-        hotkeys = c.hotKeys + c.hotKeyFolders
-        window_info = self.get_window_info(window)
-        for item in hotkeys:
-            if item.get_applicable_regex() is not None and item._should_trigger_window_title(window_info):
-                self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, window)
-            elif self.__needsMutterWorkaround(item):
-                self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, window)
-
-    def __grabHotkey(self, key, modifiers, window):
+        return (
+            cm.ConfigManager.SETTINGS[cm.ROOT_WINDOW_HOTKEY_GRABS],
+            tuple((item.hotKey, tuple(item.modifiers)) for item in snapshot.globalHotkeys if item.enabled),
+            tuple(
+                (item.hotKey, tuple(item.modifiers), getattr(item.get_applicable_regex(), "pattern", None))
+                for item in snapshot.hotKeys + snapshot.hotKeyFolders
+            )
+        )
+
+    def __desiredGrabs(self, snapshot):
         """
-        Grab a specific hotkey in the given window
+        Determine the grabs needed for the configured hotkeys. Global hotkeys and hotkeys without a window filter are
+        grabbed in the root window. Hotkeys having a window filter are grabbed in every matching window and all of its
+        descendants. If the rootWindowHotkeyGrabs setting is enabled, they are grabbed in the root window, too, and
+        their window filters are checked on each press.
+
+        @return: A tuple of
+            - the set of (keycode, mask) grabbed in the root window,
+            - a dict mapping the (keycode, mask) of root window grabs that need a window filter check on each press to
+              the filtered items,
+            - the list of (keycode, mask) grabbed in every window,
+            - the list of (item, (keycode, mask)) pairs grabbed in the windows matching the window filter of the item
         """
-        logger.debug("Grabbing hotkey: %r %r", modifiers, key)
-        try:
-            keycode = self.__lookupKeyCode(key)
-            mask = 0
-            for mod in modifiers:
-                mask |= self.modMasks[mod]
-
-            window.grab_key(keycode, mask, True, X.GrabModeAsync, X.GrabModeAsync)
-
-            if Key.NUMLOCK in self.modMasks:
-                window.grab_key(keycode, mask|self.modMasks[Key.NUMLOCK], True, X.GrabModeAsync, X.GrabModeAsync)
-
-            if Key.CAPSLOCK in self.modMasks:
-                window.grab_key(keycode, mask|self.modMasks[Key.CAPSLOCK], True, X.GrabModeAsync, X.GrabModeAsync)
+        rootWindowGrabs = cm.ConfigManager.SETTINGS[cm.ROOT_WINDOW_HOTKEY_GRABS]
+        rootSpecs = []
+        # Hotkeys grabbed in every window, see __needsMutterWorkaround()
+        everywhereSpecs = []
+        filteredItems = []
+        rootFilteredItems = collections.OrderedDict()
+        items = [(item, True) for item in snapshot.globalHotkeys if item.enabled]
+        items += [(item, False) for item in snapshot.hotKeys + snapshot.hotKeyFolders]
+        for item, isGlobal in items:
+            try:
+                spec = self.__hotkeyGrabSpec(item.hotKey, item.modifiers)
+            except Exception as e:
+                logger.warning("Failed to grab hotkey %r %r: %s", item.modifiers, item.hotKey, str(e))
+                continue
+            if isGlobal or item.get_applicable_regex() is None:
+                rootSpecs.append(spec)
+                if self.__needsMutterWorkaround(item):
+                    everywhereSpecs.append(spec)
+            elif rootWindowGrabs:
+                rootFilteredItems.setdefault(spec, []).append(item)
+            else:
+                filteredItems.append((item, spec))
 
-            if Key.CAPSLOCK in self.modMasks and Key.NUMLOCK in self.modMasks:
-                window.grab_key(keycode, mask|self.modMasks[Key.CAPSLOCK]|self.modMasks[Key.NUMLOCK], True, X.GrabModeAsync, X.GrabModeAsync)
+        # A key combination also used by a hotkey without a window filter is consumed in every window anyways
+        syncGrabItems = {spec: items for spec, items in rootFilteredItems.items() if spec not in rootSpecs}
+        return set(rootSpecs) | syncGrabItems.keys(), syncGrabItems, everywhereSpecs, filteredItems
 
-        except Exception as e:
-            logger.warning("Failed to grab hotkey %r %r: %s", modifiers, key, str(e))
+    def __ungrabAllHotkeys(self):
+        """
+        Ungrab all hotkeys in preparation for keymap change
+        """
+        for window_id, keycode, mask in self.__grabRegistry.grabs():
+            self.__ungrabKey(self.localDisplay.create_resource_object("window", window_id), keycode, mask)
+        self.localDisplay.flush()
+        self.__syncGrabItems = {}
+        self.__grabbedSignature = None
+        self.__grabWalk = None
 
-    def grab_hotkey(self, item):
+    def __grabHotkeysForWindows(self):
         """
-        Grab a hotkey.
+        Update the hotkey grabs of the windows created, mapped or renamed since the last call. A burst of window
+        events results in a single pass.
 
-        If the hotkey has no filter regex, it is global and is grabbed recursively from the root window
-        If it has a filter regex, iterate over all children of the root and grab from matching windows
+        The grabs of hotkeys having a window filter are diffed against the registered grabs of each window, so that a
+        renamed window no longer matching a filter releases the grab. As in the window tree walk, the filtered grabs
+        of a window also apply to its descendants, which are updated, too, if the grabs of the window changed. Grabs
+        needed by the Mutter workaround are only added.
         """
-        if item.get_applicable_regex() is None:
-            self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, self.rootWindow)
-            if self.__needsMutterWorkaround(item):
-                self.__enqueue(self.__grabRecurse, item, self.rootWindow, False)
+        with self.__windowsToGrabLock:
+            windows = list(self.__windowsToGrab.values())
+            self.__windowsToGrab.clear()
+
+        snapshot = self.app.configManager.snapshot
+        hotkeys = snapshot.hotKeys + snapshot.hotKeyFolders
+        if cm.ConfigManager.SETTINGS[cm.ROOT_WINDOW_HOTKEY_GRABS]:
+            # Hotkeys having a window filter are grabbed in the root window only
+            filteredItems = []
         else:
-            self.__enqueue(self.__grabRecurse, item, self.rootWindow)
+            filteredItems = [item for item in hotkeys if item.get_applicable_regex() is not None]
+        mutterItems = [item for item in hotkeys if self.__needsMutterWorkaround(item)]
+        if not filteredItems and not mutterItems:
+            return
 
-    def __grabRecurse(self, item, parent, checkWinInfo=True):
-        try:
-            children = parent.query_tree().children
-        except:
-            return # window has been destroyed
-                     
-        for window in children:
-            shouldTrigger = False
-            
-            if checkWinInfo:
-                window_info = self.get_window_info(window, False)
-                shouldTrigger = item._should_trigger_window_title(window_info)
+        filteredSpecs = self.__itemGrabSpecs(filteredItems)
+        mutterSpecs = {spec for item, spec in self.__itemGrabSpecs(mutterItems)}
+        filteredSpecSet = {spec for item, spec in filteredSpecs}
+        for window in windows:
+            inheritedSpecs = self.__inheritedGrabSpecs(window, filteredSpecs)
+            if inheritedSpecs is None:
+                continue
+            pending = [(window, inheritedSpecs)]
+            while pending:
+                window, inheritedSpecs = pending.pop()
+                specs = self.__windowGrabSpecs(window, inheritedSpecs, filteredSpecs)
+                if specs is None:
+                    continue
+                missing, obsolete = self.__grabRegistry.diff_window(window.id, set(specs) | mutterSpecs)
+                # Grabs of hotkeys without a window filter are maintained by the grab update only
+                obsolete &= filteredSpecSet
+                for keycode, mask in obsolete:
+                    logger.debug("Ungrabbing hotkey in window %d: %r %r", window.id, keycode, mask)
+                    self.__ungrabKey(window, keycode, mask)
+                for keycode, mask in missing:
+                    logger.debug("Grabbing hotkey in window %d: %r %r", window.id, keycode, mask)
+                    self.__grabKey(window, keycode, mask)
+                if (missing | obsolete) & filteredSpecSet:
+                    try:
+                        children = window.query_tree().children
+                    except:
+                        children = []  # window has been destroyed
+                    pending.extend((child, specs) for child in children)
+        self.localDisplay.flush()
 
-            if shouldTrigger or not checkWinInfo:
-                self.__grabHotkey(item.hotKey, item.modifiers, window)
-                self.__grabRecurse(item, window, False)
-            else:
-                self.__grabRecurse(item, window)
+    def __itemGrabSpecs(self, items: list) -> list:
+        """Returns the list of (item, (keycode, mask)) pairs of the given hotkey items. Failing items are skipped."""
+        specs = []
+        for item in items:
+            try:
+                specs.append((item, self.__hotkeyGrabSpec(item.hotKey, item.modifiers)))
+            except Exception as e:
+                logger.warning("Failed to grab hotkey %r %r: %s", item.modifiers, item.hotKey, str(e))
+        return specs
 
-    def ungrab_hotkey(self, item):
+    def __inheritedGrabSpecs(self, window, filteredItems: list) -> typing.Optional[list]:
         """
-        Ungrab a hotkey.
-
-        If the hotkey has no filter regex, it is global and is grabbed recursively from the root window
-        If it has a filter regex, iterate over all children of the root and ungrab from matching windows
+        Returns the grab specs the given window inherits from the window filters matching its ancestors, or None, if
+        the window was destroyed or the information of an ancestor can not be read.
         """
-        import copy
-        newItem = copy.copy(item)
-        
-        if item.get_applicable_regex() is None:
-            self.__enqueue(self.__ungrabHotkey, newItem.hotKey, newItem.modifiers, self.rootWindow)
-            if self.__needsMutterWorkaround(item):
-                self.__enqueue(self.__ungrabRecurse, newItem, self.rootWindow, False)
-        else:
-            self.__enqueue(self.__ungrabRecurse, newItem, self.rootWindow)
-
-    def __ungrabRecurse(self, item, parent, checkWinInfo=True):
+        ancestors = []
         try:
-            children = parent.query_tree().children
+            parent = window.query_tree().parent
+            while not isinstance(parent, int) and parent.id not in (0, self.rootWindow.id):
+                ancestors.append(parent)
+                parent = parent.query_tree().parent
         except:
-            return # window has been destroyed
-                     
-        for window in children:
-            shouldTrigger = False
-            
-            if checkWinInfo:
-                window_info = self.get_window_info(window, False)
-                shouldTrigger = item._should_trigger_window_title(window_info)
+            return None  # window has been destroyed
+        specs = []
+        # Visited top-down like in the window tree walk
+        for ancestor in reversed(ancestors):
+            specs = self.__windowGrabSpecs(ancestor, specs, filteredItems)
+            if specs is None:
+                return None
+        return specs
+
+    def __hotkeyGrabSpec(self, key, modifiers) -> typing.Tuple[int, int]:
+        """Returns the keycode and modifier mask to grab for the given hotkey."""
+        keycode = self.__lookupKeyCode(key)
+        mask = 0
+        for mod in modifiers:
+            mask |= self.modMasks[mod]
+        return keycode, mask
+
+    def __lockMasks(self) -> typing.List[int]:
+        """Returns the lock modifier combinations, each of which requires a grab of its own."""
+        masks = [0]
+        if Key.NUMLOCK in self.modMasks:
+            masks.append(self.modMasks[Key.NUMLOCK])
+        if Key.CAPSLOCK in self.modMasks:
+            masks.append(self.modMasks[Key.CAPSLOCK])
+        if Key.CAPSLOCK in self.modMasks and Key.NUMLOCK in self.modMasks:
+            masks.append(self.modMasks[Key.CAPSLOCK]|self.modMasks[Key.NUMLOCK])
+        return masks
+
+    def __grabKey(self, window, keycode: int, mask: int, keyboardMode: int=X.GrabModeAsync):
+        for lockMask in self.__lockMasks():
+            window.grab_key(keycode, mask|lockMask, True, X.GrabModeAsync, keyboardMode)
+        self.__grabRegistry.add(window.id, keycode, mask)
+
+    def __ungrabKey(self, window, keycode: int, mask: int):
+        # Registered windows may have been destroyed in the meantime, without AutoKey noticing.
+        for lockMask in self.__lockMasks():
+            window.ungrab_key(keycode, mask|lockMask, onerror=error.CatchError(error.BadWindow))
+        self.__grabRegistry.discard(window.id, keycode, mask)
 
-            if shouldTrigger or not checkWinInfo:
-                self.__ungrabHotkey(item.hotKey, item.modifiers, window)
-                self.__ungrabRecurse(item, window, False)
-            else:
-                self.__ungrabRecurse(item, window)
-
-    def __ungrabHotkey(self, key, modifiers, window):
+    def grab_hotkey(self, item):
         """
-        Ungrab a specific hotkey in the given window
+        Grab the hotkey of the given item, after it was assigned or changed.
+
+        Only the difference to the currently held grabs is applied, including the grabs in all windows matching the
+        window filter of the item. Updates requested by the following configuration change are coalesced with this one.
         """
-        logger.debug("Ungrabbing hotkey: %r %r", modifiers, key)
-        try:
-            keycode = self.__lookupKeyCode(key)
-            mask = 0
-            for mod in modifiers:
-                mask |= self.modMasks[mod]
+        self.__scheduleHotkeyGrabUpdate()
 
-            window.ungrab_key(keycode, mask)
+    def ungrab_hotkey(self, item):
+        """
+        Ungrab the hotkey of the given item, before it is removed or changed.
 
-            if Key.NUMLOCK in self.modMasks:
-                window.ungrab_key(keycode, mask|self.modMasks[Key.NUMLOCK])
+        The grabs no longer needed by any hotkey are released by the next grab update, which compares the held grabs
+        with the configuration. A grab still used by another hotkey with the same key combination is kept.
+        """
+        self.__scheduleHotkeyGrabUpdate()
 
-            if Key.CAPSLOCK in self.modMasks:
-                window.ungrab_key(keycode, mask|self.modMasks[Key.CAPSLOCK])
+    def lookup_string(self, keyCode, shifted, numlock, altGrid):
+        try:
+            return self.__keyNameTable[
+                (keyCode << 3) | bool(shifted) | (bool(numlock) << 1) | (bool(altGrid) << 2)]
+        except IndexError:
+            return self.__lookupString(keyCode, shifted, numlock, altGrid)
 
-            if Key.CAPSLOCK in self.modMasks and Key.NUMLOCK in self.modMasks:
-                window.ungrab_key(keycode, mask|self.modMasks[Key.CAPSLOCK]|self.modMasks[Key.NUMLOCK])
-        except Exception as e:
-            logger.warning("Failed to ungrab hotkey %r %r: %s", modifiers, key, str(e))
+    def __buildKeyNameTable(self):
+        """
+        Precompute lookup_string() for all keycodes and all combinations of the shift, numlock and AltGr states.
+        The table is indexed by keycode << 3 | shifted | numlock << 1 | altGrid << 2.
+        """
+        self.__keyNameTable = [
+            self.__lookupString(keyCode, state & 1, state & 2, state & 4)
+            for keyCode in range(256) for state in range(8)
+        ]
 
-    def lookup_string(self, keyCode, shifted, numlock, altGrid):
+    def __lookupString(self, keyCode, shifted, numlock, altGrid):
         if keyCode == 0:
             return "<unknown>"
 
@@ -670,7 +1217,10 @@ class XInterfaceBase(threading.Thread):
         self.__enqueue(self.__grab_keyboard)
 
     def __grab_keyboard(self):
-        focus = self.localDisplay.get_input_focus().focus
+        if cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT]:
+            # XTest events are delivered like physical key presses, so a grab would redirect them to AutoKey itself.
+            return
+        focus = self.__getFocusWindow()
         focus.grab_keyboard(True, X.GrabModeAsync, X.GrabModeAsync, X.CurrentTime)
         self.localDisplay.flush()
 
@@ -688,6 +1238,19 @@ class XInterfaceBase(threading.Thread):
 
         return None, None
 
+    def __lookupSendKeycode(self, char: str) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+        """
+        Return the keycode and offset (shift level) usable to type the given character with the current keyboard
+        mapping, or (None, None) if the character can not be typed without remapping.
+        Results are cached until the keyboard mapping changes.
+        """
+        try:
+            return self.__sendKeycodes[char]
+        except KeyError:
+            result = self.__findUsableKeycode(self.localDisplay.keysym_to_keycodes(ord(char)))
+            self.__sendKeycodes[char] = result
+            return result
+
     def send_string(self, string):
         self.__enqueue(self.__sendString, string)
         
@@ -700,61 +1263,42 @@ class XInterfaceBase(threading.Thread):
         if not cm.ConfigManager.SETTINGS[cm.ENABLE_QT4_WORKAROUND]:
             self.__checkWorkaroundNeeded()
 
-        # First find out if any chars need remapping
-        remapNeeded = False
-        for char in string:
-            keyCodeList = self.localDisplay.keysym_to_keycodes(ord(char))
-            usableCode, offset = self.__findUsableKeycode(keyCodeList)
-            if usableCode is None and char not in self.remappedChars:
-                remapNeeded = True
-                break
-
-        # Now we know chars need remapping, do it
-        if remapNeeded:
-            self.__ignoreRemap = True
-            self.remappedChars = {}
-            remapChars = []
-
-            for char in string:
-                keyCodeList = self.localDisplay.keysym_to_keycodes(ord(char))
-                usableCode, offset = self.__findUsableKeycode(keyCodeList)
-                if usableCode is None:
-                    remapChars.append(char)
-
-            logger.debug("Characters requiring remapping: %r", remapChars)
-            availCodes = self.__availableKeycodes
-            logger.debug("Remapping with keycodes in the range: %r", availCodes)
-            mapping = self.localDisplay.get_keyboard_mapping(8, 200)
-            firstCode = 8
-
-            for i in range(len(availCodes) - 1):
-                code = availCodes[i]
-                sym1 = 0
-                sym2 = 0
-
-                if len(remapChars) > 0:
-                    char = remapChars.pop(0)
-                    self.remappedChars[char] = (code, 0)
-                    sym1 = ord(char)
-                if len(remapChars) > 0:
-                    char = remapChars.pop(0)
-                    self.remappedChars[char] = (code, 1)
-                    sym2 = ord(char)
-
-                if sym1 != 0:
-                    mapping[code - firstCode][0] = sym1
-                    mapping[code - firstCode][1] = sym2
-
-            mapping = [tuple(l) for l in mapping]
-            self.localDisplay.change_keyboard_mapping(firstCode, mapping)
-            self.localDisplay.flush()
-
-        focus = self.localDisplay.get_input_focus().focus
+        # First find out if any chars need remapping. Each distinct char only needs to be checked once. Already
+        # remapped chars are passed along, too, so that they are marked as recently used and are not evicted for
+        # other chars of this string.
+        remapChars = []
+        poolCodes = {code for code, offset in self.remappedChars.values()}
+        for char in collections.OrderedDict.fromkeys(string):
+            if char in self.remappedChars:
+                remapChars.append(char)
+                continue
+            usableCode, offset = self.__lookupSendKeycode(char)
+            if usableCode is None:
+                remapChars.append(char)
+            elif usableCode in poolCodes:
+                # The cached keycode was reassigned to another remapped char in the meantime
+                del self.__sendKeycodes[char]
+                remapChars.append(char)
+
+        if remapChars:
+            self.__remapCharacters(remapChars)
+
+        # The XTest backend sends to whatever window has the focus, so the focus window is not needed.
+        focus = None if cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT] else self.__getFocusWindow()
 
         for char in string:
             try:
-                keyCodeList = self.localDisplay.keysym_to_keycodes(ord(char))
-                keyCode, offset = self.__findUsableKeycode(keyCodeList)
+                if char in self.remappedChars:
+                    # Remapped chars are always typed using their pool slot
+                    keyCode, offset = self.remappedChars[char]
+                    if offset == 0:
+                        self.__sendKeyCode(keyCode, theWindow=focus)
+                    if offset == 1:
+                        self.__pressKey(Key.SHIFT)
+                        self.__sendKeyCode(keyCode, self.modMasks[Key.SHIFT], focus)
+                        self.__releaseKey(Key.SHIFT)
+                    continue
+                keyCode, offset = self.__lookupSendKeycode(char)
                 if keyCode is not None:
                     if offset == 0:
                         self.__sendKeyCode(keyCode, theWindow=focus)
@@ -773,21 +1317,100 @@ class XInterfaceBase(threading.Thread):
                         self.__releaseKey(Key.SHIFT)
                         self.__releaseKey(Key.ALT_GR)
 
-                elif char in self.remappedChars:
-                    keyCode, offset = self.remappedChars[char]
-                    if offset == 0:
-                        self.__sendKeyCode(keyCode, theWindow=focus)
-                    if offset == 1:
-                        self.__pressKey(Key.SHIFT)
-                        self.__sendKeyCode(keyCode, self.modMasks[Key.SHIFT], focus)
-                        self.__releaseKey(Key.SHIFT)
                 else:
                     logger.warning("Unable to send character %r", char)
             except Exception as e:
                 logger.exception("Error sending char %r: %s", char, str(e))
 
-        self.__ignoreRemap = False
 
+    def __remapCharacters(self, chars: typing.List[str]):
+        """
+        Make the given characters, which are not part of the keyboard layout, typeable by assigning them to unused
+        keycodes. Characters remapped by a previous send are reused. If the unused keycodes run out, the least recently
+        used remappings not needed for this send are replaced. Only the keycodes that actually change are rewritten,
+        so sending already remapped characters does not change the keyboard mapping at all.
+        """
+        pool = self.remappedChars
+        for char in chars:
+            if char in pool:
+                pool.move_to_end(char)
+        missing = [char for char in chars if char not in pool]
+        if not missing:
+            return
+
+        logger.debug("Characters requiring remapping: %r", missing)
+        usedSlots = set(pool.values())
+        freeSlots = [slot for slot in self.__remapSlots if slot not in usedSlots]
+        changedCodes = set()
+        for index, char in enumerate(missing):
+            if freeSlots:
+                slot = freeSlots.pop(0)
+            else:
+                oldestChar = next(iter(pool), None)
+                if oldestChar is None or oldestChar in chars:
+                    # All remapped characters are needed for this send.
+                    logger.warning("Not enough unused keycodes to remap the characters %r", missing[index:])
+                    break
+                slot = pool.pop(oldestChar)
+            pool[char] = slot
+            changedCodes.add(slot[0])
+
+        if not changedCodes:
+            return
+        # Cached lookups of the rewritten keycodes refer to the chars previously assigned to them
+        for char, (code, offset) in list(self.__sendKeycodes.items()):
+            if code in changedCodes:
+                del self.__sendKeycodes[char]
+        firstCode = min(changedCodes)
+        codeCount = max(changedCodes) - firstCode + 1
+        mapping = [list(row) for row in self.localDisplay.get_keyboard_mapping(firstCode, codeCount)]
+        remappedSymbols = self.__remappedSymbols()
+        for code in changedCodes:
+            row = mapping[code - firstCode]
+            row[0] = remappedSymbols[code].get(0, 0)
+            row[1] = remappedSymbols[code].get(1, 0)
+
+        logger.debug("Remapping keycodes: %r", sorted(changedCodes))
+        self.__expectMappingNotify(firstCode, codeCount)
+        self.localDisplay.change_keyboard_mapping(firstCode, [tuple(row) for row in mapping])
+        self.localDisplay.flush()
+
+    def __preRemapCharacters(self):
+        """
+        Remap the characters of all keyboard sent phrases that are not part of the keyboard layout, so that expanding
+        them does not need to change the keyboard mapping. If there are not enough unused keycodes, the most frequent
+        characters are remapped. All characters are remapped using a single keyboard mapping change.
+        """
+        counts = collections.Counter()
+        for item in self.app.configManager.snapshot.allItems:
+            if isinstance(item, model.Phrase) and item.sendMode == model.SendMode.KEYBOARD:
+                counts.update(item.phrase)
+
+        missing = collections.Counter({
+            char: count for char, count in counts.items()
+            if char not in "\n\t" and self.__lookupSendKeycode(char)[0] is None
+        })
+        if not missing:
+            return
+        # The least frequent characters come first, so that they are the first ones evicted from the remapping pool.
+        chars = [char for char, count in reversed(missing.most_common(len(self.__remapSlots)))]
+        logger.info("Remapping %d characters used in phrases, of %d characters not in the keyboard layout.",
+                    len(chars), len(missing))
+        self.__remapCharacters(chars)
+
+    def __remappedSymbols(self) -> typing.Dict[int, typing.Dict[int, int]]:
+        """Returns the keysyms of all remapped characters as {keycode: {offset: keysym}}."""
+        symbols = {}
+        for char, (code, offset) in self.remappedChars.items():
+            symbols.setdefault(code, {})[offset] = ord(char)
+        return symbols
+
+    @staticmethod
+    def __isRemappedRow(keyCodeMapping, remappedSymbols: typing.Dict[int, typing.Dict[int, int]], keyCode: int) -> bool:
+        """Returns True, if the keycode mapping contains exactly the characters remapped to it by AutoKey."""
+        expected = [remappedSymbols[keyCode].get(0, 0), remappedSymbols[keyCode].get(1, 0)]
+        row = list(keyCodeMapping)
+        return row[:2] == expected and not any(row[2:])
 
     def send_key(self, keyName):
         """
@@ -799,27 +1422,79 @@ class XInterfaceBase(threading.Thread):
         logger.debug("Send special key: [%r]", keyName)
         self.__sendKeyCode(self.__lookupKeyCode(keyName))
 
+    def send_key_repeated(self, keyName, count: int):
+        """
+        Send a specific non-printing key count times, as a single job of the event loop. The keycode and the focus
+        window are looked up once and the display is flushed once at the end.
+        """
+        if count > 0:
+            self.__enqueue(self.__sendKeyRepeatedFlush, keyName, count)
+
+    def __sendKeyRepeatedFlush(self, keyName, count: int):
+        self.__sendKeyRepeated(keyName, count)
+        self.__flush()
+
+    def __sendKeyRepeated(self, keyName, count: int):
+        logger.debug("Send special key %d times: [%r]", count, keyName)
+        keyCode = self.__lookupKeyCode(keyName)
+        # The XTest backend sends to whatever window has the focus, so the focus window is not needed.
+        focus = None if cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT] else self.__getFocusWindow()
+        for _ in range(count):
+            self.__sendKeyCode(keyCode, theWindow=focus)
+
     def fake_keypress(self, keyName):
          self.__enqueue(self.__fakeKeypress, keyName)
          
     def __fakeKeypress(self, keyName):        
         keyCode = self.__lookupKeyCode(keyName)
-        xtest.fake_input(self.rootWindow, X.KeyPress, keyCode)
-        xtest.fake_input(self.rootWindow, X.KeyRelease, keyCode)
+        self.__fakeInput(X.KeyPress, keyCode, swallowEcho=False)
+        self.__fakeInput(X.KeyRelease, keyCode, swallowEcho=False)
 
     def fake_keydown(self, keyName):
         self.__enqueue(self.__fakeKeydown, keyName)
         
     def __fakeKeydown(self, keyName):
         keyCode = self.__lookupKeyCode(keyName)
-        xtest.fake_input(self.rootWindow, X.KeyPress, keyCode)
+        self.__fakeInput(X.KeyPress, keyCode, swallowEcho=False)
 
     def fake_keyup(self, keyName):
         self.__enqueue(self.__fakeKeyup, keyName)
         
     def __fakeKeyup(self, keyName):
         keyCode = self.__lookupKeyCode(keyName)
-        xtest.fake_input(self.rootWindow, X.KeyRelease, keyCode)
+        self.__fakeInput(X.KeyRelease, keyCode, swallowEcho=False)
+
+    def send_batch(self, operations: typing.List[typing.Tuple[str, tuple]]):
+        """
+        Perform a sequence of output operations as a single job of the event loop and flush the display once at the
+        end, instead of enqueueing one job per operation.
+
+        @param operations: List of (method name, arguments) tuples. Supported method names are "send_string",
+        "send_key", "send_key_repeated", "send_modified_key", "press_key", "release_key" and "fake_keypress".
+        """
+        self.__enqueue(self.__sendBatch, operations)
+
+    def __sendBatch(self, operations: typing.List[typing.Tuple[str, tuple]]):
+        implementations = {
+            "send_string": self.__sendString,
+            "send_key": self.__sendKey,
+            "send_key_repeated": self.__sendKeyRepeated,
+            "send_modified_key": self.__sendModifiedKey,
+            "press_key": self.__pressKey,
+            "release_key": self.__releaseKey,
+            "fake_keypress": self.__fakeKeypress,
+        }
+        self.__batchThread = threading.current_thread()
+        try:
+            for name, args in operations:
+                try:
+                    implementations[name](*args)
+                except Exception:
+                    # Same behaviour as for separately enqueued operations: Log the error and continue.
+                    logger.exception("Error in batched output operation %s%r", name, args)
+        finally:
+            self.__batchThread = None
+        self.__flush()
 
     def send_modified_key(self, keyName, modifiers):
         """
@@ -900,27 +1575,17 @@ class XInterfaceBase(threading.Thread):
 
     def __flushEvents(self):
         logger.debug("__flushEvents: Entering event loop.")
+        wakeupFd = self.__wakeupPipe[0]
         while True:
             try:
-                readable, w, e = select.select([self.localDisplay], [], [], 1)
-                time.sleep(1)
-                if self.localDisplay in readable:
-                    createdWindows = []
-                    destroyedWindows = []
-                    
-                    for x in range(self.localDisplay.pending_events()):
-                        event = self.localDisplay.next_event()
-                        if event.type == X.CreateNotify:
-                            createdWindows.append(event.window)
-                        if event.type == X.DestroyNotify:
-                            destroyedWindows.append(event.window)
-                            
-                    for window in createdWindows:
-                        if window not in destroyedWindows:
-                            self.__enqueue(self.__grabHotkeysForWindow, window)
-
+                # Block until there is something to do. The display is looked up on each iteration, as it is replaced
+                # on keymap changes.
+                readable, w, e = select.select([self.localDisplay, wakeupFd], [], [])
+                if wakeupFd in readable:
+                    os.read(wakeupFd, 512)
                 if self.shutdown:
                     break
+                self.__processPendingEvents()
             except ConnectionClosedError:
                 # Autokey does not properly exit on logout. It causes an infinite exception loop, accumulating stack
                 # traces along. This acts like a memory leak, filling the system RAM until it hits an OOM condition.
@@ -929,18 +1594,132 @@ class XInterfaceBase(threading.Thread):
                 # the connection.
                 # See https://github.com/autokey/autokey/issues/198 for details
                 logger.exception("__flushEvents: Connection to the X server closed. Forcefully exiting Autokey now.")
-                import os
                 os._exit(1)
             except Exception:
                 logger.exception("__flushEvents: Some exception occured:")
                 pass
         logger.debug("__flushEvents: Left event loop.")
 
+    def __wakeListener(self, force: bool=False):
+        if self.shutdown and not force:
+            # The listener is stopping and the pipe is about to be closed
+            return
+        try:
+            os.write(self.__wakeupPipe[1], b"\0")
+        except BlockingIOError:
+            pass  # The pipe is full, so a wakeup is pending anyways.
+
+    def __processPendingEvents(self):
+        """
+        Process all events already received on the local display. This does not block and does not cause round trips.
+        """
+        grabbedKeyPresses = []
+        with self.__xEventLock:
+            windowsToGrab = []
+            destroyedWindows = set()
+            mappingChanges = []
+
+            for x in range(self.localDisplay.pending_events()):
+                event = self.localDisplay.next_event()
+                if event.type == X.KeyPress:
+                    # Only delivered for presses activating a grab of AutoKey
+                    grabbedKeyPresses.append(event)
+                elif event.type in (X.CreateNotify, X.MapNotify):
+                    windowsToGrab.append(event.window)
+                elif event.type == X.DestroyNotify:
+                    destroyedWindows.add(event.window.id)
+                    self.__windowInfoCache.invalidate(event.window.id, destroyed=True)
+                    self.__grabRegistry.forget_window(event.window.id)
+                    self.__focusTracker.invalidate()
+                elif event.type == X.ReparentNotify:
+                    self.__windowInfoCache.invalidate(event.window.id)
+                elif event.type == X.MappingNotify and event.request == X.MappingKeyboard:
+                    mappingChanges.append((event.first_keycode, event.count))
+                elif event.type == X.PropertyNotify:
+                    if event.atom == self.__activeWindowAtom:
+                        self.__focusTracker.invalidate()
+                    elif event.atom in self.__windowInfoAtoms:
+                        self.__windowInfoCache.invalidate(event.window.id)
+                        # A window filter may match the new title or class
+                        windowsToGrab.append(event.window)
+                elif event.type in (X.FocusIn, X.FocusOut) and event.mode not in (X.NotifyGrab, X.NotifyUngrab):
+                    # Keyboard grabs (done by AutoKey itself while sending) do not change the focused window.
+                    self.__focusTracker.invalidate()
+
+            if windowsToGrab or destroyedWindows:
+                with self.__windowsToGrabLock:
+                    passPending = bool(self.__windowsToGrab)
+                    for window in windowsToGrab:
+                        self.__windowsToGrab[window.id] = window
+                    for window_id in destroyedWindows:
+                        self.__windowsToGrab.pop(window_id, None)
+                    if self.__windowsToGrab and not passPending:
+                        self.__enqueue(self.__grabHotkeysForWindows, lane=WorkLane.BACKGROUND)
+
+        # Done without holding the event lock, as reading the window information processes events, too
+        for event in grabbedKeyPresses:
+            self.__allowGrabbedKeyPress(event)
+        for firstCode, count in mappingChanges:
+            self.__mappingNotified(firstCode, count)
+
+    def __processRoundTripEvents(self):
+        """
+        Called after requests waiting for a reply of the X server, which may be done by any thread. While waiting, Xlib
+        reads all events received before the reply into its queue. The listener thread is not woken up for those, as
+        the connection has already been read. A press of a hotkey grabbed synchronously in the root window freezes the
+        keyboard until it is decided on, so such events must not wait for the next wakeup of the listener.
+        """
+        if self.__syncGrabItems:
+            self.__processPendingEvents()
+
+    def __allowGrabbedKeyPress(self, event):
+        """
+        Decide on a press of a hotkey grabbed in the root window for hotkeys having a window filter. The keyboard is
+        frozen until then. If no window filter matches the focused window, the press is replayed to the focused
+        window, as if it was never grabbed. Otherwise, it is consumed and handled as a hotkey.
+        Presses of other grabs do not freeze the keyboard, for those this is a no-op.
+        """
+        replay = False
+        try:
+            lockBits = 0
+            for lockMask in self.__lockMasks():
+                lockBits |= lockMask
+            # Pointer button and keyboard group bits are not part of the grabbed modifier mask
+            items = self.__syncGrabItems.get((event.detail, event.state & MODIFIER_STATE_MASK & ~lockBits))
+            if items:
+                window_info = self.get_window_info()
+                replay = not any(item._should_trigger_window_title(window_info) for item in items)
+        except Exception:
+            logger.exception("Failed to check the window filter of a grabbed hotkey")
+            replay = True
+        finally:
+            # Never leave the keyboard frozen
+            self.localDisplay.allow_events(X.ReplayKeyboard if replay else X.AsyncKeyboard, event.time)
+            self.localDisplay.flush()
+
+    def __dispatchInput(self, method: typing.Callable, *args):
+        """
+        Hand an input event over for handling. With single hop input enabled, the event is handled right away, in the
+        thread of the input source. This saves the thread hand-overs via the event loop and the IoMediator queues.
+        Otherwise, it is queued in the input lane of the event loop.
+        """
+        if cm.ConfigManager.SETTINGS[cm.SINGLE_HOP_INPUT]:
+            try:
+                method(*args)
+            except Exception:
+                logger.exception("Error handling an input event")
+            self.__processRoundTripEvents()
+        else:
+            self.__enqueue(method, *args, lane=WorkLane.INPUT)
+
     def handle_keypress(self, keyCode):
-        self.__enqueue(self.__handleKeyPress, keyCode)
+        if self.__isFakeEventEcho(X.KeyPress, keyCode):
+            return
+        self.__dispatchInput(self.__handleKeyPress, keyCode)
     
     def __handleKeyPress(self, keyCode):
-        focus = self.localDisplay.get_input_focus().focus
+        tracing.mark(tracing.STAGE_HANDLE_KEY_PRESS)
+        focus = self.__getFocusWindow()
 
         modifier = self.__decodeModifier(keyCode)
         if modifier is not None:
@@ -950,7 +1729,9 @@ class XInterfaceBase(threading.Thread):
             self.mediator.handle_keypress(keyCode, window_info)
 
     def handle_keyrelease(self, keyCode):
-        self.__enqueue(self.__handleKeyrelease, keyCode)
+        if self.__isFakeEventEcho(X.KeyRelease, keyCode):
+            return
+        self.__dispatchInput(self.__handleKeyrelease, keyCode)
     
     def __handleKeyrelease(self, keyCode):
         modifier = self.__decodeModifier(keyCode)
@@ -958,13 +1739,15 @@ class XInterfaceBase(threading.Thread):
             self.mediator.handle_modifier_up(modifier)
             
     def handle_mouseclick(self, button, x, y):
-        self.__enqueue(self.__handleMouseclick, button, x, y)
+        self.__dispatchInput(self.__handleMouseclick, button, x, y)
         
     def __handleMouseclick(self, button, x, y):
         # Sleep a bit to timing issues. A mouse click might change the active application.
         # If so, the switch happens asynchronously somewhere during the execution of the first two queries below,
         # causing the queried window title (and maybe the window class or even none of those) to be invalid.
         time.sleep(0.005)  # TODO: may need some tweaking
+        # The click probably moved the focus. Do not wait for the focus change events and query the X server directly.
+        self.__focusTracker.invalidate()
         window_info = self.get_window_info()
         
         if x is None and y is None:
@@ -996,7 +1779,7 @@ class XInterfaceBase(threading.Thread):
         self.__sendKeyReleaseEvent(keyCode, modifiers, theWindow)
 
     def __checkWorkaroundNeeded(self):
-        focus = self.localDisplay.get_input_focus().focus
+        focus = self.__getFocusWindow()
         window_info = self.get_window_info(focus)
         w = self.app.configManager.workAroundApps
         if w.match(window_info.wm_title) or w.match(window_info.wm_class):
@@ -1015,9 +1798,45 @@ class XInterfaceBase(threading.Thread):
         if len(self.lastChars) > 10:
             self.lastChars.pop(0)
 
+    def __fakeInput(self, eventType, keyCode, swallowEcho: bool=True):
+        """
+        Send a key event using XTest. Used instead of synthetic events, if the XTest output setting is enabled, and for
+        the fake key events requested by scripts. The echo of the latter is handled as user input, as intended by the
+        scripts, but is still expected, so that the echoes of the other events are matched in order.
+        """
+        with self.__pendingFakeEventsLock:
+            self.__pendingFakeEvents.append((eventType, keyCode, time.monotonic(), swallowEcho))
+        xtest.fake_input(self.rootWindow, eventType, keyCode)
+
+    def __isFakeEventEcho(self, eventType, keyCode) -> bool:
+        """
+        Returns True, if the recorded key event is the echo of a previous __fakeInput() call, that must not be handled
+        as user input. Echoes are recorded in the order the fake events were sent, so only the oldest pending fake event
+        can match. Any other key event means that the pending echoes are stale, so all of them are discarded and no
+        physical key press is swallowed. Fake events not echoed within FAKE_EVENT_ECHO_TIMEOUT are discarded, too.
+        """
+        with self.__pendingFakeEventsLock:
+            pending = self.__pendingFakeEvents
+            expired = time.monotonic() - FAKE_EVENT_ECHO_TIMEOUT
+            while pending and pending[0][2] < expired:
+                pending.popleft()
+            if not pending:
+                return False
+            pendingType, pendingKeyCode, sendTime, swallowEcho = pending[0]
+            if pendingType == eventType and pendingKeyCode == keyCode:
+                pending.popleft()
+                return swallowEcho
+            pending.clear()
+            return False
+
     def __sendKeyPressEvent(self, keyCode, modifiers, theWindow=None):
+        tracing.mark(tracing.STAGE_FIRST_SEND)
+        if cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT]:
+            # XTest events use the real modifier state. Required modifiers are pressed separately by the callers.
+            self.__fakeInput(X.KeyPress, keyCode)
+            return
         if theWindow is None:
-            focus = self.localDisplay.get_input_focus().focus
+            focus = self.__getFocusWindow()
         else:
             focus = theWindow
         keyEvent = event.KeyPress(
@@ -1036,8 +1855,11 @@ class XInterfaceBase(threading.Thread):
         focus.send_event(keyEvent)
 
     def __sendKeyReleaseEvent(self, keyCode, modifiers, theWindow=None):
+        if cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT]:
+            self.__fakeInput(X.KeyRelease, keyCode)
+            return
         if theWindow is None:
-            focus = self.localDisplay.get_input_focus().focus
+            focus = self.__getFocusWindow()
         else:
             focus = theWindow
         keyEvent = event.KeyRelease(
@@ -1070,13 +1892,52 @@ class XInterfaceBase(threading.Thread):
     def get_window_info(self, window=None, traverse: bool=True) -> WindowInfo:
         try:
             if window is None:
-                window = self.localDisplay.get_input_focus().focus
-            return self._get_window_info(window, traverse)
+                window = self.__getFocusWindow()
+            if not traverse or isinstance(window, int):
+                # Only cache the lookups done for the focused window. The non-traversing lookups are done once per
+                # window while grabbing hotkeys, which would subscribe to events of every window without any benefit.
+                # An int is given, if there is no focus window (X.NONE or X.PointerRoot).
+                return self._get_window_info(window, traverse)
+            # Apply already received invalidation events, so that a just changed window title is not missed
+            self.__processPendingEvents()
+            cache = self.__windowInfoCache
+            window_info = cache.get(window.id)
+            if window_info is None:
+                visited = []
+                window_info = self._get_window_info(window, traverse, visited=visited)
+                if self.__watchWindows(visited):
+                    # Changes are only reported for already watched windows. If some window was not watched before,
+                    # it might have changed between reading and subscribing, so the result is not cached this time.
+                    cache.put(window.id, window_info, (visited_window.id for visited_window in visited))
+            return window_info
         except error.BadWindow:
             logger.exception("Got BadWindow error while requesting window information.")
             return self._create_window_info(window, "", "")
+        finally:
+            self.__processRoundTripEvents()
 
-    def _get_window_info(self, window, traverse: bool, wm_title: str=None, wm_class: str=None) -> WindowInfo:
+    def __watchWindows(self, windows) -> bool:
+        """
+        Subscribe to title, class, focus and structure changes of the given windows.
+        Returns True, if all windows were already watched before.
+        """
+        cache = self.__windowInfoCache
+        all_watched = True
+        for window in windows:
+            if window.id not in cache.watched and window != self.rootWindow:
+                # The root window already has an event mask set, which must not be overwritten.
+                window.change_attributes(
+                    event_mask=X.PropertyChangeMask|X.StructureNotifyMask|X.FocusChangeMask,
+                    onerror=error.CatchError()
+                )
+                cache.watched.add(window.id)
+                all_watched = False
+        return all_watched
+
+    def _get_window_info(self, window, traverse: bool, wm_title: str=None, wm_class: str=None,
+                         visited: list=None) -> WindowInfo:
+        if visited is not None:
+            visited.append(window)
         new_wm_title = self._try_get_window_title(window)
         new_wm_class = self._try_get_window_class(window)
 
@@ -1088,7 +1949,7 @@ class XInterfaceBase(threading.Thread):
         if traverse:
             # Recursive operation on the parent window
             if wm_title and wm_class:  # Both known, abort walking the tree and return the data.
-                return self._create_window_info(window, wm_title, wm_class)
+                return self._create_window_info(window, wm_title, wm_class, visited)
             else:  # At least one property is still not known. So walk the window tree up.
                 parent = window.query_tree().parent
                 # Stop traversal, if the parent is not a window. When querying the parent, at some point, an integer
@@ -1096,9 +1957,9 @@ class XInterfaceBase(threading.Thread):
                 if isinstance(parent, int):
                     # At this point, wm_title or wm_class may still be None. The recursive call with traverse=False
                     # will replace any None with an empty string. See below.
-                    return self._get_window_info(window, False, wm_title, wm_class)
+                    return self._get_window_info(window, False, wm_title, wm_class, visited)
                 else:
-                    return self._get_window_info(parent, traverse, wm_title, wm_class)
+                    return self._get_window_info(parent, traverse, wm_title, wm_class, visited)
 
         else:
             # No recursion, so fill unknown values with empty strings.
@@ -1106,9 +1967,9 @@ class XInterfaceBase(threading.Thread):
                 wm_title = ""
             if wm_class is None:
                 wm_class = ""
-            return self._create_window_info(window, wm_title, wm_class)
+            return self._create_window_info(window, wm_title, wm_class, visited)
 
-    def _create_window_info(self, window, wm_title: str, wm_class: str):
+    def _create_window_info(self, window, wm_title: str, wm_class: str, visited: list=None):
         """
         Creates a WindowInfo object from the window title and WM_CLASS.
         Also checks for the Java XFocusProxyWindow workaround and applies it if needed:
@@ -1120,7 +1981,7 @@ class XInterfaceBase(threading.Thread):
         if "FocusProxy" in wm_class:
             parent = window.query_tree().parent
             # Discard both the already known wm_class and window title, because both are known to be wrong.
-            return self._get_window_info(parent, False)
+            return self._get_window_info(parent, False, visited=visited)
         else:
             return WindowInfo(wm_title=wm_title, wm_class=wm_class)
 
@@ -1161,13 +2022,20 @@ class XInterfaceBase(threading.Thread):
         return self.get_window_info(window, traverse).wm_class
 
     def cancel(self):
+        self.__mappingChangeScheduler.cancel()
         logger.debug("XInterfaceBase: Try to exit event thread.")
-        self.queue.put_nowait((None, None))
+        # Served after the pending background jobs, once the input and output lanes are empty
+        self.queue.put(WorkLane.BACKGROUND, None, None)
         logger.debug("XInterfaceBase: Event thread exit marker enqueued.")
         self.shutdown = True
+        self.__wakeListener(force=True)
         logger.debug("XInterfaceBase: self.shutdown set to True. This should stop the listener thread.")
         self.listenerThread.join()
         self.eventThread.join()
+        # Only closed once no thread can use the pipe anymore. A job of the event thread might still have opened a new
+        # display, which could reuse the file descriptor numbers.
+        for fd in self.__wakeupPipe:
+            os.close(fd)
         self.localDisplay.flush()
         self.localDisplay.close()
         self.join()
@@ -1225,7 +2093,9 @@ class XRecordInterface(XInterfaceBase):
         while len(data):
             event, data = rq.EventField(None).parse_binary_value(data, self.recordDisplay.display, None, None)
             if event.type == X.KeyPress:
+                tracing.begin()
                 self.handle_keypress(event.detail)
+                tracing.end()
             elif event.type == X.KeyRelease:
                 self.handle_keyrelease(event.detail)
             elif event.type == X.ButtonPress:
@@ -1250,7 +2120,9 @@ class AtSpiInterface(XInterfaceBase):
 
     def __processKeyEvent(self, event):
         if event.type == pyatspi.KEY_PRESSED_EVENT:
+            tracing.begin()
             self.handle_keypress(event.hw_code)
+            tracing.end()
         else:
             self.handle_keyrelease(event.hw_code)
 
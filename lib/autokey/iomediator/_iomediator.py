@@ -2,13 +2,15 @@ import threading
 import queue
 import logging
 
-from ..configmanager import ConfigManager
+from ..configmanager import ConfigManager, XTEST_OUTPUT, SINGLE_HOP_INPUT
 from ..configmanager_constants import INTERFACE_TYPE
 from ..interface import XRecordInterface, AtSpiInterface
 from autokey.model import SendMode
+from autokey import tracing
 
 from .key import Key
-from .constants import X_RECORD_INTERFACE, KEY_SPLIT_RE, MODIFIERS, HELD_MODIFIERS
+from .constants import X_RECORD_INTERFACE, MODIFIERS, HELD_MODIFIERS
+from ._keyprogram import compile_key_program
 
 CURRENT_INTERFACE = None
 _logger = logging.getLogger("iomediator")
@@ -58,7 +60,7 @@ class IoMediator(threading.Thread):
     def shutdown(self):
         _logger.debug("IoMediator shutting down")
         self.interface.cancel()
-        self.queue.put_nowait((None, None))
+        self.queue.put_nowait((None, None, None))
         _logger.debug("Waiting for IoMediator thread to end")
         self.join()
         _logger.debug("IoMediator shutdown completed")
@@ -95,25 +97,39 @@ class IoMediator(threading.Thread):
         """
         Looks up the character for the given key code, applying any 
         modifiers currently in effect, and passes it to the expansion service.
+
+        With single hop input enabled, this is done right away in the calling thread. Otherwise, the key press is
+        queued for the IoMediator thread.
         """
-        self.queue.put_nowait((keyCode, window_info))
+        if ConfigManager.SETTINGS[SINGLE_HOP_INPUT]:
+            self.process_keypress(keyCode, window_info)
+        else:
+            self.queue.put_nowait((keyCode, window_info, tracing.current()))
         
     def run(self):
         while True:
-            keyCode, window_info = self.queue.get()
+            keyCode, window_info, trace = self.queue.get()
             if keyCode is None and window_info is None:
                 break
-            
-            numLock = self.modifiers[Key.NUMLOCK]
-            modifiers = self.__getModifiersOn()
-            shifted = self.modifiers[Key.CAPSLOCK] ^ self.modifiers[Key.SHIFT]
-            key = self.interface.lookup_string(keyCode, shifted, numLock, self.modifiers[Key.ALT_GR])
-            rawKey = self.interface.lookup_string(keyCode, False, False, False)
-            
-            for target in self.listeners:
-                target.handle_keypress(rawKey, modifiers, key, window_info)
-                
+
+            tracing.activate(trace)
+            self.process_keypress(keyCode, window_info)
+            tracing.end()
             self.queue.task_done()
+
+    def process_keypress(self, keyCode, window_info):
+        """
+        Looks up the character for the given key code and passes it to the expansion service, in the calling thread.
+        """
+        tracing.mark(tracing.STAGE_IOMEDIATOR)
+        numLock = self.modifiers[Key.NUMLOCK]
+        modifiers = self.__getModifiersOn()
+        shifted = self.modifiers[Key.CAPSLOCK] ^ self.modifiers[Key.SHIFT]
+        key = self.interface.lookup_string(keyCode, shifted, numLock, self.modifiers[Key.ALT_GR])
+        rawKey = self.interface.lookup_string(keyCode, False, False, False)
+
+        for target in self.listeners:
+            target.handle_keypress(rawKey, modifiers, key, window_info)
             
     def handle_mouse_click(self, rootX, rootY, relX, relY, button, windowInfo):
         for target in self.listeners:
@@ -128,37 +144,14 @@ class IoMediator(threading.Thread):
         if not string:
             return
 
-        string = string.replace('\n', "<enter>")
-        string = string.replace('\t', "<tab>")
-        
         _logger.debug("Send via event interface")
-        self.__clearModifiers()
-        modifiers = []
-        for section in KEY_SPLIT_RE.split(string):
-            if len(section) > 0:
-                if Key.is_key(section[:-1]) and section[-1] == '+' and section[:-1] in MODIFIERS:
-                    # Section is a modifier application (modifier followed by '+')
-                    modifiers.append(section[:-1])
-                    
-                else:
-                    if len(modifiers) > 0:
-                        # Modifiers ready for application - send modified key
-                        if Key.is_key(section):
-                            self.interface.send_modified_key(section, modifiers)
-                            modifiers = []
-                        else:
-                            self.interface.send_modified_key(section[0], modifiers)
-                            if len(section) > 1:
-                                self.interface.send_string(section[1:])
-                            modifiers = []
-                    else:
-                        # Normal string/key operation
-                        if Key.is_key(section):
-                            self.interface.send_key(section)
-                        else:
-                            self.interface.send_string(section)
-                            
-        self.__reapplyModifiers()
+        # The parsed expansion string is cached, so sending the same phrase again needs no parsing.
+        program = compile_key_program(string)
+        # All operations are passed to the interface as one batch, which is processed as a single job.
+        operations = self.__clearModifiers()
+        operations += program.operations
+        operations += self.__reapplyModifiers()
+        self.interface.send_batch(operations)
         
     def paste_string(self, string, pasteCommand: SendMode):
         if len(string) > 0:
@@ -166,20 +159,7 @@ class IoMediator(threading.Thread):
             self.interface.send_string_clipboard(string, pasteCommand)
 
     def remove_string(self, string):
-        backspaces = -1  # Start from -1 to discount the backspace already pressed by the user
-        
-        for section in KEY_SPLIT_RE.split(string):
-            if Key.is_key(section):
-                # TODO: Only a subset of keys defined in Key are printable, thus require a backspace.
-                # Many keys are not printable, like the modifier keys or F-Keys.
-                # If the current key is a modifier, it may affect the printability of the next character.
-                # For example, if section == <alt>, and the next section begins with "+a", both the "+" and "a" are not
-                # printable, because both belong to the keyboard combination "<alt>+a"
-                backspaces += 1
-            else:
-                backspaces += len(section)
-                
-        self.send_backspace(backspaces)
+        self.send_backspace(compile_key_program(string).backspaces)
 
     def send_key(self, keyName):
         keyName = keyName.replace('\n', "<enter>")
@@ -201,43 +181,59 @@ class IoMediator(threading.Thread):
         """
         Sends the given number of left key presses.
         """
-        for i in range(count):
-            self.interface.send_key(Key.LEFT)
+        self.interface.send_key_repeated(Key.LEFT, count)
 
     def send_right(self, count):
-        for i in range(count):
-            self.interface.send_key(Key.RIGHT)
+        self.interface.send_key_repeated(Key.RIGHT, count)
     
     def send_up(self, count):
         """
         Sends the given number of up key presses.
         """        
-        for i in range(count):
-            self.interface.send_key(Key.UP)
+        self.interface.send_key_repeated(Key.UP, count)
 
     def send_backspace(self, count):
         """
         Sends the given number of backspace key presses.
         """
-        for i in range(count):
-            self.interface.send_key(Key.BACKSPACE)
+        self.interface.send_key_repeated(Key.BACKSPACE, count)
 
     def flush(self):
         self.interface.flush()
         
     # Utility methods ----
     
-    def __clearModifiers(self):
+    def __clearModifiers(self) -> list:
+        """
+        Returns the output operations needed to release the currently held modifiers, so that they do not affect the
+        sent keys.
+        """
+        operations = []
         self.releasedModifiers = []
         
         for modifier in list(self.modifiers.keys()):
             if self.modifiers[modifier] and modifier not in (Key.CAPSLOCK, Key.NUMLOCK):
                 self.releasedModifiers.append(modifier)
-                self.interface.release_key(modifier)
-
-    def __reapplyModifiers(self):
+                operations.append(("release_key", (modifier,)))
+
+        if ConfigManager.SETTINGS[XTEST_OUTPUT] and self.modifiers[Key.CAPSLOCK]:
+            # XTest input is affected by the real lock state, so temporarily switch Capslock off.
+            operations.append(("press_key", (Key.CAPSLOCK,)))
+            operations.append(("release_key", (Key.CAPSLOCK,)))
+        return operations
+
+    def __reapplyModifiers(self) -> list:
+        operations = []
+        if ConfigManager.SETTINGS[XTEST_OUTPUT]:
+            if self.modifiers[Key.CAPSLOCK]:
+                operations.append(("press_key", (Key.CAPSLOCK,)))
+                operations.append(("release_key", (Key.CAPSLOCK,)))
+            # Releasing modifiers using XTest changes the real keyboard state. Pressing them again would leave them
+            # stuck, if the user let go of them in the meantime. So they stay released until pressed again.
+            return operations
         for modifier in self.releasedModifiers:
-            self.interface.press_key(modifier)
+            operations.append(("press_key", (modifier,)))
+        return operations
 
     def __getModifiersOn(self):
         modifiers = []
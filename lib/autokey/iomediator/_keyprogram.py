@@ -0,0 +1,102 @@
+"""
+Compiled "key programs": The output operations needed to type a phrase expansion string.
+
+Parsing an expansion string into literal text, special keys and modified-key chords requires splitting it with a
+regular expression and checking every section against the known key names. Phrases are sent over and over again with
+the same expansion string, so the parsing result is cached, keyed by the string itself. A changed phrase text results
+in a different string and therefore in a freshly compiled program.
+"""
+
+import functools
+import typing
+
+from .key import Key
+from .constants import KEY_SPLIT_RE, MODIFIERS
+
+# Number of distinct expansion strings kept compiled
+KEY_PROGRAM_CACHE_SIZE = 256
+
+Operation = typing.Tuple[str, tuple]
+
+
+class KeyProgram:
+    """
+    The output operations of an expansion string, in the format accepted by XInterfaceBase.send_batch(), and the
+    number of backspaces needed to erase the typed string again.
+    """
+
+    __slots__ = ("operations", "backspaces")
+
+    def __init__(self, operations: typing.Tuple[Operation, ...], backspaces: int):
+        self.operations = operations
+        self.backspaces = backspaces
+
+
+@functools.lru_cache(maxsize=KEY_PROGRAM_CACHE_SIZE)
+def compile_key_program(string: str) -> KeyProgram:
+    """Returns the compiled key program of the given expansion string. The result is cached and must not be altered."""
+    return KeyProgram(tuple(_compile_operations(string)), _count_backspaces(string))
+
+
+def _compile_operations(string: str) -> typing.List[Operation]:
+    string = string.replace('\n', "<enter>")
+    string = string.replace('\t', "<tab>")
+
+    operations = []  # type: typing.List[Operation]
+    modifiers = []
+    for section in KEY_SPLIT_RE.split(string):
+        if len(section) > 0:
+            if Key.is_key(section[:-1]) and section[-1] == '+' and section[:-1] in MODIFIERS:
+                # Section is a modifier application (modifier followed by '+')
+                modifiers.append(section[:-1])
+
+            else:
+                if len(modifiers) > 0:
+                    # Modifiers ready for application - send modified key
+                    if Key.is_key(section):
+                        operations.append(("send_modified_key", (section, tuple(modifiers))))
+                        modifiers = []
+                    else:
+                        operations.append(("send_modified_key", (section[0], tuple(modifiers))))
+                        if len(section) > 1:
+                            operations.append(("send_string", (section[1:],)))
+                        modifiers = []
+                else:
+                    # Normal string/key operation
+                    if Key.is_key(section):
+                        _append_send_key(operations, section)
+                    else:
+                        operations.append(("send_string", (section,)))
+    return operations
+
+
+def _append_send_key(operations: typing.List[Operation], key_name: str):
+    """
+    Append sending the given key to the output operations. Runs of the same key, like the cursor movements added
+    by the cursor macro, are merged into a single repeated key operation.
+    """
+    if operations:
+        name, args = operations[-1]
+        if name == "send_key" and args[0] == key_name:
+            operations[-1] = ("send_key_repeated", (key_name, 2))
+            return
+        if name == "send_key_repeated" and args[0] == key_name:
+            operations[-1] = ("send_key_repeated", (key_name, args[1] + 1))
+            return
+    operations.append(("send_key", (key_name,)))
+
+
+def _count_backspaces(string: str) -> int:
+    backspaces = -1  # Start from -1 to discount the backspace already pressed by the user
+
+    for section in KEY_SPLIT_RE.split(string):
+        if Key.is_key(section):
+            # TODO: Only a subset of keys defined in Key are printable, thus require a backspace.
+            # Many keys are not printable, like the modifier keys or F-Keys.
+            # If the current key is a modifier, it may affect the printability of the next character.
+            # For example, if section == <alt>, and the next section begins with "+a", both the "+" and "a" are not
+            # printable, because both belong to the keyboard combination "<alt>+a"
+            backspaces += 1
+        else:
+            backspaces += len(section)
+    return backspaces
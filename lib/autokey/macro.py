@@ -1,9 +1,23 @@
+import collections
+import concurrent.futures
 import datetime
+import functools
+import logging
+import os
+import os.path
+import threading
+import typing
 from abc import abstractmethod
 
 from autokey.iomediator.constants import KEY_SPLIT_RE
 from autokey.iomediator.key import Key
 from autokey import common
+from autokey import configmanager as cm
+
+_logger = logging.getLogger("macro")
+
+# Maximum number of script macros of a phrase run at the same time
+SCRIPT_MACRO_WORKERS = 4
 
 if common.USING_QT:
     from PyQt5.QtWidgets import QAction
@@ -39,6 +53,13 @@ class MacroManager:
         self.macros.append(DateMacro())
         self.macros.append(FileContentsMacro())
         self.macros.append(CursorMacro())
+        self.macrosById = {macro.ID: macro for macro in self.macros}
+        self.scriptExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=SCRIPT_MACRO_WORKERS)
+
+    def shutdown(self):
+        self.scriptExecutor.shutdown(wait=False)
+        for macro in self.macros:
+            macro.shutdown()
         
     def get_menu(self, callback, menu=None):
         if common.USING_QT:
@@ -58,13 +79,91 @@ class MacroManager:
         return menu
         
     def process_expansion(self, expansion):
-        parts = KEY_SPLIT_RE.split(expansion.string)
-        
-        for macro in self.macros:        
-            macro.process(parts)
-        
+        template = compile_template(expansion.string)
+        if not template.nodes:
+            # Static text, nothing to expand
+            return
+
+        parts = list(template.parts)
+        nodes = template.nodes
+        scriptNodes = [node for node in nodes if node.macro_id == ScriptMacro.ID]
+        if len(scriptNodes) > 1 and cm.ConfigManager.SETTINGS[cm.CONCURRENT_SCRIPT_MACROS]:
+            self.__runScriptsConcurrently(parts, scriptNodes)
+            # Script nodes are evaluated first, so the remaining nodes follow them.
+            nodes = nodes[len(scriptNodes):]
+
+        for node in nodes:
+            self.macrosById[node.macro_id].evaluate(parts, node)
+
         expansion.string = ''.join(parts)
-        
+
+    def __runScriptsConcurrently(self, parts, nodes):
+        """
+        Run the scripts of the given script macro nodes on the worker pool and insert their return values in order.
+        """
+        scriptMacro = self.macrosById[ScriptMacro.ID]  # type: ScriptMacro
+        futures = [self.scriptExecutor.submit(scriptMacro.run, node) for node in nodes]
+        for node, future in zip(nodes, futures):
+            parts[node.index] = future.result()
+
+
+class MacroNode:
+    """
+    A macro invocation inside a compiled template: The index of the macro token in the template parts and the parsed
+    macro arguments. If the arguments are invalid, the error message is raised when the macro is evaluated.
+    """
+
+    __slots__ = ("macro_id", "index", "args", "error")
+
+    def __init__(self, macro_id: str, index: int, args: typing.Optional[typing.Dict[str, str]],
+                 error: typing.Optional[str]=None):
+        self.macro_id = macro_id
+        self.index = index
+        self.args = args
+        self.error = error
+
+
+class Template:
+    """
+    A phrase text parsed into literal parts and macro nodes. The parts contain the literal text and, at the node
+    indices, the original macro tokens. The nodes are sorted in macro evaluation order.
+    """
+
+    __slots__ = ("parts", "nodes")
+
+    def __init__(self, parts: typing.Tuple[str, ...], nodes: typing.Tuple[MacroNode, ...]):
+        self.parts = parts
+        self.nodes = nodes
+
+
+# Number of distinct phrase texts kept compiled
+TEMPLATE_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(string: str) -> Template:
+    """
+    Parse the given phrase text into a Template. The result is cached and must not be altered. Macros are evaluated
+    in the order Script, Date, File and Cursor, as the cursor position depends on the text inserted by the others.
+    """
+    parts = KEY_SPLIT_RE.split(string)
+    order = {macro_class.ID: position for position, macro_class in enumerate(MACRO_CLASSES)}
+    nodes = []
+    for index, part in enumerate(parts):
+        if KEY_SPLIT_RE.match(part):
+            macro_id = part[1:-1].split(' ', 1)[0]
+            if macro_id in order:
+                nodes.append(_compile_node(MACRO_CLASSES[order[macro_id]], part, index))
+    nodes.sort(key=lambda node: (order[node.macro_id], node.index))
+    return Template(tuple(parts), tuple(nodes))
+
+
+def _compile_node(macro_class, token: str, index: int) -> MacroNode:
+    try:
+        return MacroNode(macro_class.ID, index, macro_class.parse_args(token))
+    except Exception as e:
+        return MacroNode(macro_class.ID, index, None, str(e))
+
 
 class AbstractMacro:
 
@@ -75,13 +174,8 @@ class AbstractMacro:
         ret += ">"
         return ret
             
-    def _can_process(self, token):
-        if KEY_SPLIT_RE.match(token):
-            return token[1:-1].split(' ', 1)[0] == self.ID
-        else:
-            return False
-        
-    def _get_args(self, token):
+    @classmethod
+    def parse_args(cls, token):
         l = token[:-1].split(' ')
         ret = {}
                 
@@ -90,19 +184,23 @@ class AbstractMacro:
                 key, val = arg.split('=', 1)
                 ret[key] = val
 
-        for k, v in self.ARGS:
+        for k, v in cls.ARGS:
             if k not in ret:
-                raise Exception("Missing mandatory argument '{}' for macro '{}'".format(k, self.ID))
+                raise Exception("Missing mandatory argument '{}' for macro '{}'".format(k, cls.ID))
         
         return ret
-        
-    def process(self, parts):
-        for i in range(len(parts)):
-            if self._can_process(parts[i]):
-                self.do_process(parts, i)
+
+    def evaluate(self, parts, node: MacroNode):
+        if node.error is not None:
+            raise Exception(node.error)
+        self.do_process(parts, node.index, node.args)
 
     @abstractmethod
-    def do_process(self, parts, i):
+    def do_process(self, parts, i, args):
+        pass
+
+    def shutdown(self):
+        """Release the resources held by the macro."""
         pass
 
 
@@ -112,7 +210,7 @@ class CursorMacro(AbstractMacro):
     TITLE = _("Position cursor")
     ARGS = []
     
-    def do_process(self, parts, i):
+    def do_process(self, parts, i, args):
         try:
             lefts = len(''.join(parts[i+1:]))
             parts.append(Key.LEFT * lefts)
@@ -130,9 +228,18 @@ class ScriptMacro(AbstractMacro):
     
     def __init__(self, engine):
         self.engine = engine
+
+    def run(self, node: MacroNode) -> str:
+        """
+        Run the script of the given node and return its return value. The macro arguments and the return value are
+        kept per thread by the Engine, so this can be called by multiple threads at the same time.
+        """
+        if node.error is not None:
+            raise Exception(node.error)
+        self.engine.run_script_from_macro(node.args)
+        return self.engine.get_return_value()
     
-    def do_process(self, parts, i):
-        args = self._get_args(parts[i])
+    def do_process(self, parts, i, args):
         self.engine.run_script_from_macro(args)
         parts[i] = self.engine.get_return_value()
 
@@ -143,20 +250,183 @@ class DateMacro(AbstractMacro):
     TITLE = _("Insert date")
     ARGS = [("format", _("Format"))]
     
-    def do_process(self, parts, i):
-        format_ = self._get_args(parts[i])["format"]
+    def do_process(self, parts, i, args):
+        format_ = args["format"]
         date = datetime.datetime.now().strftime(format_)
         parts[i] = date
 
 
+# Maximum total size of the file contents kept by the FileContentCache, in bytes
+FILE_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+
+class _CachedFile:
+
+    __slots__ = ("content", "mtime", "size", "watched")
+
+    def __init__(self, content: str, mtime: float, size: int, watched: bool):
+        self.content = content
+        self.mtime = mtime
+        self.size = size
+        # True, if changes to the file are reported by the file monitor, which refreshes the content in the background.
+        self.watched = watched
+
+
+class FileContentCache:
+    """
+    Keeps the contents of the files inserted by the file macro, so that expanding a phrase does not need to read the
+    file again. A cached content is validated by comparing the modification time and size of the file. If the
+    watchMacroFiles setting is enabled, the directories of cached files are watched using a FileMonitor, too. Changed
+    files are then read again in the background, once they are completely written. The validation is still done on
+    each read, as changes on network file systems are not reported by inotify.
+
+    The least recently used contents are evicted, when the total size exceeds max_bytes. Larger files are not cached.
+    """
+
+    def __init__(self, max_bytes: int=FILE_CACHE_MAX_BYTES):
+        self.maxBytes = max_bytes
+        self.totalBytes = 0
+        self.__lock = threading.Lock()
+        self.__files = collections.OrderedDict()  # type: typing.Dict[str, _CachedFile]
+        self.__monitor = None
+        self.__watchedDirs = collections.Counter()  # type: typing.Dict[str, int]
+
+    def read(self, name: str) -> str:
+        path = os.path.abspath(name)
+        watch = cm.ConfigManager.SETTINGS[cm.WATCH_MACRO_FILES]
+        with self.__lock:
+            cached = self.__files.get(path)
+            if cached is not None:
+                self.__files.move_to_end(path)
+        if watch:
+            # Watch before reading, so that no change after reading is missed.
+            watch = self.__watchDirectory(os.path.dirname(path))
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self.__lock:
+                self.__unwatchDirectory(os.path.dirname(path), watch)
+            raise
+        if cached is not None and (cached.mtime, cached.size) == (stat.st_mtime, stat.st_size):
+            with self.__lock:
+                if watch and not cached.watched and self.__files.get(path) is cached:
+                    # The entry takes over the just obtained watch.
+                    cached.watched = True
+                else:
+                    self.__unwatchDirectory(os.path.dirname(path), watch)
+            return cached.content
+
+        try:
+            with open(path, "r") as inputFile:
+                content = inputFile.read()
+        except Exception:
+            with self.__lock:
+                self.__unwatchDirectory(os.path.dirname(path), watch)
+            raise
+        self.__store(path, _CachedFile(content, stat.st_mtime, stat.st_size, watch))
+        return content
+
+    def __store(self, path: str, cachedFile: _CachedFile):
+        with self.__lock:
+            replaced = self.__files.pop(path, None)
+            if replaced is not None:
+                self.totalBytes -= replaced.size
+                self.__unwatchDirectory(os.path.dirname(path), replaced.watched)
+            if cachedFile.size > self.maxBytes:
+                self.__unwatchDirectory(os.path.dirname(path), cachedFile.watched)
+                return
+            self.__files[path] = cachedFile
+            self.totalBytes += cachedFile.size
+            while self.totalBytes > self.maxBytes:
+                evictedPath, evicted = self.__files.popitem(last=False)
+                self.totalBytes -= evicted.size
+                self.__unwatchDirectory(os.path.dirname(evictedPath), evicted.watched)
+
+    def __watchDirectory(self, directory: str) -> bool:
+        """Start watching the given directory for a cached file in it. Returns False, if watching is not possible."""
+        try:
+            with self.__lock:
+                if self.__monitor is None:
+                    # Imported here, so that inotify is only used if required.
+                    from autokey import monitor
+                    self.__monitor = monitor.FileMonitor(self, monitor.COMPLETED_FILE_MASK)
+                    self.__monitor.start()
+                if self.__watchedDirs[directory] == 0 and not self.__monitor.add_watch(directory):
+                    # Files in this directory keep being validated using their modification time.
+                    return False
+                self.__watchedDirs[directory] += 1
+            return True
+        except Exception:
+            _logger.exception("Unable to watch %s for changes. Falling back to checking file modification times.",
+                              directory)
+            return False
+
+    def __unwatchDirectory(self, directory: str, watched: bool):
+        """Release a watch obtained by __watchDirectory(). Must be called while holding the lock."""
+        if not watched:
+            return
+        self.__watchedDirs[directory] -= 1
+        if self.__watchedDirs[directory] <= 0:
+            del self.__watchedDirs[directory]
+            try:
+                self.__monitor.remove_watch(directory)
+            except Exception:
+                _logger.exception("Unable to stop watching %s", directory)
+
+    # Listener interface of the FileMonitor
+
+    def path_created_or_modified(self, path: str):
+        with self.__lock:
+            cached = self.__files.get(path)
+        if cached is None:
+            return
+        # Refresh in the monitor thread, so that the next expansion finds the new content.
+        try:
+            stat = os.stat(path)
+            with open(path, "r") as inputFile:
+                content = inputFile.read()
+        except OSError:
+            self.path_removed(path)
+            return
+        _logger.debug("Refreshed cached content of %s", path)
+        with self.__lock:
+            if not self.__watchedDirs[os.path.dirname(path)]:
+                # The watch was just released. The cached entry is validated using the modification time when read.
+                return
+            # Obtain a reference to the watch for the new entry. The one of the replaced entry is released by __store().
+            self.__watchedDirs[os.path.dirname(path)] += 1
+        self.__store(path, _CachedFile(content, stat.st_mtime, stat.st_size, True))
+
+    def path_removed(self, path: str):
+        with self.__lock:
+            cached = self.__files.pop(path, None)
+            if cached is not None:
+                _logger.debug("Dropped cached content of %s", path)
+                self.totalBytes -= cached.size
+                self.__unwatchDirectory(os.path.dirname(path), cached.watched)
+
+    def shutdown(self):
+        if self.__monitor is not None:
+            self.__monitor.stop()
+            self.__monitor = None
+
+
 class FileContentsMacro(AbstractMacro):
 
     ID = "file"
     TITLE = _("Insert file contents")
     ARGS = [("name", _("File name"))]
+
+    def __init__(self):
+        self.cache = FileContentCache()
     
-    def do_process(self, parts, i):
-        name = self._get_args(parts[i])["name"]
-        
-        with open(name, "r") as inputFile:
-            parts[i] = inputFile.read()
+    def do_process(self, parts, i, args):
+        parts[i] = self.cache.read(args["name"])
+
+    def shutdown(self):
+        self.cache.shutdown()
+
+
+# All macros, in evaluation order
+MACRO_CLASSES = (ScriptMacro, DateMacro, FileContentsMacro, CursorMacro)
@@ -0,0 +1,382 @@
+"""
+Trigger lookup structures used by the expansion service.
+
+The AbbreviationIndex is built once per configuration change. It allows the service to only evaluate the few items
+whose abbreviation actually ends at the current input position, instead of checking every configured abbreviation
+on each keystroke. The StreamingMatcher follows the typed input one character at a time on top of such an index.
+
+The HotkeyTable maps a pressed key combination directly to the global hotkeys, items and folders bound to it.
+The WindowFilterCache remembers which window-filtered folders and items may trigger in the recently focused windows.
+"""
+
+import collections
+import typing
+
+from autokey import model
+
+# Number of distinct windows for which the WindowFilterCache keeps the evaluated window filters.
+WINDOW_FILTER_CACHE_SIZE = 32
+
+
+def _fold_case(text: str) -> str:
+    """
+    Lower-case the given text one character at a time, the same way the typed input is folded key by key. Lowering the
+    whole string instead would apply context-sensitive rules, like the final form of the Greek sigma, which can not be
+    known while the input is typed. The final sigma itself is folded to the regular one, so that an abbreviation
+    containing it still finds its candidates. The final decision is made by check_input() anyway.
+    """
+    return "".join(char.lower() for char in text).replace("\u03c2", "\u03c3")
+
+
+# An abbreviation either ends at the end of the input buffer (immediate mode) or is followed by exactly one trigger
+# character. Candidates are therefore collected at these two positions.
+_TRIGGER_OFFSETS = (0, 1)
+
+
+class _Automaton:
+    """
+    Aho-Corasick automaton over a set of string patterns. Each state represents the longest suffix of the consumed
+    input that is also a prefix of some pattern.
+    """
+
+    def __init__(self, patterns: typing.Dict[str, typing.List[int]]):
+        self._goto = [{}]  # type: typing.List[typing.Dict[str, int]]
+        self._fail = [0]  # type: typing.List[int]
+        self._output = [()]  # type: typing.List[typing.Tuple[int, ...]]
+        # Link to the nearest state reachable via failure links that has a non-empty output.
+        self._output_link = [0]  # type: typing.List[int]
+
+        for pattern, values in patterns.items():
+            self._add_pattern(pattern, tuple(values))
+        self._build_failure_links()
+
+    def _add_pattern(self, pattern: str, values: typing.Tuple[int, ...]):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._output_link.append(0)
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state] += values
+
+    def _build_failure_links(self):
+        queue = list(self._goto[0].values())
+        index = 0
+        while index < len(queue):
+            state = queue[index]
+            index += 1
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = fail
+                self._output_link[next_state] = fail if self._output[fail] else self._output_link[fail]
+
+    def step(self, state: int, char: str) -> int:
+        """Advance the automaton by one character."""
+        goto = self._goto
+        while state and char not in goto[state]:
+            state = self._fail[state]
+        return goto[state].get(char, 0)
+
+    def matches(self, state: int) -> typing.Iterator[int]:
+        """Yield the values of all patterns that end at the given state."""
+        if not self._output[state]:
+            state = self._output_link[state]
+        while state:
+            yield from self._output[state]
+            state = self._output_link[state]
+
+
+# Pair of states of the case-sensitive and the case-insensitive automaton.
+MatchState = typing.Tuple[int, int]
+
+
+class AbbreviationIndex:
+    """
+    Multi-pattern index over the abbreviations of all folders and items that use the abbreviation trigger mode.
+
+    Abbreviations with ignoreCase set are stored case-folded in a separate automaton that is fed the case-folded
+    input. The index only pre-selects candidates. The final decision is still made by the item's check_input().
+    """
+
+    def __init__(self, folders: typing.Iterable[model.Folder], items: typing.Iterable[model.Item]):
+        # Folders and items are kept in their configuration order, so that lookups return candidates in the same
+        # order in which the service used to scan the full lists.
+        self._folders = [folder for folder in folders if model.TriggerMode.ABBREVIATION in folder.modes]
+        self._items = [item for item in items if model.TriggerMode.ABBREVIATION in item.modes]
+        entries = self._folders + self._items
+
+        exact_patterns = {}  # type: typing.Dict[str, typing.List[int]]
+        folded_patterns = {}  # type: typing.Dict[str, typing.List[int]]
+        for rank, entry in enumerate(entries):
+            for abbreviation in entry.abbreviations:
+                if not abbreviation:
+                    continue
+                if entry.ignoreCase:
+                    folded_patterns.setdefault(_fold_case(abbreviation), []).append(rank)
+                else:
+                    exact_patterns.setdefault(abbreviation, []).append(rank)
+
+        self._entries = entries
+        self._exact = _Automaton(exact_patterns)
+        self._folded = _Automaton(folded_patterns)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def initial_state(self) -> MatchState:
+        """Return the automaton state for an empty input buffer."""
+        return 0, 0
+
+    def advance(self, state: MatchState, char: str) -> MatchState:
+        """Return the state reached by appending the given character to the input described by state."""
+        exact_state, folded_state = state
+        exact_state = self._exact.step(exact_state, char)
+        for folded_char in _fold_case(char):
+            folded_state = self._folded.step(folded_state, folded_char)
+        return exact_state, folded_state
+
+    def candidates_at(self, states: typing.Iterable[MatchState]) -> typing.Tuple[
+            typing.List[model.Folder], typing.List[model.Item]]:
+        """
+        Return the folders and items that have an abbreviation ending at any of the given states. Both lists are
+        sorted in configuration order.
+        """
+        ranks = set()
+        for exact_state, folded_state in states:
+            ranks.update(self._exact.matches(exact_state))
+            ranks.update(self._folded.matches(folded_state))
+
+        folder_count = len(self._folders)
+        folders = []
+        items = []
+        for rank in sorted(ranks):
+            if rank < folder_count:
+                folders.append(self._entries[rank])
+            else:
+                items.append(self._entries[rank])
+        return folders, items
+
+    def find_candidates(self, buffer: str) -> typing.Tuple[typing.List[model.Folder], typing.List[model.Item]]:
+        """
+        Return the folders and items that have an abbreviation ending at one of the possible trigger positions of the
+        given input buffer. Both lists are sorted in configuration order.
+        """
+        states = []
+        state = self.initial_state()
+        last_index = len(buffer) - 1
+        for index, char in enumerate(buffer):
+            state = self.advance(state, char)
+            if last_index - index in _TRIGGER_OFFSETS:
+                states.append(state)
+        return self.candidates_at(states)
+
+
+class StreamingMatcher:
+    """
+    Incremental matcher that follows the input stack of the expansion service one character at a time.
+
+    It keeps one automaton state per character in the input stack, so appending a character costs a single
+    automaton step and a backspace simply drops the last state. The candidates for the current input are read from
+    the last two states, without re-joining or re-scanning the input buffer.
+    """
+
+    def __init__(self, index: AbbreviationIndex, max_length: int):
+        self.index = index
+        self._states = collections.deque(maxlen=max_length)  # type: typing.Deque[MatchState]
+
+    def push(self, char: str):
+        """Advance the matcher by one typed character."""
+        state = self._states[-1] if self._states else self.index.initial_state()
+        self._states.append(self.index.advance(state, char))
+
+    def pop(self):
+        """Undo the last character, e.g. when the user typed a backspace."""
+        try:
+            self._states.pop()
+        except IndexError:
+            # in case the input is already empty
+            pass
+
+    def reset(self):
+        """Forget all typed input."""
+        self._states.clear()
+
+    def rebuild(self, index: AbbreviationIndex, buffer: typing.Iterable[str]):
+        """Switch to a new index (after a configuration change) and re-feed the current input buffer."""
+        self.index = index
+        self._states.clear()
+        for char in buffer:
+            self.push(char)
+
+    def candidates(self) -> typing.Tuple[typing.List[model.Folder], typing.List[model.Item]]:
+        """Return the folders and items whose abbreviation ends at one of the possible trigger positions."""
+        length = len(self._states)
+        states = [self._states[length - 1 - offset] for offset in _TRIGGER_OFFSETS if offset < length]
+        return self.index.candidates_at(states)
+
+
+# Dictionary key of the HotkeyTable: The set of pressed modifiers and the pressed key.
+HotkeyCombination = typing.Tuple[typing.FrozenSet[str], str]
+HotkeyCandidates = typing.Tuple[list, typing.List[model.Item], typing.List[model.Folder]]
+
+
+class HotkeyTable:
+    """
+    Dispatch table from (modifiers, key) to the global hotkeys, items and folders that use this key combination.
+
+    The table only pre-selects candidates by their key combination. The final decision, including the window filter
+    evaluation, is still made by the candidate's check_hotkey(). Each bucket keeps its entries in configuration order,
+    so that the first matching item is the same one the service found by scanning the full lists. Entries added later
+    are inserted at their configuration position, if given, and appended otherwise.
+    The table is rebuilt on each configuration change and updated in between, when single hotkeys are created or
+    removed by the user interface.
+    """
+
+    def __init__(self, global_hotkeys: typing.Iterable, items: typing.Iterable[model.Item],
+                 folders: typing.Iterable[model.Folder]):
+        self._global_hotkeys = {}  # type: typing.Dict[HotkeyCombination, list]
+        self._items = {}  # type: typing.Dict[HotkeyCombination, typing.List[model.Item]]
+        self._folders = {}  # type: typing.Dict[HotkeyCombination, typing.List[model.Folder]]
+        # Reverse mapping, used to remove entries even after their hotkey was changed in place.
+        self._combinations = {}  # type: typing.Dict[typing.Any, HotkeyCombination]
+
+        for hotkey in global_hotkeys:
+            self._add(self._global_hotkeys, hotkey)
+        for item in items:
+            self._add(self._items, item)
+        for folder in folders:
+            self._add(self._folders, folder)
+
+    def __len__(self):
+        return len(self._combinations)
+
+    def copy(self) -> "HotkeyTable":
+        """Return an independent copy of this table, which can be modified without affecting readers of this one."""
+        table = HotkeyTable((), (), ())
+        table._global_hotkeys = {combination: list(bucket) for combination, bucket in self._global_hotkeys.items()}
+        table._items = {combination: list(bucket) for combination, bucket in self._items.items()}
+        table._folders = {combination: list(bucket) for combination, bucket in self._folders.items()}
+        table._combinations = dict(self._combinations)
+        return table
+
+    @staticmethod
+    def combination(modifiers: typing.Iterable[str], key: str) -> HotkeyCombination:
+        return frozenset(modifiers), key
+
+    def _bucket_for(self, entry) -> typing.Dict[HotkeyCombination, list]:
+        if isinstance(entry, model.Folder):
+            return self._folders
+        elif isinstance(entry, (model.Phrase, model.Script)):
+            return self._items
+        else:
+            return self._global_hotkeys
+
+    def _add(self, buckets: typing.Dict[HotkeyCombination, list], entry, ranks: typing.Mapping[typing.Any, int]=None):
+        if entry.hotKey is None:
+            return
+        combination = self.combination(entry.modifiers, entry.hotKey)
+        bucket = buckets.setdefault(combination, [])
+        rank = ranks.get(entry) if ranks is not None else None
+        if rank is None:
+            bucket.append(entry)
+        else:
+            # Before the first entry coming later in the configuration. Entries of unknown position are kept in front.
+            index = next((index for index, other in enumerate(bucket) if ranks.get(other, -1) > rank), len(bucket))
+            bucket.insert(index, entry)
+        self._combinations[entry] = combination
+
+    def add(self, entry, ranks: typing.Mapping[typing.Any, int]=None):
+        """
+        Register the current hotkey of the given global hotkey, item or folder. An existing registration of the same
+        entry is replaced. Items and folders are only registered if they use the hotkey trigger mode.
+
+        @param ranks: The position of the global hotkeys, items and folders in configuration order. The entry is
+        inserted into its bucket according to this order. Without ranks, or if the entry has no rank, it is appended.
+        """
+        self.remove(entry)
+        buckets = self._bucket_for(entry)
+        if buckets is not self._global_hotkeys and model.TriggerMode.HOTKEY not in entry.modes:
+            return
+        self._add(buckets, entry, ranks)
+
+    def remove(self, entry):
+        """Remove the given global hotkey, item or folder from the table, regardless of its current hotkey."""
+        combination = self._combinations.pop(entry, None)
+        if combination is None:
+            return
+        buckets = self._bucket_for(entry)
+        bucket = buckets[combination]
+        bucket.remove(entry)
+        if not bucket:
+            del buckets[combination]
+
+    def lookup(self, modifiers: typing.Iterable[str], key: str) -> HotkeyCandidates:
+        """Return the global hotkeys, items and folders bound to the given key combination."""
+        combination = self.combination(modifiers, key)
+        return (
+            self._global_hotkeys.get(combination, []),
+            self._items.get(combination, []),
+            self._folders.get(combination, [])
+        )
+
+
+class WindowFilterCache:
+    """
+    Per-window cache of the window filter evaluation for all folders and items.
+
+    For each recently seen window, the cache holds the set of window-filtered folders and items that are eligible to
+    trigger in that window. Folders and items without an applicable window filter are eligible everywhere and are not
+    stored per window. Because the applicable filter depends on the parent folders, the cache is only valid for the
+    configuration it was built for. A new cache is created on each configuration change. The least recently used
+    windows are evicted, once more than max_size windows were seen.
+    """
+
+    def __init__(self, entries: typing.Iterable[model.AbstractWindowFilter], max_size: int=WINDOW_FILTER_CACHE_SIZE):
+        self._max_size = max_size
+        self._unfiltered = set()  # type: typing.Set[model.AbstractWindowFilter]
+        self._filtered = set()  # type: typing.Set[model.AbstractWindowFilter]
+        for entry in entries:
+            if entry.get_applicable_regex() is None:
+                self._unfiltered.add(entry)
+            else:
+                self._filtered.add(entry)
+        self._eligible = collections.OrderedDict()  # type: typing.Dict[tuple, typing.FrozenSet]
+
+    def __len__(self):
+        return len(self._eligible)
+
+    def eligible_filtered(self, window_info: tuple) -> typing.FrozenSet[model.AbstractWindowFilter]:
+        """Return the window-filtered folders and items that may trigger in the given window."""
+        try:
+            eligible = self._eligible[window_info]
+            self._eligible.move_to_end(window_info)
+        except KeyError:
+            eligible = frozenset(entry for entry in self._filtered if entry._should_trigger_window_title(window_info))
+            self._eligible[window_info] = eligible
+            if len(self._eligible) > self._max_size:
+                self._eligible.popitem(last=False)
+        return eligible
+
+    def filter(self, entries: typing.Iterable, window_info: tuple) -> list:
+        """
+        Return the given folders or items that may trigger in the given window, preserving their order.
+        Entries unknown to this cache, like those added by a hotkey change after the last configuration rebuild, are
+        evaluated directly.
+        """
+        eligible = self.eligible_filtered(window_info)
+        result = []
+        for entry in entries:
+            if entry in self._unfiltered or entry in eligible:
+                result.append(entry)
+            elif entry not in self._filtered and entry._should_trigger_window_title(window_info):
+                result.append(entry)
+        return result
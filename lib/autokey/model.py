@@ -261,12 +261,55 @@ class AbstractAbbreviation:
             return input_string[:split_index], input_string[split_index: split_index_2], input_string[split_index_2:]
 
 
+# Key of the resolved child filter in the filter cache. The applicable regexes are keyed by the forChild flag.
+_CHILD_FILTER = "child_filter"
+
+
 class AbstractWindowFilter:
 
+    # The effective window filter depends on the filters of all parent folders. It is resolved once and cached.
+    # The cache is invalidated for the whole subtree, whenever the filter or the parent of a folder or item changes.
+    _windowInfoRegex = None  # type: typing.Optional[typing.Pattern]
+    _isRecursive = False
+    _parent = None
+
     def __init__(self):
         self.windowInfoRegex = None
         self.isRecursive = False
 
+    @property
+    def windowInfoRegex(self) -> typing.Optional[typing.Pattern]:
+        return self._windowInfoRegex
+
+    @windowInfoRegex.setter
+    def windowInfoRegex(self, regex: typing.Optional[typing.Pattern]):
+        self._windowInfoRegex = regex
+        self._invalidate_filter_cache()
+
+    @property
+    def isRecursive(self) -> bool:
+        return self._isRecursive
+
+    @isRecursive.setter
+    def isRecursive(self, recursive: bool):
+        self._isRecursive = recursive
+        self._invalidate_filter_cache()
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        self._parent = parent
+        self._invalidate_filter_cache()
+
+    def _invalidate_filter_cache(self):
+        """Forget the resolved window filters of this object. Folders also invalidate their content."""
+        # Replaced instead of cleared: A reader that resolves a filter concurrently stores its result in the dict
+        # it read before resolving, so a value resolved from the old filters never lands in the fresh cache.
+        self._filterCache = {}  # type: typing.Dict[typing.Any, typing.Union[str, typing.Optional[typing.Pattern]]]
+
     def get_serializable(self):
         if self.windowInfoRegex is not None:
             return {"regex": self.windowInfoRegex.pattern, "isRecursive": self.isRecursive}
@@ -309,6 +352,15 @@ class AbstractWindowFilter:
         return False
 
     def get_child_filter(self):
+        cache = self._filterCache
+        try:
+            return cache[_CHILD_FILTER]
+        except KeyError:
+            child_filter = self._resolve_child_filter()
+            cache[_CHILD_FILTER] = child_filter
+            return child_filter
+
+    def _resolve_child_filter(self):
         if self.isRecursive and self.windowInfoRegex is not None:
             return self.get_filter_regex()
         elif self.parent is not None:
@@ -337,6 +389,15 @@ class AbstractWindowFilter:
         return otherFilter == self.get_applicable_regex().pattern
 
     def get_applicable_regex(self, forChild=False):
+        cache = self._filterCache
+        try:
+            return cache[forChild]
+        except KeyError:
+            regex = self._resolve_applicable_regex(forChild)
+            cache[forChild] = regex
+            return regex
+
+    def _resolve_applicable_regex(self, forChild):
         if self.windowInfoRegex is not None:
             if (forChild and self.isRecursive) or not forChild:
                 return self.windowInfoRegex
@@ -378,8 +439,12 @@ class AbstractHotkey(AbstractWindowFilter):
         self.modifiers = modifiers
         self.hotKey = key
 
-    def check_hotkey(self, modifiers, key, windowTitle):
-        if self.hotKey is not None and self._should_trigger_window_title(windowTitle):
+    def check_hotkey(self, modifiers, key, windowTitle, skip_window_filter=False):
+        """
+        @param skip_window_filter: Set, if the caller already determined that the window filter allows triggering
+        in the given window.
+        """
+        if self.hotKey is not None and (skip_window_filter or self._should_trigger_window_title(windowTitle)):
             return (self.modifiers == modifiers) and (self.hotKey == key)
         else:
             return False
@@ -425,6 +490,14 @@ class Folder(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         self.parent = None  # type: typing.Optional[Folder]
         self.path = path
 
+    def _invalidate_filter_cache(self):
+        AbstractWindowFilter._invalidate_filter_cache(self)
+        # Sub-folders and items inherit recursive filters. The lists do not exist yet during __init__()
+        for child in getattr(self, "folders", ()):
+            child._invalidate_filter_cache()
+        for child in getattr(self, "items", ()):
+            child._invalidate_filter_cache()
+
     def build_path(self, base_name=None):
         if base_name is None:
             base_name = self.title
@@ -577,9 +650,10 @@ class Folder(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         #del self.phrases[phrase.description]
         self.items.remove(item)
 
-    def check_input(self, buffer, window_info):
+    def check_input(self, buffer, window_info, skip_window_filter=False):
         if TriggerMode.ABBREVIATION in self.modes:
-            return self._should_trigger_abbreviation(buffer) and self._should_trigger_window_title(window_info)
+            return self._should_trigger_abbreviation(buffer) and (
+                skip_window_filter or self._should_trigger_window_title(window_info))
         else:
             return False
 
@@ -765,9 +839,10 @@ class Phrase(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
     def set_modes(self, modes: typing.List[TriggerMode]):
         self.modes = modes
 
-    def check_input(self, buffer, window_info):
+    def check_input(self, buffer, window_info, skip_window_filter=False):
         if TriggerMode.ABBREVIATION in self.modes:
-            return self._should_trigger_abbreviation(buffer) and self._should_trigger_window_title(window_info)
+            return self._should_trigger_abbreviation(buffer) and (
+                skip_window_filter or self._should_trigger_window_title(window_info))
         else:
             return False
 
@@ -1080,9 +1155,10 @@ class Script(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
     def set_modes(self, modes: typing.List[TriggerMode]):
         self.modes = modes
 
-    def check_input(self, buffer, window_info):
+    def check_input(self, buffer, window_info, skip_window_filter=False):
         if TriggerMode.ABBREVIATION in self.modes:
-            return self._should_trigger_abbreviation(buffer) and self._should_trigger_window_title(window_info)
+            return self._should_trigger_abbreviation(buffer) and (
+                skip_window_filter or self._should_trigger_window_title(window_info))
         else:
             return False
 
@@ -27,6 +27,8 @@ _logger = logging.getLogger("inotify")
 
 m = EventsCodes.OP_FLAGS
 MASK = m["IN_CREATE"]|m["IN_MODIFY"]|m["IN_DELETE"]|m["IN_MOVED_TO"]|m["IN_MOVED_FROM"]
+# Reports files only once they are completely written, either closed after writing or moved into place
+COMPLETED_FILE_MASK = m["IN_CLOSE_WRITE"]|m["IN_DELETE"]|m["IN_MOVED_TO"]|m["IN_MOVED_FROM"]
 
 class Processor(ProcessEvent):
     
@@ -57,6 +59,11 @@ class Processor(ProcessEvent):
         path = self.__getEventPath(event)
         if not self.monitor.is_suspended():
             self.listener.path_created_or_modified(path)
+
+    def process_IN_CLOSE_WRITE(self, event):
+        path = self.__getEventPath(event)
+        if not self.monitor.is_suspended():
+            self.listener.path_created_or_modified(path)
         
     def process_IN_DELETE(self, event):
         path = self.__getEventPath(event)
@@ -71,9 +78,10 @@ class Processor(ProcessEvent):
 
 class FileMonitor(threading.Thread):
     
-    def __init__(self, listener):
+    def __init__(self, listener, mask: int=MASK):
         threading.Thread.__init__(self)
         self.__p = Processor(self, listener)
+        self.mask = mask
         self.manager = WatchManager()
         self.notifier = Notifier(self.manager, self.__p)
         self.event = threading.Event()
@@ -102,10 +110,16 @@ class FileMonitor(threading.Thread):
     def has_watch(self, path):
         return path in self.watches
     
-    def add_watch(self, path):
+    def add_watch(self, path) -> bool:
+        """Watch the given path. Returns False, if inotify refused the watch, for example if the limit is reached."""
         _logger.debug("Adding watch for %s", path)
-        self.manager.add_watch(path, MASK, self.__p)
+        # pyinotify does not raise on failure, but reports a negative watch descriptor instead.
+        result = self.manager.add_watch(path, self.mask, self.__p)
+        if result.get(path, -1) < 0:
+            _logger.warning("Unable to watch %s for changes", path)
+            return False
         self.watches.append(path)
+        return True
         
     def remove_watch(self, path):
         _logger.debug("Removing watch for %s", path)
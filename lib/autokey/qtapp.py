@@ -234,25 +234,33 @@ class Application(QApplication):
 
     def config_altered(self, persistGlobal):
         self.configManager.config_altered(persistGlobal)
+        self.service.mediator.interface.config_altered()
+        self.service.update_tracing()
         self.notifier.create_assign_context_menu()
 
     def hotkey_created(self, item):
         logging.debug("Created hotkey: %r %s", item.modifiers, item.hotKey)
+        self.configManager.hotkey_created(item)
         self.service.mediator.interface.grab_hotkey(item)
 
     def hotkey_removed(self, item):
         logging.debug("Removed hotkey: %r %s", item.modifiers, item.hotKey)
+        self.configManager.hotkey_removed(item)
         self.service.mediator.interface.ungrab_hotkey(item)
 
     def path_created_or_modified(self, path):
         time.sleep(0.5)
         changed = self.configManager.path_created_or_modified(path)
+        if changed:
+            self.service.mediator.interface.config_altered()
         if changed and self.configWindow is not None:
             self.configWindow.config_modified()
 
     def path_removed(self, path):
         time.sleep(0.5)
         changed = self.configManager.path_removed(path)
+        if changed:
+            self.service.mediator.interface.config_altered()
         if changed and self.configWindow is not None:
             self.configWindow.config_modified()
 
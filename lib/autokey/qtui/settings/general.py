@@ -50,6 +50,13 @@ class GeneralSettings(*ui_common.inherits_from_ui_file_with_name("generalsetting
         self.allow_kb_nav_checkbox.setVisible(False)
         self.sort_by_usage_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.SORT_BY_USAGE_COUNT])
         self.enable_undo_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.UNDO_USING_BACKSPACE])
+        self.xtest_output_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT])
+        self.pre_remap_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.PRE_REMAP_CHARACTERS])
+        self.root_window_grabs_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.ROOT_WINDOW_HOTKEY_GRABS])
+        self.single_hop_input_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.SINGLE_HOP_INPUT])
+        self.latency_tracing_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.LATENCY_TRACING])
+        self.watch_macro_files_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.WATCH_MACRO_FILES])
+        self.concurrent_script_macros_checkbox.setChecked(cm.ConfigManager.SETTINGS[cm.CONCURRENT_SCRIPT_MACROS])
         self.disable_capslock_checkbox.setChecked(cm.ConfigManager.is_modifier_disabled(Key.CAPSLOCK))
         self._fill_notification_icon_combobox_user_data()
         self._load_system_tray_icon_theme()
@@ -67,6 +74,13 @@ class GeneralSettings(*ui_common.inherits_from_ui_file_with_name("generalsetting
         # cm.ConfigManager.SETTINGS[cm.MENU_TAKES_FOCUS] = self.allow_kb_nav_checkbox.isChecked()
         cm.ConfigManager.SETTINGS[cm.SORT_BY_USAGE_COUNT] = self.sort_by_usage_checkbox.isChecked()
         cm.ConfigManager.SETTINGS[cm.UNDO_USING_BACKSPACE] = self.enable_undo_checkbox.isChecked()
+        cm.ConfigManager.SETTINGS[cm.XTEST_OUTPUT] = self.xtest_output_checkbox.isChecked()
+        cm.ConfigManager.SETTINGS[cm.PRE_REMAP_CHARACTERS] = self.pre_remap_checkbox.isChecked()
+        cm.ConfigManager.SETTINGS[cm.ROOT_WINDOW_HOTKEY_GRABS] = self.root_window_grabs_checkbox.isChecked()
+        cm.ConfigManager.SETTINGS[cm.SINGLE_HOP_INPUT] = self.single_hop_input_checkbox.isChecked()
+        cm.ConfigManager.SETTINGS[cm.LATENCY_TRACING] = self.latency_tracing_checkbox.isChecked()
+        cm.ConfigManager.SETTINGS[cm.WATCH_MACRO_FILES] = self.watch_macro_files_checkbox.isChecked()
+        cm.ConfigManager.SETTINGS[cm.CONCURRENT_SCRIPT_MACROS] = self.concurrent_script_macros_checkbox.isChecked()
         cm.ConfigManager.SETTINGS[cm.NOTIFICATION_ICON] = self.system_tray_icon_theme_combobox.currentData(Qt.UserRole)
         self._save_disable_capslock_setting()
         self._save_autostart_settings()
@@ -85,6 +99,13 @@ class GeneralSettings(*ui_common.inherits_from_ui_file_with_name("generalsetting
             "Allow keyboard navigation: {}, " \
             "Sort by usage count: {}, " \
             "Enable undo using backspace: {}, " \
+            "Type using XTest: {}, " \
+            "Pre-remap characters: {}, " \
+            "Root window hotkey grabs: {}, " \
+            "Single hop input: {}, " \
+            "Latency tracing: {}, " \
+            "Watch macro files: {}, " \
+            "Concurrent script macros: {}, " \
             "Tray icon theme: {}, " \
             "Disable Capslock: {}".format(
                self.autosave_checkbox.isChecked(),
@@ -92,6 +113,13 @@ class GeneralSettings(*ui_common.inherits_from_ui_file_with_name("generalsetting
                self.allow_kb_nav_checkbox.isChecked(),
                self.sort_by_usage_checkbox.isChecked(),
                self.enable_undo_checkbox.isChecked(),
+               self.xtest_output_checkbox.isChecked(),
+               self.pre_remap_checkbox.isChecked(),
+               self.root_window_grabs_checkbox.isChecked(),
+               self.single_hop_input_checkbox.isChecked(),
+               self.latency_tracing_checkbox.isChecked(),
+               self.watch_macro_files_checkbox.isChecked(),
+               self.concurrent_script_macros_checkbox.isChecked(),
                self.system_tray_icon_theme_combobox.currentData(Qt.UserRole),
                self.disable_capslock_checkbox.isChecked()
             )
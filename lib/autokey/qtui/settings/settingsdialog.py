@@ -56,7 +56,8 @@ class SettingsDialog(*common.inherits_from_ui_file_with_name("settingsdialog")):
         self.general_settings_page.save()
         self.special_hotkeys_page.save()
         self.script_engine_page.save()
-        app.configManager.config_altered(True)
+        # Through the application, so that the hotkey grabs follow a changed grab setting
+        app.config_altered(True)
         app.update_notifier_visibility()
         app.notifier.reset_tray_icon()
         super(SettingsDialog, self).accept()
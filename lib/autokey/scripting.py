@@ -1138,7 +1138,9 @@ class Engine:
         self.configManager = configManager
         self.runner = runner
         self.monitor = configManager.app.monitor
-        self.__returnValue = ''
+        # The macro arguments and return value belong to the thread running the macro script, so that multiple
+        # script macros can run at the same time.
+        self.__macroContext = threading.local()
         
     def get_folder(self, title):
         """
@@ -1262,7 +1264,7 @@ class Engine:
         """
         Used internally by AutoKey for phrase macros
         """
-        self.__macroArgs = args["args"].split(',')
+        self.__macroContext.macroArgs = args["args"].split(',')
         
         try:
             self.run_script(args["name"])
@@ -1278,7 +1280,7 @@ class Engine:
         @return: the arguments
         @rtype: C{list(str())}
         """
-        return self.__macroArgs
+        return self.__macroContext.macroArgs
             
     def set_return_value(self, val):
         """
@@ -1288,12 +1290,12 @@ class Engine:
         
         @param val: value to be stored
         """
-        self.__returnValue = val
+        self.__macroContext.returnValue = val
         
     def get_return_value(self):
         """
         Used internally by AutoKey for phrase macros
         """
-        ret = self.__returnValue
-        self.__returnValue = ''
+        ret = getattr(self.__macroContext, "returnValue", '')
+        self.__macroContext.returnValue = ''
         return ret
@@ -26,9 +26,11 @@ from autokey.iomediator.key import Key, KEY_FIND_RE
 from autokey.iomediator import IoMediator
 
 from .macro import MacroManager
+from .matcher import StreamingMatcher
 
-from . import scripting, model, scripting_Store, scripting_highlevel
-from .configmanager import ConfigManager, SERVICE_RUNNING, SCRIPT_GLOBALS, save_config, UNDO_USING_BACKSPACE
+from . import scripting, model, scripting_Store, scripting_highlevel, tracing
+from .configmanager import ConfigManager, SERVICE_RUNNING, SCRIPT_GLOBALS, save_config, UNDO_USING_BACKSPACE, \
+    LATENCY_TRACING
 import threading
 logger = logging.getLogger("service")
 
@@ -38,7 +40,8 @@ MAX_STACK_LENGTH = 150
 def threaded(f):
 
     def wrapper(*args):
-        t = threading.Thread(target=f, args=args, name="Phrase-thread")
+        # Keystrokes being traced are followed into the new thread
+        t = threading.Thread(target=tracing.propagate(f), args=args, name="Phrase-thread")
         t.setDaemon(False)
         t.start()
 
@@ -72,8 +75,10 @@ class Service:
         self.configManager = app.configManager
         ConfigManager.SETTINGS[SERVICE_RUNNING] = False
         self.mediator = None
+        self.phraseRunner = None  # type: PhraseRunner
         self.app = app
         self.inputStack = collections.deque(maxlen=MAX_STACK_LENGTH)
+        self.matcher = StreamingMatcher(self.configManager.snapshot.abbreviationIndex, MAX_STACK_LENGTH)
         self.lastStackState = ''
         self.lastMenu = None
 
@@ -86,8 +91,13 @@ class Service:
         self.scriptRunner = ScriptRunner(self.mediator, self.app)
         self.phraseRunner = PhraseRunner(self)
         scripting_Store.Store.GLOBALS = ConfigManager.SETTINGS[SCRIPT_GLOBALS]
+        self.update_tracing()
         logger.info("Service now marked as running")
 
+    def update_tracing(self):
+        """Enable or disable the keystroke latency tracing, according to the settings."""
+        tracing.set_enabled(ConfigManager.SETTINGS[LATENCY_TRACING])
+
     def unpause(self):
         ConfigManager.SETTINGS[SERVICE_RUNNING] = True
         logger.info("Unpausing - service now marked as running")
@@ -102,13 +112,14 @@ class Service:
     def shutdown(self, save=True):
         logger.info("Service shutting down")
         if self.mediator is not None: self.mediator.shutdown()
+        if self.phraseRunner is not None: self.phraseRunner.macroManager.shutdown()
         if save:
             save_config(self.configManager)
         logger.debug("Service shutdown completed.")
 
     def handle_mouseclick(self, rootX, rootY, relX, relY, button, windowTitle):
         # logger.debug("Received mouse click - resetting buffer")
-        self.inputStack.clear()
+        self.__clearStack()
 
         # If we had a menu and receive a mouse click, means we already
         # hid the menu. Don't need to do it again
@@ -118,20 +129,24 @@ class Service:
         self.phraseRunner.clear_last()
 
     def handle_keypress(self, rawKey, modifiers, key, window_info):
+        tracing.mark(tracing.STAGE_SERVICE)
         logger.debug("Raw key: %r, modifiers: %r, Key: %s", rawKey, modifiers, key)
         logger.debug("Window visible title: %r, Window class: %r" % window_info)
-        self.configManager.lock.acquire()
+        # Work on the currently published configuration. It is never modified in place, so no locking is required.
+        snapshot = self.configManager.snapshot
+        # Only the few hotkeys bound to exactly this key combination can possibly match
+        globalHotkeys, hotkeyItems, hotkeyFolders = snapshot.hotkeyTable.lookup(modifiers, rawKey)
 
         # Always check global hotkeys
-        for hotkey in self.configManager.globalHotkeys:
+        for hotkey in globalHotkeys:
             hotkey.check_hotkey(modifiers, rawKey, window_info)
 
         if self.__shouldProcess(window_info):
             itemMatch = None
             menu = None
 
-            for item in self.configManager.hotKeys:
-                if item.check_hotkey(modifiers, rawKey, window_info):
+            for item in snapshot.windowFilterCache.filter(hotkeyItems, window_info):
+                if item.check_hotkey(modifiers, rawKey, window_info, skip_window_filter=True):
                     itemMatch = item
                     break
 
@@ -143,12 +158,15 @@ class Service:
                     menu = ([], [itemMatch])
 
             else:
-                for folder in self.configManager.hotKeyFolders:
-                    if folder.check_hotkey(modifiers, rawKey, window_info):
+                for folder in snapshot.windowFilterCache.filter(hotkeyFolders, window_info):
+                    if folder.check_hotkey(modifiers, rawKey, window_info, skip_window_filter=True):
                         #menu = PopupMenu(self, [folder], [])
                         menu = ([folder], [])
 
 
+            if itemMatch is not None or menu is not None:
+                tracing.mark(tracing.STAGE_MATCH)
+
             if menu is not None:
                 logger.debug("Matched Folder with hotkey - showing menu")
                 if self.lastMenu is not None:
@@ -160,7 +178,6 @@ class Service:
                 self.app.show_popup_menu(*menu)
 
             if itemMatch is not None:
-                self.__tryReleaseLock()
                 self.__processItem(itemMatch)
 
 
@@ -169,24 +186,27 @@ class Service:
             modifierCount = len(modifiers)
 
             if modifierCount > 1 or (modifierCount == 1 and Key.SHIFT not in modifiers):
-                self.inputStack.clear()
-                self.__tryReleaseLock()
+                self.__clearStack()
                 return
 
             ### --- end of processing if non-printing modifiers are on --- ###
 
-            if self.__updateStack(key):
-                currentInput = ''.join(self.inputStack)
-                item, menu = self.__checkTextMatches([], self.configManager.abbreviations,
-                                                    currentInput, window_info, True)
-                if not item or menu:
-                    item, menu = self.__checkTextMatches(
-                        self.configManager.allFolders,
-                        self.configManager.allItems,
-                        currentInput, window_info)  # type: model.Phrase, list
+            if self.__updateStack(key, snapshot):
+                # Only items having an abbreviation that ends at the current input position can possibly match
+                folders, items = self.matcher.candidates()
+                folders = snapshot.windowFilterCache.filter(folders, window_info)
+                items = snapshot.windowFilterCache.filter(items, window_info)
+                if folders or items:
+                    currentInput = ''.join(self.inputStack)
+                    item, menu = self.__checkTextMatches([], items, currentInput, window_info, True)
+                    if not item or menu:
+                        item, menu = self.__checkTextMatches(
+                            folders, items, currentInput, window_info)  # type: model.Phrase, list
+                else:
+                    item, menu = None, None
+                tracing.mark(tracing.STAGE_MATCH)
 
                 if item:
-                    self.__tryReleaseLock()
                     logger.info('Matched {} "{}" having abbreviations "{}" against current input'.format(
                         item.__class__.__name__, item.description, item.abbreviations))
                     self.__processItem(item, currentInput)
@@ -200,17 +220,9 @@ class Service:
 
                 logger.debug("Input queue at end of handle_keypress: %s", self.inputStack)
 
-        self.__tryReleaseLock()
-
-    def __tryReleaseLock(self):
-        try:
-            self.configManager.lock.release()
-        except:
-            logger.exception("Ignored locking error in handle_keypress")
-
     def run_folder(self, name):
         folder = None
-        for f in self.configManager.allFolders:
+        for f in self.configManager.snapshot.allFolders:
             if f.title == name:
                 folder = f
 
@@ -229,7 +241,7 @@ class Service:
         self.scriptRunner.execute(script)
 
     def __findItem(self, name, objType, typeDescription):
-        for item in self.configManager.allItems:
+        for item in self.configManager.snapshot.allItems:
             if item.description == name and isinstance(item, objType):
                 return item
 
@@ -253,7 +265,7 @@ class Service:
             extraKeys = ''
         return extraBs, extraKeys
 
-    def __updateStack(self, key):
+    def __updateStack(self, key, snapshot):
         """
         Update the input stack in non-hotkey mode, and determine if anything
         further is needed.
@@ -283,12 +295,14 @@ class Service:
                 except IndexError:
                     # in case self.inputStack is empty
                     pass
+                else:
+                    self.matcher.pop()
 
             return False
 
         elif len(key) > 1:
             # non-simple key
-            self.inputStack.clear()
+            self.__clearStack()
             self.phraseRunner.clear_last()
             return False
         else:
@@ -296,12 +310,28 @@ class Service:
             self.phraseRunner.clear_last()
             # if len(self.inputStack) == MAX_STACK_LENGTH, front items will removed for appending new items.
             self.inputStack.append(key)
+            self.__syncMatcher(snapshot)
+            self.matcher.push(key)
             return True
 
+    def __clearStack(self):
+        self.inputStack.clear()
+        self.matcher.reset()
+
+    def __syncMatcher(self, snapshot):
+        """
+        Switch the matcher over to the current abbreviation index, if the configuration changed since the last
+        keypress. The new index is primed with the current input, without the character that is about to be pushed.
+        """
+        index = snapshot.abbreviationIndex
+        if self.matcher.index is not index:
+            self.matcher.rebuild(index, list(self.inputStack)[:-1])
+
     def __checkTextMatches(self, folders, items, buffer, windowInfo, immediate=False):
         """
         Check for an abbreviation/predictive match among the given folder and items
-        (scripts, phrases).
+        (scripts, phrases). The window filters of the given folders and items must
+        already be checked against windowInfo.
 
         @return: a tuple possibly containing an item to execute, or a menu to show
         """
@@ -309,14 +339,14 @@ class Service:
         folderMatches = []
 
         for item in items:
-            if item.check_input(buffer, windowInfo):
+            if item.check_input(buffer, windowInfo, skip_window_filter=True):
                 if not item.prompt and immediate:
                     return item, None
                 else:
                     itemMatches.append(item)
 
         for folder in folders:
-            if folder.check_input(buffer, windowInfo):
+            if folder.check_input(buffer, windowInfo, skip_window_filter=True):
                 folderMatches.append(folder)
                 break # There should never be more than one folder match anyway
 
@@ -338,7 +368,7 @@ class Service:
         return windowInfo[0] != "Set Abbreviations" and self.is_running()
 
     def __processItem(self, item, buffer=''):
-        self.inputStack.clear()
+        self.__clearStack()
         self.lastStackState = ''
 
         if isinstance(item, model.Phrase):
@@ -386,6 +416,7 @@ class PhraseRunner:
     @threaded
     #@synchronized(iomediator.SEND_LOCK)
     def execute(self, phrase: model.Phrase, buffer=''):
+        tracing.mark(tracing.STAGE_PHRASE_EXECUTE)
         mediator = self.service.mediator  # type: IoMediator
         mediator.interface.begin_send()
         try:
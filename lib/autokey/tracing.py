@@ -0,0 +1,154 @@
+"""
+Optional latency tracing of single keystrokes through the input and expansion pipeline.
+
+When enabled, each key press recorded from the X server starts a Trace. The trace is handed along with the keystroke,
+from thread to thread, and each pipeline stage marks the time it was reached. The time elapsed since the key press
+was received is added to a rolling histogram per stage, which can be queried at runtime using statistics().
+
+When disabled, each instrumented stage costs a single function call and a boolean check.
+"""
+
+import collections
+import threading
+import time
+import typing
+
+# The instrumented pipeline stages, in pipeline order
+STAGE_XRECORD = "xrecord_receipt"
+STAGE_HANDLE_KEY_PRESS = "handle_key_press"
+STAGE_IOMEDIATOR = "iomediator"
+STAGE_SERVICE = "service_handle_keypress"
+STAGE_MATCH = "match_decision"
+STAGE_PHRASE_EXECUTE = "phrase_execute"
+STAGE_FIRST_SEND = "first_send_event"
+STAGES = (
+    STAGE_XRECORD, STAGE_HANDLE_KEY_PRESS, STAGE_IOMEDIATOR, STAGE_SERVICE, STAGE_MATCH, STAGE_PHRASE_EXECUTE,
+    STAGE_FIRST_SEND
+)
+
+# Number of most recent samples kept per stage
+HISTOGRAM_SIZE = 1000
+
+enabled = False
+_current = threading.local()
+
+
+class RollingHistogram:
+    """Keeps the most recent samples of a value and computes percentiles over them."""
+
+    def __init__(self, size: int=HISTOGRAM_SIZE):
+        self._lock = threading.Lock()
+        self._samples = collections.deque(maxlen=size)  # type: typing.Deque[float]
+        self.count = 0
+
+    def add(self, value: float):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+
+    def percentiles(self, *percents: float) -> typing.List[typing.Optional[float]]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return [None for _ in percents]
+        return [samples[min(len(samples) - 1, int(len(samples) * percent / 100))] for percent in percents]
+
+
+_histograms = {stage: RollingHistogram() for stage in STAGES}  # type: typing.Dict[str, RollingHistogram]
+
+
+class Trace:
+    """The timing of a single keystroke. Each stage is recorded once, so only the first send event counts."""
+
+    __slots__ = ("start", "stages")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = set()  # type: typing.Set[str]
+
+    def mark(self, stage: str):
+        if stage not in self.stages:
+            self.stages.add(stage)
+            _histograms[stage].add(time.perf_counter() - self.start)
+
+
+def set_enabled(enable: bool):
+    global enabled
+    enabled = enable
+
+
+def begin():
+    """Start a new trace for a just received key press and make it the current trace of the calling thread."""
+    if enabled:
+        trace = Trace()
+        _current.trace = trace
+        trace.mark(STAGE_XRECORD)
+
+
+def end():
+    """Detach the current trace from the calling thread."""
+    _current.trace = None
+
+
+def current() -> typing.Optional[Trace]:
+    """Returns the trace of the keystroke handled by the calling thread, if any."""
+    return getattr(_current, "trace", None)
+
+
+def activate(trace: typing.Optional[Trace]):
+    """Make the given trace, which was handed over from another thread, the current trace of the calling thread."""
+    _current.trace = trace
+
+
+def mark(stage: str):
+    """Record that the keystroke handled by the calling thread reached the given stage."""
+    if enabled:
+        trace = getattr(_current, "trace", None)
+        if trace is not None:
+            trace.mark(stage)
+
+
+def propagate(function: typing.Callable) -> typing.Callable:
+    """
+    Bind the current trace to a function that is going to be run by another thread. Returns the function unchanged,
+    if there is no current trace.
+    """
+    if not enabled:
+        return function
+    trace = getattr(_current, "trace", None)
+    if trace is None:
+        return function
+
+    def traced(*args, **kwargs):
+        previous = current()
+        _current.trace = trace
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.trace = previous
+
+    return traced
+
+
+def statistics() -> typing.Dict[str, typing.Dict[str, typing.Optional[float]]]:
+    """
+    Returns, for each stage, the number of recorded keystrokes and the p50, p95 and p99 of the time in milliseconds
+    elapsed between receiving the key press and reaching the stage, over the most recent keystrokes.
+    """
+    result = collections.OrderedDict()
+    for stage in STAGES:
+        histogram = _histograms[stage]
+        p50, p95, p99 = histogram.percentiles(50, 95, 99)
+        result[stage] = {
+            "count": histogram.count,
+            "p50": None if p50 is None else p50 * 1000,
+            "p95": None if p95 is None else p95 * 1000,
+            "p99": None if p99 is None else p99 * 1000,
+        }
+    return result
+
+
+def reset():
+    """Discard all recorded samples."""
+    for stage in STAGES:
+        _histograms[stage] = RollingHistogram()
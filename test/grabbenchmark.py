@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the hotkey grab code of XInterfaceBase, comparing the two strategies for hotkeys having a window filter:
+
+- per-window (rootWindowHotkeyGrabs disabled): grab each hotkey in every matching window and all of its descendants,
+- root (rootWindowHotkeyGrabs enabled): grab each key combination once in the root window and check the window filter
+  on each press.
+
+Three operations are measured for both strategies, using the real grab code of XInterfaceBase:
+
+- startup: grabbing all hotkeys in the open windows,
+- new windows: grabbing the hotkeys in a burst of newly created windows,
+- hotkey added: one window-filtered hotkey is added, reported by grab_hotkey() and config_altered(), like the user
+  interface does.
+
+The jobs enqueued for the X event loop are run right away, in the calling thread. The longest of them is reported,
+as key presses handled by the event loop can wait for up to that long.
+
+Usage: python3 test/grabbenchmark.py [--windows N] [--hotkeys M] [--applications K] [--new-windows B] [--repeat R]
+
+The X server is replaced by a mocked display, holding N top-level windows with one child each and their WM_CLASS
+spread over K applications. Each of the M hotkeys is restricted to one of the applications. The mocked display counts
+the requests AutoKey sends. Round trips wait for a reply of the X server, so in a real session each of them adds at
+least the latency of the X connection. The reported time is the CPU time spent by AutoKey itself.
+"""
+
+import argparse
+import os.path
+import sys
+import threading
+import time
+import types
+
+from Xlib import X
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+import autokey.iomediator  # Imported first to resolve the circular import between configmanager and model.
+from autokey import configmanager as cm
+from autokey import interface
+from autokey import model
+from autokey.iomediator.key import Key
+
+KEYS = "abcdefghijklmnopqrstuvwxyz0123456789"
+MODIFIERS = [[Key.CONTROL], [Key.ALT], [Key.CONTROL, Key.ALT], [Key.CONTROL, Key.SHIFT]]
+MODIFIER_MASKS = {
+    Key.SHIFT: X.ShiftMask, Key.CAPSLOCK: X.LockMask, Key.CONTROL: X.ControlMask, Key.ALT: X.Mod1Mask,
+    Key.NUMLOCK: X.Mod2Mask, Key.SUPER: X.Mod4Mask,
+}
+NAME_ATOM = 1
+VISIBLE_NAME_ATOM = 2
+
+
+class MockedDisplay:
+    """The parts of an Xlib display used by the grab code. Counts the requests and round trips."""
+
+    def __init__(self):
+        self.requests = 0
+        self.round_trips = 0
+        self.longest_job = 0.0
+        self.windows = {}
+        self.next_id = 1
+        self.root = MockedWindow(self, None, "", None)
+
+    def keysym_to_keycode(self, keysym: int) -> int:
+        return 8 + keysym % 248
+
+    def create_resource_object(self, resource_type: str, resource_id: int):
+        return self.windows[resource_id]
+
+    def pending_events(self) -> int:
+        return 0
+
+    def flush(self):
+        pass
+
+    def reset_counters(self):
+        self.requests = 0
+        self.round_trips = 0
+        self.longest_job = 0.0
+
+
+class MockedWindow:
+
+    def __init__(self, mocked_display: MockedDisplay, parent, title: str, wm_class):
+        self.display = mocked_display
+        self.id = mocked_display.next_id
+        mocked_display.next_id += 1
+        mocked_display.windows[self.id] = self
+        self.parent = parent
+        self.children = []
+        self.title = title
+        self.wm_class = wm_class
+        if parent is not None:
+            parent.children.append(self)
+
+    def query_tree(self):
+        self.display.round_trips += 1
+        return types.SimpleNamespace(children=list(self.children), parent=self.parent or 0)
+
+    def get_property(self, atom, property_type, offset, length):
+        self.display.round_trips += 1
+        if atom == NAME_ATOM and self.title:
+            return types.SimpleNamespace(value=self.title)
+        return None
+
+    def get_wm_class(self):
+        self.display.round_trips += 1
+        return self.wm_class
+
+    def grab_key(self, keycode, modifiers, owner_events, pointer_mode, keyboard_mode):
+        self.display.requests += 1
+
+    def ungrab_key(self, keycode, modifiers, onerror=None):
+        self.display.requests += 1
+
+    def change_attributes(self, event_mask=None, onerror=None):
+        self.display.requests += 1
+
+
+def create_window(mocked_display: MockedDisplay, number: int, application_count: int) -> MockedWindow:
+    application = "app{}".format(number % application_count)
+    window = MockedWindow(mocked_display, mocked_display.root, "Window {} of {}".format(number, application),
+                          (application, application.capitalize()))
+    MockedWindow(mocked_display, window, "", None)
+    return window
+
+
+def build_hotkey(number: int, application_count: int) -> model.Phrase:
+    phrase = model.Phrase("hotkey {}".format(number), "expansion {}".format(number))
+    phrase.set_hotkey(MODIFIERS[(number // len(KEYS)) % len(MODIFIERS)], KEYS[number % len(KEYS)])
+    phrase.set_window_titles(r"app{}\..*".format(number % application_count))
+    return phrase
+
+
+def build_interface(mocked_display: MockedDisplay, hotkeys) -> interface.XInterfaceBase:
+    """
+    Create an X interface using the mocked display. Only the state used by the grab code is initialised, so that no
+    threads are started and no real X connection is needed.
+    """
+    x_interface = interface.XInterfaceBase.__new__(interface.XInterfaceBase)
+    snapshot = types.SimpleNamespace(globalHotkeys=[], hotKeys=list(hotkeys), hotKeyFolders=[])
+    x_interface.app = types.SimpleNamespace(configManager=types.SimpleNamespace(snapshot=snapshot))
+    x_interface.localDisplay = mocked_display
+    x_interface.rootWindow = mocked_display.root
+    x_interface.modMasks = MODIFIER_MASKS
+    x_interface.queue = interface.WorkQueue()
+    private_state = {
+        "grabRegistry": interface.GrabRegistry(),
+        "syncGrabItems": {},
+        "grabbedSignature": None,
+        "grabWalk": None,
+        "grabUpdatePending": False,
+        "grabUpdateLock": threading.Lock(),
+        "windowInfoCache": interface.WindowInfoCache(),
+        "focusTracker": interface.FocusTracker(False),
+        "windowsToGrab": {},
+        "windowsToGrabLock": threading.Lock(),
+        "xEventLock": threading.Lock(),
+        "NameAtom": NAME_ATOM,
+        "VisibleNameAtom": VISIBLE_NAME_ATOM,
+        "windowInfoAtoms": {NAME_ATOM, VISIBLE_NAME_ATOM},
+    }
+    for name, value in private_state.items():
+        setattr(x_interface, "_XInterfaceBase__" + name, value)
+    return x_interface
+
+
+def run_queued_jobs(x_interface: interface.XInterfaceBase):
+    """Run the jobs enqueued for the X event loop, until none is left. Records the CPU time of the longest job."""
+    while any(x_interface.queue.depths().values()):
+        method, args = x_interface.queue.get()
+        start = time.process_time()
+        method(*args)
+        x_interface.localDisplay.longest_job = max(
+            x_interface.localDisplay.longest_job, time.process_time() - start)
+
+
+def measure(mocked_display: MockedDisplay, function):
+    mocked_display.reset_counters()
+    start = time.process_time()
+    function()
+    elapsed = time.process_time() - start
+    return elapsed, mocked_display.requests, mocked_display.round_trips, mocked_display.longest_job
+
+
+def run_strategy(root_window_grabs: bool, args):
+    """
+    Returns a list of (operation, seconds, requests, round trips, longest job seconds) tuples, each the minimum of the
+    repetitions.
+    """
+    cm.ConfigManager.SETTINGS[cm.ROOT_WINDOW_HOTKEY_GRABS] = root_window_grabs
+    results = {}
+    for repetition in range(args.repeat):
+        mocked_display = MockedDisplay()
+        for number in range(args.windows):
+            create_window(mocked_display, number, args.applications)
+        hotkeys = [build_hotkey(number, args.applications) for number in range(args.hotkeys)]
+        x_interface = build_interface(mocked_display, hotkeys)
+
+        operations = []
+        def grab_at_startup():
+            x_interface._XInterfaceBase__grabHotkeys()
+            run_queued_jobs(x_interface)
+        operations.append(("startup", measure(mocked_display, grab_at_startup)))
+
+        def grab_new_windows():
+            new_windows = [create_window(mocked_display, args.windows + number, args.applications)
+                           for number in range(args.new_windows)]
+            x_interface._XInterfaceBase__windowsToGrab.update((window.id, window) for window in new_windows)
+            x_interface._XInterfaceBase__grabHotkeysForWindows()
+            run_queued_jobs(x_interface)
+        operations.append(("new windows", measure(mocked_display, grab_new_windows)))
+
+        def add_hotkey():
+            hotkey = build_hotkey(args.hotkeys, args.applications)
+            x_interface.grab_hotkey(hotkey)
+            # The configuration manager publishes the new hotkey, then the user interface reports the change
+            x_interface.app.configManager.snapshot.hotKeys.append(hotkey)
+            x_interface.config_altered()
+            run_queued_jobs(x_interface)
+        operations.append(("hotkey added", measure(mocked_display, add_hotkey)))
+
+        for operation, result in operations:
+            if operation not in results or result[0] < results[operation][0]:
+                results[operation] = result
+    return [(operation,) + results[operation] for operation in ("startup", "new windows", "hotkey added")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hotkey grab strategies.")
+    parser.add_argument("--windows", type=int, default=300, help="Number of top-level windows.")
+    parser.add_argument("--hotkeys", type=int, default=200, help="Number of window-filtered hotkeys.")
+    parser.add_argument("--applications", type=int, default=20, help="Number of distinct window classes.")
+    parser.add_argument("--new-windows", type=int, default=50, help="Number of windows created in a burst.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of repetitions, the fastest one is reported.")
+    args = parser.parse_args()
+
+    print("{} windows, {} hotkeys, {} applications, {} new windows".format(
+        args.windows, args.hotkeys, args.applications, args.new_windows))
+    for name, root_window_grabs in (("per-window", False), ("root", True)):
+        print(name + ":")
+        for operation, elapsed, requests, round_trips, longest_job in run_strategy(root_window_grabs, args):
+            print("    {:14s} {:10.2f} ms, {:8d} requests, {:8d} round trips, longest job {:8.2f} ms".format(
+                operation + ":", elapsed * 1e3, requests, round_trips, longest_job * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""Tests of the interface module, which do not need an X server."""
+
+import os.path
+import sys
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+import autokey.iomediator  # Imported first to resolve the circular import between configmanager and model.
+from autokey import interface
+
+from Xlib import X
+
+DELAY = 0.05
+
+
+class DebouncedCallTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.called = threading.Event()
+        self.debounced = interface.DebouncedCall(DELAY, self._callback)
+        self.addCleanup(self.debounced.cancel)
+
+    def _callback(self):
+        self.calls.append(time.monotonic())
+        self.called.set()
+
+    def testBurstIsCoalesced(self):
+        self.assertFalse(self.debounced.schedule())
+        for _ in range(5):
+            time.sleep(DELAY / 5)
+            self.assertTrue(self.debounced.schedule())
+        last_schedule = time.monotonic()
+        self.assertTrue(self.called.wait(DELAY * 20))
+        time.sleep(DELAY * 2)
+        self.assertEqual(len(self.calls), 1)
+        # The delay restarts with each schedule() call
+        self.assertGreaterEqual(self.calls[0] - last_schedule, DELAY * 0.9)
+
+    def testScheduleAfterCallStartsAnew(self):
+        self.debounced.schedule()
+        self.assertTrue(self.called.wait(DELAY * 20))
+        self.called.clear()
+        self.assertFalse(self.debounced.schedule())
+        self.assertTrue(self.called.wait(DELAY * 20))
+        self.assertEqual(len(self.calls), 2)
+
+    def testCancel(self):
+        self.debounced.schedule()
+        self.debounced.cancel()
+        self.assertFalse(self.called.wait(DELAY * 3))
+        self.assertEqual(self.calls, [])
+
+    def testStaleTimerIsDiscarded(self):
+        # A timer that already fired, while a newer schedule() replaced it, must not call the callback.
+        self.debounced.schedule()
+        stale_generation = self.debounced._generation
+        self.debounced.schedule()
+        self.debounced._fire(stale_generation)
+        self.assertEqual(self.calls, [])
+        self.assertTrue(self.called.wait(DELAY * 20))
+        self.assertEqual(len(self.calls), 1)
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = interface.WorkQueue()
+
+    def _drain(self) -> list:
+        jobs = []
+        while any(self.queue.depths().values()):
+            jobs.append(self.queue.get())
+        return jobs
+
+    def testLanesAreServedInOrder(self):
+        self.queue.put(interface.WorkLane.BACKGROUND, "grab", (1,))
+        self.queue.put(interface.WorkLane.OUTPUT, "send", (1,))
+        self.queue.put(interface.WorkLane.INPUT, "press", (1,))
+        self.queue.put(interface.WorkLane.BACKGROUND, "grab", (2,))
+        self.queue.put(interface.WorkLane.INPUT, "press", (2,))
+        self.assertEqual(self._drain(), [
+            ("press", (1,)), ("press", (2,)), ("send", (1,)), ("grab", (1,)), ("grab", (2,))
+        ])
+
+    def testInputOvertakesPendingBackground(self):
+        self.queue.put(interface.WorkLane.BACKGROUND, "grab", (1,))
+        self.queue.put(interface.WorkLane.BACKGROUND, "grab", (2,))
+        self.assertEqual(self.queue.get(), ("grab", (1,)))
+        # A job enqueued by a running BACKGROUND job waits behind input arriving in the meantime
+        self.queue.put(interface.WorkLane.BACKGROUND, "grab", (3,))
+        self.queue.put(interface.WorkLane.INPUT, "press", (1,))
+        self.assertEqual(self._drain(), [("press", (1,)), ("grab", (2,)), ("grab", (3,))])
+
+    def testDepths(self):
+        for number in range(3):
+            self.queue.put(interface.WorkLane.OUTPUT, "send", (number,))
+        self.queue.put(interface.WorkLane.BACKGROUND, "grab", ())
+        self.assertEqual(self.queue.depths(), {"INPUT": 0, "OUTPUT": 3, "BACKGROUND": 1})
+        self._drain()
+        self.queue.put(interface.WorkLane.OUTPUT, "send", ())
+        self.assertEqual(self.queue.depths(), {"INPUT": 0, "OUTPUT": 1, "BACKGROUND": 0})
+        self.assertEqual(self.queue.peak_depths(), {"INPUT": 0, "OUTPUT": 3, "BACKGROUND": 1})
+
+    def testGetBlocksUntilPut(self):
+        jobs = []
+        consumer = threading.Thread(target=lambda: jobs.append(self.queue.get()))
+        consumer.start()
+        time.sleep(DELAY)
+        self.assertEqual(jobs, [])
+        self.queue.put(interface.WorkLane.BACKGROUND, None, None)
+        consumer.join(DELAY * 20)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(jobs, [(None, None)])
+
+
+class GrabRegistryTest(unittest.TestCase):
+
+    def testDiff(self):
+        registry = interface.GrabRegistry()
+        registry.add(1, 38, 4)
+        registry.add(1, 39, 4)
+        registry.add(2, 38, 4)
+        missing, obsolete = registry.diff({(1, 38, 4), (2, 38, 4), (3, 40, 8)})
+        self.assertEqual(missing, {(3, 40, 8)})
+        self.assertEqual(obsolete, {(1, 39, 4)})
+
+    def testDiscardAndForget(self):
+        registry = interface.GrabRegistry()
+        registry.add(1, 38, 4)
+        registry.add(1, 38, 4)
+        registry.add(1, 39, 0)
+        registry.add(2, 38, 4)
+        registry.discard(1, 38, 4)
+        # Discarding an unknown grab is a no-op
+        registry.discard(3, 38, 4)
+        self.assertEqual(registry.grabs(), {(1, 39, 0), (2, 38, 4)})
+        registry.forget_window(1)
+        self.assertEqual(registry.grabs(), {(2, 38, 4)})
+        registry.discard(2, 38, 4)
+        self.assertEqual(registry.grabs(), set())
+        self.assertEqual(registry._grabs, {})
+
+    def testWindowDiff(self):
+        registry = interface.GrabRegistry()
+        registry.add(1, 38, 4)
+        registry.add(1, 39, 4)
+        registry.add(2, 38, 4)
+        self.assertEqual(registry.window_ids(), {1, 2})
+        self.assertEqual(registry.window_grabs(1), {(38, 4), (39, 4)})
+        self.assertEqual(registry.window_grabs(3), set())
+        missing, obsolete = registry.diff_window(1, {(38, 4), (40, 8)})
+        self.assertEqual(missing, {(40, 8)})
+        self.assertEqual(obsolete, {(39, 4)})
+        self.assertEqual(registry.diff_window(3, {(38, 4)}), ({(38, 4)}, set()))
+
+
+class MockedDisplay:
+
+    def __init__(self):
+        self.polls = 0
+        self.flushes = 0
+
+    def pending_events(self) -> int:
+        self.polls += 1
+        return 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+def build_interface() -> interface.XInterfaceBase:
+    """Create an X interface holding only the state used by the fake event and output batch handling."""
+    x_interface = interface.XInterfaceBase.__new__(interface.XInterfaceBase)
+    x_interface.localDisplay = MockedDisplay()
+    x_interface.rootWindow = None
+    x_interface.lastChars = []
+    private_state = {
+        "pendingFakeEvents": interface.collections.deque(),
+        "pendingFakeEventsLock": threading.Lock(),
+        "batchThread": None,
+        "xEventLock": threading.Lock(),
+        "syncGrabItems": {},
+        "focusTracker": interface.FocusTracker(False),
+    }
+    for name, value in private_state.items():
+        setattr(x_interface, "_XInterfaceBase__" + name, value)
+    return x_interface
+
+
+@mock.patch.object(interface.xtest, "fake_input")
+class FakeEventEchoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.x_interface = build_interface()
+        self.fake_input = self.x_interface._XInterfaceBase__fakeInput
+        self.is_echo = self.x_interface._XInterfaceBase__isFakeEventEcho
+
+    def testEchoesAreMatchedInOrder(self, fake_input):
+        for keyCode in (38, 39, 38):
+            self.fake_input(X.KeyPress, keyCode)
+            self.fake_input(X.KeyRelease, keyCode)
+        self.assertEqual(fake_input.call_count, 6)
+        for keyCode in (38, 39, 38):
+            self.assertTrue(self.is_echo(X.KeyPress, keyCode))
+            self.assertTrue(self.is_echo(X.KeyRelease, keyCode))
+        self.assertFalse(self.is_echo(X.KeyPress, 38))
+
+    def testOtherEventDiscardsPendingEchoes(self, fake_input):
+        self.fake_input(X.KeyPress, 38)
+        self.fake_input(X.KeyRelease, 38)
+        self.fake_input(X.KeyPress, 39)
+        self.fake_input(X.KeyRelease, 39)
+        self.assertTrue(self.is_echo(X.KeyPress, 38))
+        # The release of key 38 was expected next. The physical key press is not swallowed and neither are the
+        # following ones, even if they match a discarded fake event.
+        self.assertFalse(self.is_echo(X.KeyPress, 39))
+        self.assertFalse(self.is_echo(X.KeyRelease, 39))
+        self.assertFalse(self.is_echo(X.KeyRelease, 38))
+
+    def testScriptFakeEventsAreHandledAsInput(self, fake_input):
+        self.fake_input(X.KeyPress, 38, swallowEcho=False)
+        self.fake_input(X.KeyPress, 39)
+        self.fake_input(X.KeyRelease, 38, swallowEcho=False)
+        self.assertFalse(self.is_echo(X.KeyPress, 38))
+        self.assertTrue(self.is_echo(X.KeyPress, 39))
+        self.assertFalse(self.is_echo(X.KeyRelease, 38))
+        self.assertEqual(len(self.x_interface._XInterfaceBase__pendingFakeEvents), 0)
+
+    def testLostEchoesExpire(self, fake_input):
+        self.fake_input(X.KeyPress, 38)
+        with mock.patch.object(interface.time, "monotonic",
+                               return_value=time.monotonic() + interface.FAKE_EVENT_ECHO_TIMEOUT + 1):
+            self.assertFalse(self.is_echo(X.KeyPress, 38))
+        self.assertEqual(len(self.x_interface._XInterfaceBase__pendingFakeEvents), 0)
+
+
+class SendBatchTest(unittest.TestCase):
+
+    def testBatchIsFlushedOnce(self):
+        x_interface = build_interface()
+        get_focus = x_interface._XInterfaceBase__getFocusWindow
+        focus_windows = []
+        # Stands in for the send operations, which look up the focused window before sending
+        x_interface._XInterfaceBase__sendKey = lambda keyName: focus_windows.append(get_focus())
+        with mock.patch.object(x_interface, "_XInterfaceBase__queryFocusWindow", return_value="focus"):
+            x_interface._XInterfaceBase__sendBatch([("send_key", ("a",))] * 3)
+            self.assertEqual(focus_windows, ["focus"] * 3)
+            # Polling for events would flush the output buffer in the middle of the batch
+            self.assertEqual(x_interface.localDisplay.polls, 0)
+            self.assertEqual(x_interface.localDisplay.flushes, 1)
+            self.assertIsNone(x_interface._XInterfaceBase__batchThread)
+            get_focus()
+            self.assertEqual(x_interface.localDisplay.polls, 1)
+
+
+class MockedWindow:
+
+    def __init__(self, window_id: int, title: str, parent=None):
+        self.id = window_id
+        self.title = title
+        self.parent = parent
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+        self.grabbed = set()
+
+    def query_tree(self):
+        # Not a Mock, which uses the parent argument for itself
+        return types.SimpleNamespace(parent=self.parent if self.parent is not None else 0, children=self.children)
+
+    def grab_key(self, keycode, mask, owner_events, pointer_mode, keyboard_mode):
+        self.grabbed.add((keycode, mask))
+
+    def ungrab_key(self, keycode, mask, onerror=None):
+        self.grabbed.discard((keycode, mask))
+
+
+class WindowGrabPassTest(unittest.TestCase):
+    """The grab pass run for created, mapped or renamed windows."""
+
+    def setUp(self):
+        self.x_interface = build_interface()
+        self.root = MockedWindow(1, "")
+        self.x_interface.rootWindow = self.root
+        self.x_interface.modMasks = {}
+        editor_filter = mock.Mock(_should_trigger_window_title=lambda info: info.wm_title.endswith("Editor"),
+                                  hotKey="e", modifiers=[])
+        snapshot = mock.Mock(hotKeys=[editor_filter], hotKeyFolders=[])
+        self.x_interface.app = mock.Mock(configManager=mock.Mock(snapshot=snapshot))
+        self.x_interface.get_window_info = lambda window, traverse=True: interface.WindowInfo(
+            wm_title=window.title, wm_class="")
+        private_state = {
+            "windowsToGrab": {},
+            "windowsToGrabLock": threading.Lock(),
+            "grabRegistry": interface.GrabRegistry(),
+            "needsMutterWorkaround": lambda item: False,
+            "lookupKeyCode": lambda key: {"e": 26, "g": 42}[key],
+        }
+        for name, value in private_state.items():
+            setattr(self.x_interface, "_XInterfaceBase__" + name, value)
+        settings_patcher = mock.patch.dict(interface.cm.ConfigManager.SETTINGS,
+                                           {interface.cm.ROOT_WINDOW_HOTKEY_GRABS: False})
+        settings_patcher.start()
+        self.addCleanup(settings_patcher.stop)
+
+    def _grabPass(self, *windows):
+        self.x_interface._XInterfaceBase__windowsToGrab.update((window.id, window) for window in windows)
+        self.x_interface._XInterfaceBase__grabHotkeysForWindows()
+
+    def testRenamedWindow(self):
+        frame = MockedWindow(2, "", self.root)
+        client = MockedWindow(3, "Document - Editor", frame)
+        child = MockedWindow(4, "", client)
+        registry = self.x_interface._XInterfaceBase__grabRegistry
+        # A grab of a hotkey without a window filter is not touched by the pass
+        registry.add(client.id, 42, 0)
+        self._grabPass(client)
+        self.assertEqual(client.grabbed, {(26, 0)})
+        self.assertEqual(child.grabbed, {(26, 0)})
+        self.assertEqual(frame.grabbed, set())
+        self.assertEqual(registry.window_grabs(client.id), {(26, 0), (42, 0)})
+
+        client.title = "Shell - Terminal"
+        self._grabPass(client)
+        self.assertEqual(client.grabbed, set())
+        self.assertEqual(child.grabbed, set())
+        self.assertEqual(registry.grabs(), {(client.id, 42, 0)})
+
+    def testInheritedGrabsAreKept(self):
+        frame = MockedWindow(2, "Document - Editor", self.root)
+        client = MockedWindow(3, "", frame)
+        self._grabPass(frame)
+        self.assertEqual(client.grabbed, {(26, 0)})
+        # The client does not match by itself, but inherits the grab of the matching frame
+        client.title = "Untitled"
+        self._grabPass(client)
+        self.assertEqual(client.grabbed, {(26, 0)})
+
+
+class MappingNotifyTest(unittest.TestCase):
+    """Keyboard mapping changes made by AutoKey itself must not re-initialise the keyboard mappings."""
+
+    def setUp(self):
+        self.x_interface = build_interface()
+        self.reinits = []
+        private_state = {
+            "ownMappingChanges": interface.collections.deque(),
+            "mappingNotifyLock": threading.Lock(),
+            "ownMappingNotifyTime": None,
+            "foreignMappingNotified": False,
+            "mappingChangeBurstStart": 0.0,
+            "mappingReinitPending": False,
+            "scheduleMappingReinit": lambda: self.reinits.append(time.monotonic()),
+        }
+        for name, value in private_state.items():
+            setattr(self.x_interface, "_XInterfaceBase__" + name, value)
+        self.x_interface.coalescedMappingChanges = 0
+        scheduler = interface.DebouncedCall(DELAY, self.x_interface._XInterfaceBase__mappingChangeSettled)
+        self.x_interface._XInterfaceBase__mappingChangeScheduler = scheduler
+        self.addCleanup(scheduler.cancel)
+        self.expect = self.x_interface._XInterfaceBase__expectMappingNotify
+        self.notified = self.x_interface._XInterfaceBase__mappingNotified
+
+    def _settle(self):
+        time.sleep(DELAY * 3)
+
+    def testOwnChangeIsIgnored(self):
+        self.expect(200, 3)
+        self.notified(200, 3)
+        # The toolkit reports the same change, without its keycode range
+        self.x_interface.on_keys_changed()
+        self._settle()
+        self.assertEqual(self.reinits, [])
+        self.assertEqual(len(self.x_interface._XInterfaceBase__ownMappingChanges), 0)
+
+    def testForeignChange(self):
+        self.expect(200, 3)
+        # Only the exact range of the own change is ignored
+        self.notified(200, 4)
+        self.x_interface.on_keys_changed()
+        self._settle()
+        self.assertEqual(len(self.reinits), 1)
+        self.notified(200, 3)
+        self._settle()
+        self.assertEqual(len(self.reinits), 1)
+
+    def testLaterToolkitEventIsNotIgnored(self):
+        self.expect(200, 3)
+        self.notified(200, 3)
+        time.sleep(interface.MAPPING_CHANGE_DELAY)
+        # A layout change well after the own change
+        self.x_interface.on_keys_changed()
+        self._settle()
+        self.assertEqual(len(self.reinits), 1)
@@ -0,0 +1,59 @@
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+import autokey.iomediator  # Imported first to resolve the circular import between configmanager and model.
+from autokey.iomediator._keyprogram import compile_key_program, KEY_PROGRAM_CACHE_SIZE
+
+
+class KeyProgramTest(unittest.TestCase):
+
+    def testPlainText(self):
+        program = compile_key_program("Hello World")
+        self.assertEqual(program.operations, (("send_string", ("Hello World",)),))
+        self.assertEqual(program.backspaces, 10)
+
+    def testNewlinesAndTabsAreSentAsKeys(self):
+        program = compile_key_program("a\tb\nc")
+        self.assertEqual(program.operations, (
+            ("send_string", ("a",)), ("send_key", ("<tab>",)), ("send_string", ("b",)),
+            ("send_key", ("<enter>",)), ("send_string", ("c",))
+        ))
+
+    def testModifiedKeys(self):
+        program = compile_key_program("<ctrl>+<shift>+t<alt>+fx<ctrl>+<escape>")
+        self.assertEqual(program.operations, (
+            ("send_modified_key", ("t", ("<ctrl>", "<shift>"))),
+            ("send_modified_key", ("f", ("<alt>",))),
+            ("send_string", ("x",)),
+            ("send_modified_key", ("<escape>", ("<ctrl>",))),
+        ))
+
+    def testUnknownTagsAreSentAsText(self):
+        program = compile_key_program("<table></table>")
+        self.assertEqual(program.operations, (("send_string", ("<table>",)), ("send_string", ("</table>",))))
+
+    def testKeyRunsAreMerged(self):
+        program = compile_key_program("ab<left><left><left><right><left>")
+        self.assertEqual(program.operations, (
+            ("send_string", ("ab",)), ("send_key_repeated", ("<left>", 3)),
+            ("send_key", ("<right>",)), ("send_key", ("<left>",))
+        ))
+
+    def testBackspaces(self):
+        # The backspace pressed by the user is already discounted, each key counts as one character.
+        self.assertEqual(compile_key_program("abc").backspaces, 2)
+        self.assertEqual(compile_key_program("ab<enter>c").backspaces, 3)
+        self.assertEqual(compile_key_program("a\nb").backspaces, 2)
+
+    def testProgramsAreCached(self):
+        compile_key_program.cache_clear()
+        program = compile_key_program("cached <enter>")
+        self.assertIs(compile_key_program("cached <enter>"), program)
+        self.assertIsNot(compile_key_program("changed <enter>"), program)
+        for number in range(KEY_PROGRAM_CACHE_SIZE):
+            compile_key_program("filler {}".format(number))
+        self.assertIsNot(compile_key_program("cached <enter>"), program)
+        self.assertEqual(compile_key_program("cached <enter>").operations, program.operations)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the keypress latency, measured using the latency tracing of the tracing module. Key presses are passed
+through the real input path, from XRecordInterface.handle_keypress() over the IoMediator to Service.handle_keypress(),
+in two modes:
+
+- queued (singleHopInput disabled): the key press is handed over via the event loop and the IoMediator queues,
+- single hop (singleHopInput enabled): the key press is handled right away, in the thread receiving it.
+
+Usage: python3 test/latencybenchmark.py [--keys N] [--interval MS] [--phrases M] [--seed S]
+
+A thread standing in for the XRecord thread types N keys of English-like text, waiting the given interval between
+two keys. The expansion service holds M abbreviation phrases, none of which is triggered by the typed text, so that
+the whole keypress handling up to the match decision is measured, but no phrase is expanded. The X server is replaced
+by a mocked display, which answers requests immediately. In a real session, each round trip to the X server adds the
+latency of the X connection on top.
+"""
+
+import argparse
+import collections
+import gettext
+import os.path
+import random
+import string
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+# The macro module, imported by the expansion service, translates its titles at import time
+gettext.install("autokey")
+
+import autokey.iomediator  # Imported first to resolve the circular import between configmanager and model.
+from autokey import configmanager as cm
+from autokey import interface
+from autokey import matcher
+from autokey import model
+from autokey import service
+from autokey import tracing
+from autokey.iomediator import _iomediator
+from autokey.iomediator.key import Key
+
+TEXT = "the quick brown fox jumps over the lazy dog "
+# Keycodes of a US keyboard layout
+KEYCODES = {char: code for code, char in enumerate("qwertyuiop", 24)}
+KEYCODES.update({char: code for code, char in enumerate("asdfghjkl", 38)})
+KEYCODES.update({char: code for code, char in enumerate("zxcvbnm", 52)})
+KEYCODES[" "] = 65
+NAME_ATOM = 1
+VISIBLE_NAME_ATOM = 2
+
+
+class MockedDisplay:
+    """The parts of an Xlib display used by the keypress handling."""
+
+    def __init__(self):
+        self.root = MockedWindow(None, "", None)
+        self.focus = MockedWindow(self.root, "Document - Editor", ("editor", "Editor"))
+        self.keysyms = {code: ord(char) for char, code in KEYCODES.items()}
+
+    def keycode_to_keysym(self, keycode: int, index: int) -> int:
+        keysym = self.keysyms.get(keycode, 0)
+        if index & 1 and keysym:
+            keysym = ord(chr(keysym).upper())
+        return keysym
+
+    def get_input_focus(self):
+        return types.SimpleNamespace(focus=self.focus)
+
+    def pending_events(self) -> int:
+        return 0
+
+
+class MockedWindow:
+
+    def __init__(self, parent, title: str, wm_class):
+        self.id = id(self)
+        self.parent = parent
+        self.title = title
+        self.wm_class = wm_class
+
+    def query_tree(self):
+        return types.SimpleNamespace(children=[], parent=self.parent or 0)
+
+    def get_property(self, atom, property_type, offset, length):
+        if atom == NAME_ATOM and self.title:
+            return types.SimpleNamespace(value=self.title)
+        return None
+
+    def get_wm_class(self):
+        return self.wm_class
+
+    def change_attributes(self, event_mask=None, onerror=None):
+        pass
+
+
+def build_snapshot(phrase_count: int, rng: random.Random) -> cm.ConfigSnapshot:
+    folder = model.Folder("Benchmark")
+    for number in range(phrase_count):
+        phrase = model.Phrase("phrase {}".format(number), "expansion {}".format(number))
+        phrase.set_modes([model.TriggerMode.ABBREVIATION])
+        # The trailing number is never typed, so no phrase is triggered
+        length = rng.randint(2, 6)
+        phrase.add_abbreviation("".join(rng.choice(string.ascii_lowercase) for _ in range(length)) + str(number))
+        folder.add_item(phrase)
+    folders = [folder]
+    items = list(folder.items)
+    return cm.ConfigSnapshot(
+        (), (), (), tuple(folders), tuple(items),
+        matcher.AbbreviationIndex(folders, items),
+        matcher.HotkeyTable([], [], []),
+        matcher.WindowFilterCache(folders + items)
+    )
+
+
+def build_pipeline(snapshot: cm.ConfigSnapshot):
+    """
+    Create the expansion service, the IoMediator and the X interface using the mocked display. Only the state used by
+    the keypress handling is initialised, so that no real X connection is needed. Returns the interface and mediator,
+    both having their threads started.
+    """
+    app = types.SimpleNamespace(configManager=types.SimpleNamespace(snapshot=snapshot))
+    expansion_service = service.Service(app)
+    cm.ConfigManager.SETTINGS[cm.SERVICE_RUNNING] = True
+    # No script is run, so the script engine is not needed
+    expansion_service.scriptRunner = types.SimpleNamespace(engine=None)
+    expansion_service.phraseRunner = service.PhraseRunner(expansion_service)
+
+    mediator = _iomediator.IoMediator.__new__(_iomediator.IoMediator)
+    threading.Thread.__init__(mediator, name="KeypressHandler-thread")
+    mediator.queue = _iomediator.queue.Queue()
+    mediator.listeners = [expansion_service]
+    mediator.modifiers = {modifier: False for modifier in (
+        Key.CONTROL, Key.ALT, Key.ALT_GR, Key.SHIFT, Key.SUPER, Key.HYPER, Key.META, Key.CAPSLOCK, Key.NUMLOCK)}
+
+    mocked_display = MockedDisplay()
+    x_interface = interface.XRecordInterface.__new__(interface.XRecordInterface)
+    x_interface.app = app
+    x_interface.mediator = mediator
+    x_interface.shutdown = False
+    x_interface.localDisplay = mocked_display
+    x_interface.rootWindow = mocked_display.root
+    x_interface.queue = interface.WorkQueue()
+    x_interface.eventThread = threading.Thread(target=x_interface._XInterfaceBase__eventLoop)
+    private_state = {
+        "syncGrabItems": {},
+        "windowInfoCache": interface.WindowInfoCache(),
+        "focusTracker": interface.FocusTracker(True),
+        "windowsToGrab": {},
+        "windowsToGrabLock": threading.Lock(),
+        "xEventLock": threading.Lock(),
+        "pendingFakeEvents": collections.deque(),
+        "batchThread": None,
+        "pendingFakeEventsLock": threading.Lock(),
+        "NameAtom": NAME_ATOM,
+        "VisibleNameAtom": VISIBLE_NAME_ATOM,
+        "windowInfoAtoms": {NAME_ATOM, VISIBLE_NAME_ATOM},
+    }
+    for name, value in private_state.items():
+        setattr(x_interface, "_XInterfaceBase__" + name, value)
+    x_interface._XInterfaceBase__buildKeyNameTable()
+    mediator.interface = x_interface
+    expansion_service.mediator = mediator
+
+    x_interface.eventThread.start()
+    mediator.start()
+    return x_interface, mediator
+
+
+def stop_pipeline(x_interface, mediator):
+    """Wait until all queued key presses are handled, then stop the threads."""
+    x_interface.queue.put(interface.WorkLane.BACKGROUND, None, None)
+    x_interface.eventThread.join()
+    mediator.queue.put_nowait((None, None, None))
+    mediator.join()
+
+
+def run_mode(single_hop: bool, args) -> dict:
+    """Type the keys and return the latency statistics."""
+    cm.ConfigManager.SETTINGS[cm.SINGLE_HOP_INPUT] = single_hop
+    snapshot = build_snapshot(args.phrases, random.Random(args.seed))
+    x_interface, mediator = build_pipeline(snapshot)
+    tracing.reset()
+    tracing.set_enabled(True)
+
+    def type_keys():
+        # Stands in for XRecordInterface.__processEvent()
+        for number in range(args.keys):
+            keyCode = KEYCODES[TEXT[number % len(TEXT)]]
+            tracing.begin()
+            x_interface.handle_keypress(keyCode)
+            tracing.end()
+            time.sleep(args.interval / 2000)
+            x_interface.handle_keyrelease(keyCode)
+            time.sleep(args.interval / 2000)
+
+    record_thread = threading.Thread(target=type_keys, name="XRecord-thread")
+    record_thread.start()
+    record_thread.join()
+    stop_pipeline(x_interface, mediator)
+    tracing.set_enabled(False)
+    return tracing.statistics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the keypress latency of the input paths.")
+    parser.add_argument("--keys", type=int, default=1000, help="Number of typed keys.")
+    parser.add_argument("--interval", type=float, default=10, help="Time between two key presses, in milliseconds.")
+    parser.add_argument("--phrases", type=int, default=2000, help="Number of abbreviation phrases.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated abbreviations.")
+    args = parser.parse_args()
+
+    print("{} keys, {} ms interval, {} phrases".format(args.keys, args.interval, args.phrases))
+    for name, single_hop in (("queued", False), ("single hop", True)):
+        print(name + ":")
+        for stage, values in run_mode(single_hop, args).items():
+            if values["count"]:
+                print("    {:24s} {:6d} keys, p50 {:7.3f} ms, p95 {:7.3f} ms, p99 {:7.3f} ms".format(
+                    stage + ":", values["count"], values["p50"], values["p95"], values["p99"]))
+
+
+if __name__ == "__main__":
+    main()
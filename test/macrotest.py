@@ -0,0 +1,122 @@
+import datetime
+import gettext
+import os
+import os.path
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import pyinotify
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+# The macro module translates its titles at import time
+gettext.install("autokey")
+
+import autokey.iomediator  # Imported first to resolve the circular import between configmanager and model.
+from autokey import configmanager as cm
+from autokey import macro
+from autokey import model
+
+
+class CompileTemplateTest(unittest.TestCase):
+
+    def testStaticText(self):
+        template = macro.compile_template("No macros <enter> here")
+        self.assertEqual("".join(template.parts), "No macros <enter> here")
+        self.assertEqual(template.nodes, ())
+
+    def testNodesInEvaluationOrder(self):
+        template = macro.compile_template(
+            "<cursor>a<date format=%Y><script name=s args=>b<file name=f.txt><script name=t args=1>")
+        self.assertEqual([(node.macro_id, node.index) for node in template.nodes], [
+            ("script", 5), ("script", 9), ("date", 3), ("file", 7), ("cursor", 1)
+        ])
+        for node in template.nodes:
+            self.assertEqual(template.parts[node.index][1:].split(" ", 1)[0].rstrip(">"), node.macro_id)
+        self.assertEqual(template.nodes[0].args, {"name": "s", "args": ""})
+        self.assertEqual(template.nodes[2].args, {"format": "%Y"})
+
+    def testInvalidArgumentsAreReportedOnEvaluation(self):
+        template = macro.compile_template("<date>")
+        node, = template.nodes
+        self.assertIsNone(node.args)
+        self.assertIn("format", node.error)
+        with self.assertRaises(Exception):
+            macro.DateMacro().evaluate(list(template.parts), node)
+
+    def testTemplatesAreCached(self):
+        template = macro.compile_template("<cursor> cached")
+        self.assertIs(macro.compile_template("<cursor> cached"), template)
+        self.assertIsNot(macro.compile_template("<cursor> changed"), template)
+
+    def testExpansion(self):
+        manager = macro.MacroManager(None)
+        self.addCleanup(manager.shutdown)
+        expansion = model.Expansion("Hello <cursor>World, it is <date format=%Y>")
+        manager.process_expansion(expansion)
+        year = datetime.datetime.now().strftime("%Y")
+        self.assertEqual(expansion.string, "Hello World, it is " + year + "<left>" * len("World, it is " + year))
+        # The cached template is not altered by the expansion
+        expansion = model.Expansion("Hello <cursor>World, it is <date format=%Y>")
+        manager.process_expansion(expansion)
+        self.assertEqual(expansion.string, "Hello World, it is " + year + "<left>" * len("World, it is " + year))
+
+
+class FileContentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "signature.txt")
+        self._write("Regards")
+        settings = mock.patch.dict(cm.ConfigManager.SETTINGS, {cm.WATCH_MACRO_FILES: True})
+        settings.start()
+        self.addCleanup(settings.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def _write(self, content):
+        with open(self.path, "w") as output:
+            output.write(content)
+
+    def _read_with_monitor(self, watch_succeeds):
+        """Read the file twice, changing it in between. Returns both results and the mocked monitor."""
+        with mock.patch("autokey.monitor.FileMonitor") as monitor_class:
+            monitor = monitor_class.return_value
+            monitor.add_watch.return_value = watch_succeeds
+            cache = macro.FileContentCache()
+            first = cache.read(self.path)
+            self._write("Best regards")
+            second = cache.read(self.path)
+            cache.shutdown()
+        return first, second, monitor
+
+    def testFailedWatchFallsBackToStat(self):
+        first, second, monitor = self._read_with_monitor(watch_succeeds=False)
+        self.assertEqual(first, "Regards")
+        # The watch was refused, so the change must be detected by comparing the modification time and size.
+        self.assertEqual(second, "Best regards")
+        monitor.add_watch.assert_called_with(self.directory.name)
+        monitor.remove_watch.assert_not_called()
+
+    def testWatchedFileIsStillValidated(self):
+        first, second, monitor = self._read_with_monitor(watch_succeeds=True)
+        self.assertEqual(first, "Regards")
+        # No change notification was delivered by the mocked monitor, like for files on network file systems. The
+        # change must be detected by comparing the modification time and size.
+        self.assertEqual(second, "Best regards")
+        monitor.add_watch.assert_called_once_with(self.directory.name)
+        monitor.remove_watch.assert_not_called()
+
+    def testChangeNotificationRefreshesContent(self):
+        with mock.patch("autokey.monitor.FileMonitor") as monitor_class:
+            monitor_class.return_value.add_watch.return_value = True
+            cache = macro.FileContentCache()
+            cache.read(self.path)
+            # Partially written files are not reported, only closed or moved ones.
+            mask = monitor_class.call_args[0][1]
+            self.assertTrue(mask & pyinotify.IN_CLOSE_WRITE and mask & pyinotify.IN_MOVED_TO)
+            self.assertFalse(mask & pyinotify.IN_MODIFY)
+            self._write("Best regards")
+            cache.path_created_or_modified(self.path)
+            self.assertEqual(cache.read(self.path), "Best regards")
+            cache.shutdown()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark comparing the abbreviation matching done by the expansion service on every keypress:
+
+- rescan: the previous approach, re-joining the input stack and calling check_input() on every item, and
+- streaming: the StreamingMatcher, advancing one character per key and only checking the returned candidates.
+
+Usage: python3 test/matcherbenchmark.py [--phrases N] [--seed S] [trace_file ...]
+
+A trace file contains typing as plain text, one keystroke per character. A backspace is stored as the '\\b'
+character. Lines starting with '# ' at the top of the file are a header and skipped. Without trace files, a synthetic
+trace of English-like text with occasional typos and the hand-written sample trace in test/data/typingtrace.txt are
+used. The sample trace is not recorded from real typing: it is an e-mail including a few shell commands, with typos
+and corrections written in by hand. It has 723 keystrokes, 20 of which are backspaces.
+"""
+
+import argparse
+import collections
+import gettext
+import os.path
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+# The macro module, imported by the expansion service, translates its titles at import time
+gettext.install("autokey")
+
+import autokey.iomediator  # Imported first to resolve the circular import between configmanager and model.
+from autokey import model
+from autokey.interface import WindowInfo
+from autokey.matcher import AbbreviationIndex, StreamingMatcher
+from autokey.service import MAX_STACK_LENGTH
+
+BACKSPACE = "\b"
+SAMPLE_TRACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "typingtrace.txt")
+WINDOW_INFO = WindowInfo(wm_title="benchmark", wm_class="benchmark.Benchmark")
+
+
+WORDS = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "please", "regards", "thanks"]
+
+
+def build_library(phrase_count: int, rng: random.Random):
+    folder = model.Folder("Benchmark")
+    for number in range(phrase_count):
+        phrase = model.Phrase("phrase {}".format(number), "expansion {}".format(number))
+        phrase.set_modes([model.TriggerMode.ABBREVIATION])
+        if number < len(WORDS) // 2:
+            # Make sure that some of the words used in the synthetic trace trigger an expansion
+            phrase.add_abbreviation(WORDS[2 * number])
+        else:
+            length = rng.randint(2, 6)
+            phrase.add_abbreviation("".join(rng.choice(string.ascii_lowercase) for _ in range(length)) + str(number))
+        phrase.ignoreCase = rng.random() < 0.2
+        phrase.immediate = rng.random() < 0.2
+        folder.add_item(phrase)
+    return [folder], list(folder.items)
+
+
+def synthetic_trace(length: int, rng: random.Random) -> str:
+    keys = []
+    while len(keys) < length:
+        word = rng.choice(WORDS)
+        if rng.random() < 0.05:
+            # A typo, corrected using backspace
+            keys.append(rng.choice(string.ascii_lowercase))
+            keys.append(BACKSPACE)
+        keys.extend(word)
+        keys.append(rng.choice(" .,\n") if rng.random() < 0.2 else " ")
+    return "".join(keys[:length])
+
+
+def run_rescan(trace: str, folders, items) -> int:
+    abbreviations = [item for item in items if model.TriggerMode.ABBREVIATION in item.modes]
+    stack = collections.deque(maxlen=MAX_STACK_LENGTH)
+    matches = 0
+    for key in trace:
+        if key == BACKSPACE:
+            if stack:
+                stack.pop()
+            continue
+        stack.append(key)
+        buffer = "".join(stack)
+        matched = [item for item in abbreviations if item.check_input(buffer, WINDOW_INFO)]
+        matched += [item for item in folders + items if item.check_input(buffer, WINDOW_INFO)]
+        matches += bool(matched)
+    return matches
+
+
+def run_streaming(trace: str, folders, items) -> int:
+    stack = collections.deque(maxlen=MAX_STACK_LENGTH)
+    matcher = StreamingMatcher(AbbreviationIndex(folders, items), MAX_STACK_LENGTH)
+    matches = 0
+    for key in trace:
+        if key == BACKSPACE:
+            if stack:
+                stack.pop()
+                matcher.pop()
+            continue
+        stack.append(key)
+        matcher.push(key)
+        candidate_folders, candidate_items = matcher.candidates()
+        if candidate_folders or candidate_items:
+            buffer = "".join(stack)
+            matched = [item for item in candidate_folders + candidate_items if item.check_input(buffer, WINDOW_INFO)]
+            matches += bool(matched)
+    return matches
+
+
+def load_trace(path: str) -> str:
+    """Read a trace file, skipping its header."""
+    with open(path, "r", encoding="UTF-8") as trace_file:
+        lines = trace_file.read().splitlines(keepends=True)
+    while lines and lines[0].startswith("# "):
+        lines.pop(0)
+    return "".join(lines)
+
+
+def measure(function, trace, folders, items):
+    start = time.perf_counter()
+    matches = function(trace, folders, items)
+    elapsed = time.perf_counter() - start
+    return elapsed, matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the abbreviation matching paths.")
+    parser.add_argument("traces", nargs="*", help="Typing trace files. '\\b' denotes a backspace.")
+    parser.add_argument("--phrases", type=int, default=5000, help="Number of phrases in the generated library.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated library and trace.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    folders, items = build_library(args.phrases, rng)
+    traces = []
+    if not args.traces:
+        traces.append(("synthetic", synthetic_trace(2000, rng)))
+        traces.append(("hand-written sample", load_trace(SAMPLE_TRACE)))
+    for path in args.traces:
+        traces.append((path, load_trace(path)))
+
+    print("Library: {} phrases".format(len(items)))
+    for name, trace in traces:
+        rescan_time, rescan_matches = measure(run_rescan, trace, folders, items)
+        streaming_time, streaming_matches = measure(run_streaming, trace, folders, items)
+        if rescan_matches != streaming_matches:
+            print("WARNING: Match counts differ: rescan {}, streaming {}".format(rescan_matches, streaming_matches))
+        keys = max(len(trace), 1)
+        print("{}: {} keys, {} matches".format(name, len(trace), streaming_matches))
+        print("    rescan:    {:10.1f} µs/key".format(rescan_time / keys * 1e6))
+        print("    streaming: {:10.1f} µs/key".format(streaming_time / keys * 1e6))
+        print("    speedup:   {:10.1f}x".format(rescan_time / max(streaming_time, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import collections
+import os.path
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+import autokey.iomediator  # Imported first to resolve the circular import between configmanager and model.
+from autokey import matcher
+from autokey import model
+from autokey.interface import WindowInfo
+
+EDITOR = WindowInfo(wm_title="Document - Editor", wm_class="editor.Editor")
+TERMINAL = WindowInfo(wm_title="Shell - Terminal", wm_class="terminal.Terminal")
+BACKSPACE = "\b"
+MAX_LENGTH = 20
+
+
+def build_phrase(folder: model.Folder, *abbreviations, ignore_case=False, immediate=False, trigger_inside=False,
+                 word_chars=None, window_filter=None) -> model.Phrase:
+    phrase = model.Phrase("phrase {}".format(len(folder.items)), "expansion")
+    phrase.set_modes([model.TriggerMode.ABBREVIATION])
+    for abbreviation in abbreviations:
+        phrase.add_abbreviation(abbreviation)
+    phrase.ignoreCase = ignore_case
+    phrase.immediate = immediate
+    phrase.triggerInside = trigger_inside
+    if word_chars is not None:
+        phrase.set_word_chars(word_chars)
+    if window_filter is not None:
+        phrase.set_window_titles(window_filter)
+    folder.add_item(phrase)
+    return phrase
+
+
+class StreamingMatcherTest(unittest.TestCase):
+    """
+    Types keys into a StreamingMatcher, like the expansion service does, and compares the confirmed candidates after
+    each key with a full scan of all items using check_input().
+    """
+
+    def setUp(self):
+        self.folder = model.Folder("Folder")
+
+    def _typeAndCompare(self, keys: str, window_info: WindowInfo=EDITOR) -> list:
+        """Returns the matching items after each typed key. Fails, if the matcher misses or adds a match."""
+        items = list(self.folder.items)
+        index = matcher.AbbreviationIndex([self.folder], items)
+        streaming = matcher.StreamingMatcher(index, MAX_LENGTH)
+        stack = collections.deque(maxlen=MAX_LENGTH)
+        results = []
+        for key in keys:
+            if key == BACKSPACE:
+                if stack:
+                    stack.pop()
+                    streaming.pop()
+                continue
+            stack.append(key)
+            streaming.push(key)
+            buffer = "".join(stack)
+            expected = [item for item in items if item.check_input(buffer, window_info)]
+            folders, candidates = streaming.candidates()
+            self.assertEqual(folders, [])
+            actual = [item for item in candidates if item.check_input(buffer, window_info)]
+            self.assertEqual(actual, expected, "Buffer {!r}".format(buffer))
+            results.append(actual)
+        return results
+
+    def testTriggerCharacterFollowsAbbreviation(self):
+        phrase = build_phrase(self.folder, "brb")
+        results = self._typeAndCompare("brb brb.brbx")
+        self.assertEqual(results[3], [phrase])
+        self.assertEqual(results[7], [phrase])
+        # Immediately after the abbreviation and two characters after it, nothing is triggered.
+        self.assertEqual(results[2], [])
+        self.assertEqual(results[4], [])
+
+    def testImmediate(self):
+        phrase = build_phrase(self.folder, "@@", immediate=True)
+        results = self._typeAndCompare("@@ @@ a@@")
+        self.assertEqual(results[1], [phrase])
+        self.assertEqual(results[2], [])
+        self.assertEqual(results[4], [phrase])
+        self.assertEqual(results[8], [])
+
+    def testTriggerInside(self):
+        inside = build_phrase(self.folder, "ing", trigger_inside=True)
+        build_phrase(self.folder, "ion")
+        results = self._typeAndCompare("walking action ")
+        self.assertEqual(results[7], [inside])
+        # "ion" is only matched as a word of its own
+        self.assertEqual(results[14], [])
+
+    def testWordChars(self):
+        build_phrase(self.folder, "sig", word_chars=r"[\w-]")
+        default = build_phrase(self.folder, "sag")
+        # A dash is a word character for the first phrase, so it does not trigger it
+        results = self._typeAndCompare("sig- sag-")
+        self.assertEqual(results[3], [])
+        self.assertEqual(results[8], [default])
+
+    def testIgnoreCase(self):
+        phrase = build_phrase(self.folder, "Addr", ignore_case=True)
+        build_phrase(self.folder, "Tel")
+        results = self._typeAndCompare("ADDR addr TEL ")
+        self.assertEqual(results[4], [phrase])
+        self.assertEqual(results[9], [phrase])
+        self.assertEqual(results[13], [])
+
+    def testIgnoreCaseFinalSigma(self):
+        # Lower-casing the whole abbreviation turns a trailing capital sigma into the final sigma, which a key by key
+        # folding of the input never produces.
+        phrase = build_phrase(self.folder, "ΟΔΟΣ", ignore_case=True)
+        final = build_phrase(self.folder, "τας", ignore_case=True)
+        results = self._typeAndCompare("ΟΔΟΣ ΤΑΣ ")
+        self.assertEqual(results[4], [phrase])
+        self.assertEqual(results[8], [final])
+
+    def testMultipleAbbreviations(self):
+        phrase = build_phrase(self.folder, "thx", "ty")
+        build_phrase(self.folder, "tyvm")
+        results = self._typeAndCompare("thx ty tyvm ")
+        self.assertEqual(results[3], [phrase])
+        self.assertEqual(results[6], [phrase])
+        self.assertEqual(len(results[11]), 1)
+        self.assertNotEqual(results[11], [phrase])
+
+    def testWindowFilter(self):
+        build_phrase(self.folder, "ls", window_filter=r"terminal\..*")
+        results = self._typeAndCompare("ls ", EDITOR)
+        self.assertEqual(results[2], [])
+        results = self._typeAndCompare("ls ", TERMINAL)
+        self.assertEqual(len(results[2]), 1)
+
+    def testBackspace(self):
+        phrase = build_phrase(self.folder, "brb")
+        results = self._typeAndCompare("brx\bb \b\bb ")
+        self.assertEqual(results[4], [phrase])
+        self.assertEqual(results[6], [phrase])
+
+    def testStackLengthLimit(self):
+        phrase = build_phrase(self.folder, "brb")
+        results = self._typeAndCompare("x" * (MAX_LENGTH * 2) + " brb" + BACKSPACE * 2 + "rb ")
+        self.assertEqual(results[-1], [phrase])
+
+    def testRebuild(self):
+        items = [build_phrase(self.folder, "brb")]
+        streaming = matcher.StreamingMatcher(matcher.AbbreviationIndex([self.folder], items), MAX_LENGTH)
+        for key in "afk":
+            streaming.push(key)
+        added = build_phrase(self.folder, "afk")
+        streaming.rebuild(matcher.AbbreviationIndex([self.folder], list(self.folder.items)), "afk")
+        streaming.push(" ")
+        self.assertEqual(streaming.candidates(), ([], [added]))
+
+    def testRandomInput(self):
+        rng = random.Random(0)
+        letters = "abcABéÉσΣς"
+        for number in range(40):
+            abbreviations = ["".join(rng.choice(letters) for _ in range(rng.randint(1, 4)))
+                             for _ in range(rng.randint(1, 2))]
+            build_phrase(self.folder, *abbreviations, ignore_case=rng.random() < 0.5,
+                         immediate=rng.random() < 0.3, trigger_inside=rng.random() < 0.3)
+        self._typeAndCompare("".join(rng.choice(letters + " .\b") for _ in range(2000)))
+
+
+class AbbreviationIndexTest(unittest.TestCase):
+
+    def testFoldersAndItemsInConfigurationOrder(self):
+        folder = model.Folder("Folder")
+        folder.set_modes([model.TriggerMode.ABBREVIATION])
+        folder.add_abbreviation("xy")
+        second = build_phrase(folder, "y")
+        first = build_phrase(folder, "xy")
+        hotkey_only = model.Phrase("hotkey", "expansion")
+        index = matcher.AbbreviationIndex([folder], [hotkey_only, first, second])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.find_candidates("xy "), ([folder], [first, second]))
+        self.assertEqual(index.find_candidates("xy"), ([folder], [first, second]))
+        self.assertEqual(index.find_candidates("xy  "), ([], []))
+
+
+def build_hotkey_phrase(folder: model.Folder, modifiers, key, window_filter=None) -> model.Phrase:
+    phrase = model.Phrase("hotkey {}".format(len(folder.items)), "expansion")
+    phrase.set_modes([model.TriggerMode.HOTKEY])
+    phrase.set_hotkey(list(modifiers), key)
+    if window_filter is not None:
+        phrase.set_window_titles(window_filter)
+    folder.add_item(phrase)
+    return phrase
+
+
+class HotkeyTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = model.Folder("Folder")
+        self.combinations = [([], "a"), (["<ctrl>"], "a"), (["<ctrl>", "<shift>"], "a"), (["<alt>"], "b")]
+
+    def _assertMatchesCheckHotkey(self, table: matcher.HotkeyTable, items, window_info: WindowInfo=EDITOR):
+        """The table followed by check_hotkey() must find the same items, in the same order, as a full scan."""
+        for modifiers, key in self.combinations:
+            modifiers = sorted(modifiers)
+            expected = [item for item in items if item.check_hotkey(modifiers, key, window_info)]
+            global_hotkeys, candidates, folders = table.lookup(modifiers, key)
+            actual = [item for item in candidates if item.check_hotkey(modifiers, key, window_info)]
+            self.assertEqual(actual, expected, "Combination {!r} {!r}".format(modifiers, key))
+
+    def testLookup(self):
+        items = [build_hotkey_phrase(self.folder, modifiers, key) for modifiers, key in self.combinations * 2]
+        table = matcher.HotkeyTable([], items, [])
+        self.assertEqual(len(table), len(items))
+        self._assertMatchesCheckHotkey(table, items)
+        # The modifier order does not matter
+        self.assertEqual(table.lookup(["<shift>", "<ctrl>"], "a")[1], [items[2], items[6]])
+
+    def testWindowFilter(self):
+        terminal = build_hotkey_phrase(self.folder, ["<ctrl>"], "a", window_filter=r"terminal\..*")
+        everywhere = build_hotkey_phrase(self.folder, ["<ctrl>"], "a")
+        table = matcher.HotkeyTable([], [terminal, everywhere], [])
+        self._assertMatchesCheckHotkey(table, [terminal, everywhere], EDITOR)
+        self._assertMatchesCheckHotkey(table, [terminal, everywhere], TERMINAL)
+
+    def testKindsAreKeptApart(self):
+        item = build_hotkey_phrase(self.folder, ["<ctrl>"], "a")
+        folder = model.Folder("Hotkey folder")
+        folder.set_modes([model.TriggerMode.HOTKEY])
+        folder.set_hotkey(["<ctrl>"], "a")
+        table = matcher.HotkeyTable([], [item], [folder])
+        self.assertEqual(table.lookup(["<ctrl>"], "a"), ([], [item], [folder]))
+
+    def testAddRemoveAndCopy(self):
+        item = build_hotkey_phrase(self.folder, ["<ctrl>"], "a")
+        table = matcher.HotkeyTable([], [item], [])
+        copy = table.copy()
+        # The hotkey is changed in place, before the table is updated
+        item.set_hotkey(["<alt>"], "b")
+        copy.add(item)
+        self.assertEqual(copy.lookup(["<ctrl>"], "a")[1], [])
+        self.assertEqual(copy.lookup(["<alt>"], "b")[1], [item])
+        self.assertEqual(table.lookup(["<ctrl>"], "a")[1], [item])
+        copy.remove(item)
+        self.assertEqual(len(copy), 0)
+        self.assertEqual(copy.lookup(["<alt>"], "b")[1], [])
+
+    def testAddedItemsKeepConfigurationOrder(self):
+        first, second, third = (build_hotkey_phrase(self.folder, ["<ctrl>"], "a") for _ in range(3))
+        table = matcher.HotkeyTable([], [second], [])
+        ranks = {item: rank for rank, item in enumerate(self.folder.items)}
+        # A hotkey created by the user interface for an item coming first in the configuration
+        table.add(third, ranks)
+        table.add(first, ranks)
+        self.assertEqual(table.lookup(["<ctrl>"], "a")[1], [first, second, third])
+        self._assertMatchesCheckHotkey(table, self.folder.items)
+        # An item changing to a combination already in use is inserted at its position, too
+        other = build_hotkey_phrase(self.folder, ["<alt>"], "b")
+        table.add(other, ranks)
+        ranks[other] = -1
+        other.set_hotkey(["<ctrl>"], "a")
+        table.add(other, ranks)
+        self.assertEqual(table.lookup(["<ctrl>"], "a")[1], [other, first, second, third])
+        self.assertEqual(table.lookup(["<alt>"], "b")[1], [])
+        # Without ranks, the item is appended
+        table.add(first)
+        self.assertEqual(table.lookup(["<ctrl>"], "a")[1], [other, second, third, first])
+
+    def testItemsWithoutHotkeyModeAreNotAdded(self):
+        item = build_hotkey_phrase(self.folder, ["<ctrl>"], "a")
+        item.set_modes([model.TriggerMode.ABBREVIATION])
+        table = matcher.HotkeyTable([], [], [])
+        table.add(item)
+        self.assertEqual(len(table), 0)
+
+
+class WindowFilterCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = model.Folder("Folder")
+        self.terminal = build_phrase(self.folder, "ls", window_filter=r"terminal\..*")
+        self.everywhere = build_phrase(self.folder, "brb")
+        self.editor = build_phrase(self.folder, "fn", window_filter=r".*Editor")
+        self.entries = [self.terminal, self.everywhere, self.editor]
+
+    def _assertMatchesWindowFilters(self, cache: matcher.WindowFilterCache, entries, window_info: WindowInfo):
+        expected = [entry for entry in entries if entry._should_trigger_window_title(window_info)]
+        self.assertEqual(cache.filter(entries, window_info), expected)
+
+    def testFilter(self):
+        cache = matcher.WindowFilterCache(self.entries)
+        for window_info in (EDITOR, TERMINAL, EDITOR, WindowInfo(wm_title="", wm_class="")):
+            self._assertMatchesWindowFilters(cache, self.entries, window_info)
+            # The order of the given entries is kept
+            self._assertMatchesWindowFilters(cache, list(reversed(self.entries)), window_info)
+
+    def testInheritedFilter(self):
+        sub_folder = model.Folder("Terminal folder")
+        sub_folder.set_window_titles(r"terminal\..*")
+        sub_folder.set_filter_recursive(True)
+        self.folder.add_folder(sub_folder)
+        inherited = build_phrase(sub_folder, "cd")
+        cache = matcher.WindowFilterCache(self.entries + [sub_folder, inherited])
+        self.assertEqual(cache.filter([sub_folder, inherited], EDITOR), [])
+        self.assertEqual(cache.filter([sub_folder, inherited], TERMINAL), [sub_folder, inherited])
+
+    def testUnknownEntriesAreEvaluated(self):
+        cache = matcher.WindowFilterCache(self.entries)
+        added = build_phrase(self.folder, "cd", window_filter=r"terminal\..*")
+        self._assertMatchesWindowFilters(cache, self.entries + [added], EDITOR)
+        self._assertMatchesWindowFilters(cache, self.entries + [added], TERMINAL)
+
+    def testLeastRecentlyUsedWindowsAreEvicted(self):
+        cache = matcher.WindowFilterCache(self.entries, max_size=2)
+        windows = [WindowInfo(wm_title="Window {}".format(number), wm_class="editor.Editor") for number in range(3)]
+        cache.filter(self.entries, windows[0])
+        cache.filter(self.entries, windows[1])
+        # Using the first window again makes the second one the least recently used
+        cache.filter(self.entries, windows[0])
+        cache.filter(self.entries, windows[2])
+        self.assertEqual(len(cache), 2)
+        self.assertIn(windows[0], cache._eligible)
+        self.assertNotIn(windows[1], cache._eligible)
+        self._assertMatchesWindowFilters(cache, self.entries, windows[1])
@@ -0,0 +1,124 @@
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+import autokey.iomediator  # Imported first to resolve the circular import between configmanager and model.
+from autokey import model
+from autokey.interface import WindowInfo
+
+EDITOR = WindowInfo(wm_title="Document - Editor", wm_class="editor.Editor")
+TERMINAL = WindowInfo(wm_title="Shell - Terminal", wm_class="terminal.Terminal")
+
+
+def resolve_regex(window_filter, for_child=False):
+    """The applicable window filter, resolved by walking up the tree without using any cache."""
+    if window_filter.windowInfoRegex is not None:
+        if not for_child or window_filter.isRecursive:
+            return window_filter.windowInfoRegex
+    elif window_filter.parent is not None:
+        return resolve_regex(window_filter.parent, True)
+    return None
+
+
+def resolve_child_filter(window_filter) -> str:
+    if window_filter.isRecursive and window_filter.windowInfoRegex is not None:
+        return window_filter.windowInfoRegex.pattern
+    elif window_filter.parent is not None:
+        return resolve_child_filter(window_filter.parent)
+    return ""
+
+
+class WindowFilterCacheTest(unittest.TestCase):
+    """Changes anywhere in the folder tree must be reflected by the cached window filters of all descendants."""
+
+    def setUp(self):
+        self.root = model.Folder("Root")
+        self.sub_folder = model.Folder("Sub folder")
+        self.root.add_folder(self.sub_folder)
+        self.phrase = model.Phrase("Phrase", "expansion")
+        self.sub_folder.add_item(self.phrase)
+        self.other = model.Folder("Other")
+        self.other.set_window_titles(r"terminal\..*")
+        self.other.set_filter_recursive(True)
+        self.objects = [self.root, self.sub_folder, self.phrase, self.other]
+
+    def _assertFiltersResolved(self):
+        for window_filter in self.objects:
+            # Read twice, so that the second read is served from the cache
+            for _ in range(2):
+                for for_child in (False, True):
+                    self.assertIs(window_filter.get_applicable_regex(for_child),
+                                  resolve_regex(window_filter, for_child), window_filter)
+                self.assertEqual(window_filter.get_child_filter(), resolve_child_filter(window_filter))
+                for window_info in (EDITOR, TERMINAL):
+                    regex = resolve_regex(window_filter)
+                    expected = regex is None or bool(regex.match(window_info.wm_title) or
+                                                     regex.match(window_info.wm_class))
+                    self.assertEqual(window_filter._should_trigger_window_title(window_info), expected)
+
+    def testNoFilter(self):
+        self._assertFiltersResolved()
+
+    def testRecursiveFilterOfAncestor(self):
+        self._assertFiltersResolved()
+        self.root.set_window_titles(r".*Editor")
+        self._assertFiltersResolved()
+        self.root.set_filter_recursive(True)
+        self._assertFiltersResolved()
+        self.assertTrue(self.phrase._should_trigger_window_title(EDITOR))
+        self.assertFalse(self.phrase._should_trigger_window_title(TERMINAL))
+
+    def testFilterChanges(self):
+        self.sub_folder.set_window_titles(r".*Editor")
+        self.sub_folder.set_filter_recursive(True)
+        self._assertFiltersResolved()
+        self.sub_folder.set_window_titles(r"terminal\..*")
+        self._assertFiltersResolved()
+        self.sub_folder.set_filter_recursive(False)
+        self._assertFiltersResolved()
+        self.sub_folder.set_window_titles(None)
+        self._assertFiltersResolved()
+        self.phrase.set_window_titles(r".*Editor")
+        self._assertFiltersResolved()
+
+    def testMovedItems(self):
+        self.root.set_window_titles(r".*Editor")
+        self.root.set_filter_recursive(True)
+        self._assertFiltersResolved()
+        self.sub_folder.remove_item(self.phrase)
+        self.other.add_item(self.phrase)
+        self._assertFiltersResolved()
+        self.root.remove_folder(self.sub_folder)
+        self.other.add_folder(self.sub_folder)
+        self._assertFiltersResolved()
+        self.assertFalse(self.sub_folder._should_trigger_window_title(EDITOR))
+
+    def testInvalidationDuringResolve(self):
+        # The GUI thread changes a filter while the keypress thread resolves the filters of the phrase.
+        self._assertFiltersResolved()
+        resolve_applicable_regex = self.phrase._resolve_applicable_regex
+        resolve_child_filter_ = self.phrase._resolve_child_filter
+
+        def change_filter_after(resolve):
+            def resolve_and_change(*args):
+                result = resolve(*args)
+                self.sub_folder.set_window_titles(r".*Editor")
+                self.sub_folder.set_filter_recursive(True)
+                return result
+            return resolve_and_change
+
+        self.phrase._resolve_applicable_regex = change_filter_after(resolve_applicable_regex)
+        self.sub_folder._invalidate_filter_cache()
+        self.assertIsNone(self.phrase.get_applicable_regex())
+        del self.phrase._resolve_applicable_regex
+        self._assertFiltersResolved()
+        self.assertFalse(self.phrase._should_trigger_window_title(TERMINAL))
+
+        self.phrase._resolve_child_filter = change_filter_after(resolve_child_filter_)
+        self.sub_folder.set_window_titles(None)
+        self.assertEqual(self.phrase.get_child_filter(), "")
+        del self.phrase._resolve_child_filter
+        self._assertFiltersResolved()
+        self.assertEqual(self.phrase.get_child_filter(), ".*Editor")